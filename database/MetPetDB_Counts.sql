@@ -0,0 +1,146 @@
+-- Counters of the rows attached to each sample and subsample, kept current
+-- by the triggers below so the webservices read them instead of counting
+-- child rows.  The counters are filled from the existing rows at the end.
+--
+-- samples.subsample_count          subsamples of the sample
+-- samples.chemical_analysis_count  analyses of the subsamples of the sample
+-- samples.image_count              images with the sample_id of the sample
+-- subsamples.chemical_analysis_count
+-- subsamples.image_count
+--
+-- Contention: every insert, delete or move of a subsample, analysis or
+-- image updates the counters of its parent samples row (and subsamples
+-- row), which stays locked until the writing transaction ends.  Concurrent
+-- writers adding children to the same sample therefore run one after the
+-- other, and a long import holding a sample blocks edits of that sample
+-- until it commits; writes under different samples do not wait on each
+-- other.  Each child row costs one parent UPDATE, so a bulk load of n
+-- images of one sample updates its row n times; for large loads, drop the
+-- triggers and run the recount at the end of this script instead.
+
+ALTER TABLE samples ADD COLUMN subsample_count integer NOT NULL DEFAULT 0;
+ALTER TABLE samples ADD COLUMN chemical_analysis_count integer NOT NULL DEFAULT 0;
+ALTER TABLE samples ADD COLUMN image_count integer NOT NULL DEFAULT 0;
+ALTER TABLE subsamples ADD COLUMN chemical_analysis_count integer NOT NULL DEFAULT 0;
+ALTER TABLE subsamples ADD COLUMN image_count integer NOT NULL DEFAULT 0;
+
+-- subsamples: moving a subsample to another sample moves its analyses too
+
+CREATE OR REPLACE FUNCTION subsamples_count() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE samples
+        SET subsample_count = subsample_count - 1,
+            chemical_analysis_count = chemical_analysis_count - OLD.chemical_analysis_count
+        WHERE sample_id = OLD.sample_id ;
+    END IF ;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE samples
+        SET subsample_count = subsample_count + 1,
+            chemical_analysis_count = chemical_analysis_count + NEW.chemical_analysis_count
+        WHERE sample_id = NEW.sample_id ;
+    END IF ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+DROP TRIGGER IF EXISTS subsamples_count_trg ON subsamples;
+CREATE TRIGGER subsamples_count_trg
+AFTER INSERT OR DELETE OR UPDATE OF sample_id ON subsamples
+FOR EACH ROW EXECUTE PROCEDURE subsamples_count();
+
+-- chemical_analyses
+
+CREATE OR REPLACE FUNCTION chemical_analyses_count() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE subsamples
+        SET chemical_analysis_count = chemical_analysis_count - 1
+        WHERE subsample_id = OLD.subsample_id ;
+        UPDATE samples
+        SET chemical_analysis_count = chemical_analysis_count - 1
+        FROM subsamples
+        WHERE samples.sample_id = subsamples.sample_id AND
+              subsamples.subsample_id = OLD.subsample_id ;
+    END IF ;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE subsamples
+        SET chemical_analysis_count = chemical_analysis_count + 1
+        WHERE subsample_id = NEW.subsample_id ;
+        UPDATE samples
+        SET chemical_analysis_count = chemical_analysis_count + 1
+        FROM subsamples
+        WHERE samples.sample_id = subsamples.sample_id AND
+              subsamples.subsample_id = NEW.subsample_id ;
+    END IF ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+DROP TRIGGER IF EXISTS chemical_analyses_count_trg ON chemical_analyses;
+CREATE TRIGGER chemical_analyses_count_trg
+AFTER INSERT OR DELETE OR UPDATE OF subsample_id ON chemical_analyses
+FOR EACH ROW EXECUTE PROCEDURE chemical_analyses_count();
+
+-- images
+
+CREATE OR REPLACE FUNCTION images_count() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE samples
+        SET image_count = image_count - 1
+        WHERE sample_id = OLD.sample_id ;
+        UPDATE subsamples
+        SET image_count = image_count - 1
+        WHERE subsample_id = OLD.subsample_id ;
+    END IF ;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE samples
+        SET image_count = image_count + 1
+        WHERE sample_id = NEW.sample_id ;
+        UPDATE subsamples
+        SET image_count = image_count + 1
+        WHERE subsample_id = NEW.subsample_id ;
+    END IF ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+DROP TRIGGER IF EXISTS images_count_trg ON images;
+CREATE TRIGGER images_count_trg
+AFTER INSERT OR DELETE OR UPDATE OF sample_id, subsample_id ON images
+FOR EACH ROW EXECUTE PROCEDURE images_count();
+
+-- the counters change no column a search reads, so updating them must not
+-- move search_version_seq (MetPetDB_Triggers.sql) and retire the cached
+-- facets; run this script after MetPetDB_Triggers.sql
+
+DROP TRIGGER IF EXISTS samples_search_version_trg ON samples;
+CREATE CONSTRAINT TRIGGER samples_search_version_trg
+AFTER INSERT OR DELETE OR UPDATE OF sample_id, number, public_data, rock_type_id, user_id, country, location, location_text ON samples
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE search_version_bump();
+
+-- recount what is already there
+
+UPDATE subsamples SET
+    chemical_analysis_count = (SELECT COUNT(*) FROM chemical_analyses
+                               WHERE chemical_analyses.subsample_id = subsamples.subsample_id),
+    image_count = (SELECT COUNT(*) FROM images
+                   WHERE images.subsample_id = subsamples.subsample_id);
+
+UPDATE samples SET
+    subsample_count = (SELECT COUNT(*) FROM subsamples
+                       WHERE subsamples.sample_id = samples.sample_id),
+    chemical_analysis_count = (SELECT COALESCE(SUM(chemical_analysis_count), 0) FROM subsamples
+                               WHERE subsamples.sample_id = samples.sample_id),
+    image_count = (SELECT COUNT(*) FROM images
+                   WHERE images.sample_id = samples.sample_id);
+
+GRANT TRIGGER ON TABLE subsamples to metpetdb_dev;
+GRANT TRIGGER ON TABLE chemical_analyses to metpetdb_dev;
+GRANT TRIGGER ON TABLE images to metpetdb_dev;
+
+ALTER FUNCTION subsamples_count() OWNER TO metpetdb_dev;
+ALTER FUNCTION chemical_analyses_count() OWNER TO metpetdb_dev;
+ALTER FUNCTION images_count() OWNER TO metpetdb_dev;
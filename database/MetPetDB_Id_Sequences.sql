@@ -0,0 +1,72 @@
+-- Sequences handing out blocks of primary keys to tastyapi.utils.get_next_id.
+-- One nextval call reserves INCREMENT BY ids, which must match BLOCK_SIZE
+-- (or BLOCK_SIZES) in tastyapi/utils.py.  Each sequence starts after the
+-- largest id in use when this script runs.
+
+-- samples
+
+DROP SEQUENCE IF EXISTS samples_id_block_seq;
+CREATE SEQUENCE samples_id_block_seq INCREMENT BY 100;
+SELECT setval('samples_id_block_seq', (SELECT COALESCE(MAX(sample_id), 0) + 1 FROM samples), false);
+GRANT ALL PRIVILEGES ON samples_id_block_seq TO metpetdb_dev;
+
+-- subsamples
+
+DROP SEQUENCE IF EXISTS subsamples_id_block_seq;
+CREATE SEQUENCE subsamples_id_block_seq INCREMENT BY 100;
+SELECT setval('subsamples_id_block_seq', (SELECT COALESCE(MAX(subsample_id), 0) + 1 FROM subsamples), false);
+GRANT ALL PRIVILEGES ON subsamples_id_block_seq TO metpetdb_dev;
+
+-- regions
+
+DROP SEQUENCE IF EXISTS regions_id_block_seq;
+CREATE SEQUENCE regions_id_block_seq INCREMENT BY 1;
+SELECT setval('regions_id_block_seq', (SELECT COALESCE(MAX(region_id), 0) + 1 FROM regions), false);
+GRANT ALL PRIVILEGES ON regions_id_block_seq TO metpetdb_dev;
+
+-- reference
+
+DROP SEQUENCE IF EXISTS reference_id_block_seq;
+CREATE SEQUENCE reference_id_block_seq INCREMENT BY 100;
+SELECT setval('reference_id_block_seq', (SELECT COALESCE(MAX(reference_id), 0) + 1 FROM reference), false);
+GRANT ALL PRIVILEGES ON reference_id_block_seq TO metpetdb_dev;
+
+-- sample_regions
+
+DROP SEQUENCE IF EXISTS sample_regions_id_block_seq;
+CREATE SEQUENCE sample_regions_id_block_seq INCREMENT BY 100;
+SELECT setval('sample_regions_id_block_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM sample_regions), false);
+GRANT ALL PRIVILEGES ON sample_regions_id_block_seq TO metpetdb_dev;
+
+-- sample_reference
+
+DROP SEQUENCE IF EXISTS sample_reference_id_block_seq;
+CREATE SEQUENCE sample_reference_id_block_seq INCREMENT BY 100;
+SELECT setval('sample_reference_id_block_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM sample_reference), false);
+GRANT ALL PRIVILEGES ON sample_reference_id_block_seq TO metpetdb_dev;
+
+-- sample_minerals
+
+DROP SEQUENCE IF EXISTS sample_minerals_id_block_seq;
+CREATE SEQUENCE sample_minerals_id_block_seq INCREMENT BY 100;
+SELECT setval('sample_minerals_id_block_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM sample_minerals), false);
+GRANT ALL PRIVILEGES ON sample_minerals_id_block_seq TO metpetdb_dev;
+
+-- sample_metamorphic_grades
+
+DROP SEQUENCE IF EXISTS sample_metamorphic_grades_id_block_seq;
+CREATE SEQUENCE sample_metamorphic_grades_id_block_seq INCREMENT BY 100;
+SELECT setval('sample_metamorphic_grades_id_block_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM sample_metamorphic_grades), false);
+GRANT ALL PRIVILEGES ON sample_metamorphic_grades_id_block_seq TO metpetdb_dev;
+
+-- sample_metamorphic_regions
+
+DROP SEQUENCE IF EXISTS sample_metamorphic_regions_id_block_seq;
+CREATE SEQUENCE sample_metamorphic_regions_id_block_seq INCREMENT BY 100;
+SELECT setval('sample_metamorphic_regions_id_block_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM sample_metamorphic_regions), false);
+GRANT ALL PRIVILEGES ON sample_metamorphic_regions_id_block_seq TO metpetdb_dev;
+
+-- tastyapi_groupaccess draws its ids from its own serial column; move it
+-- past the ids that used to be assigned by hand.
+
+SELECT setval('tastyapi_groupaccess_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM tastyapi_groupaccess), false);
@@ -0,0 +1,194 @@
+-- page_version: stamp of the rows the cached webservices detail pages are
+-- keyed on (webservices/responsecache.py), moved by every change of a row a
+-- page shows, however it is made: Django, raw SQL, the counter triggers of
+-- MetPetDB_Counts.sql...
+--
+-- samples.page_version            sample page, subsamples page of the sample
+-- subsamples.page_version         subsample page, analyses page of the subsample
+-- chemical_analyses.page_version  chemical analysis page
+--
+-- The stamps come from a sequence, which never hands out a value twice, so
+-- a page cached by a transaction that is rolled back is never served.  The
+-- version column is left alone: the API compares it to detect edit
+-- conflicts, and a client must not see one because an alias was added.
+--
+-- A write to a child row updates its parent row, which stays locked until
+-- the writing transaction ends, as with the counters.
+
+DROP SEQUENCE IF EXISTS page_version_seq CASCADE;
+CREATE SEQUENCE page_version_seq;
+
+ALTER TABLE samples ADD COLUMN page_version bigint NOT NULL DEFAULT nextval('page_version_seq');
+ALTER TABLE subsamples ADD COLUMN page_version bigint NOT NULL DEFAULT nextval('page_version_seq');
+ALTER TABLE chemical_analyses ADD COLUMN page_version bigint NOT NULL DEFAULT nextval('page_version_seq');
+
+-- any update of a row stamps it, unless the update sets page_version itself
+
+CREATE OR REPLACE FUNCTION page_version_stamp() RETURNS trigger AS $$
+BEGIN
+    NEW.page_version := nextval('page_version_seq') ;
+    RETURN NEW ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+DROP TRIGGER IF EXISTS samples_page_version_trg ON samples;
+CREATE TRIGGER samples_page_version_trg
+BEFORE UPDATE ON samples
+FOR EACH ROW WHEN (NEW.page_version = OLD.page_version)
+EXECUTE PROCEDURE page_version_stamp();
+
+DROP TRIGGER IF EXISTS subsamples_page_version_trg ON subsamples;
+CREATE TRIGGER subsamples_page_version_trg
+BEFORE UPDATE ON subsamples
+FOR EACH ROW WHEN (NEW.page_version = OLD.page_version)
+EXECUTE PROCEDURE page_version_stamp();
+
+DROP TRIGGER IF EXISTS chemical_analyses_page_version_trg ON chemical_analyses;
+CREATE TRIGGER chemical_analyses_page_version_trg
+BEFORE UPDATE ON chemical_analyses
+FOR EACH ROW WHEN (NEW.page_version = OLD.page_version)
+EXECUTE PROCEDURE page_version_stamp();
+
+-- child rows stamp their parents
+
+CREATE OR REPLACE FUNCTION sample_page_version_bump() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE samples SET page_version = nextval('page_version_seq')
+        WHERE sample_id = NEW.sample_id ;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE samples SET page_version = nextval('page_version_seq')
+        WHERE sample_id IN (OLD.sample_id, NEW.sample_id) ;
+    ELSE
+        UPDATE samples SET page_version = nextval('page_version_seq')
+        WHERE sample_id = OLD.sample_id ;
+    END IF ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+CREATE OR REPLACE FUNCTION subsample_page_version_bump() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE subsamples SET page_version = nextval('page_version_seq')
+        WHERE subsample_id = NEW.subsample_id ;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE subsamples SET page_version = nextval('page_version_seq')
+        WHERE subsample_id IN (OLD.subsample_id, NEW.subsample_id) ;
+    ELSE
+        UPDATE subsamples SET page_version = nextval('page_version_seq')
+        WHERE subsample_id = OLD.subsample_id ;
+    END IF ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+CREATE OR REPLACE FUNCTION chemical_analysis_page_version_bump() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE chemical_analyses SET page_version = nextval('page_version_seq')
+        WHERE chemical_analysis_id = NEW.chemical_analysis_id ;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE chemical_analyses SET page_version = nextval('page_version_seq')
+        WHERE chemical_analysis_id IN (OLD.chemical_analysis_id, NEW.chemical_analysis_id) ;
+    ELSE
+        UPDATE chemical_analyses SET page_version = nextval('page_version_seq')
+        WHERE chemical_analysis_id = OLD.chemical_analysis_id ;
+    END IF ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+-- the lists of a sample; moving a row to another sample stamps both
+
+DROP TRIGGER IF EXISTS sample_aliases_page_version_trg ON sample_aliases;
+CREATE TRIGGER sample_aliases_page_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_aliases
+FOR EACH ROW EXECUTE PROCEDURE sample_page_version_bump();
+
+DROP TRIGGER IF EXISTS sample_minerals_page_version_trg ON sample_minerals;
+CREATE TRIGGER sample_minerals_page_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_minerals
+FOR EACH ROW EXECUTE PROCEDURE sample_page_version_bump();
+
+DROP TRIGGER IF EXISTS sample_regions_page_version_trg ON sample_regions;
+CREATE TRIGGER sample_regions_page_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_regions
+FOR EACH ROW EXECUTE PROCEDURE sample_page_version_bump();
+
+DROP TRIGGER IF EXISTS sample_metamorphic_regions_page_version_trg ON sample_metamorphic_regions;
+CREATE TRIGGER sample_metamorphic_regions_page_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_metamorphic_regions
+FOR EACH ROW EXECUTE PROCEDURE sample_page_version_bump();
+
+DROP TRIGGER IF EXISTS sample_metamorphic_grades_page_version_trg ON sample_metamorphic_grades;
+CREATE TRIGGER sample_metamorphic_grades_page_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_metamorphic_grades
+FOR EACH ROW EXECUTE PROCEDURE sample_page_version_bump();
+
+DROP TRIGGER IF EXISTS sample_reference_page_version_trg ON sample_reference;
+CREATE TRIGGER sample_reference_page_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_reference
+FOR EACH ROW EXECUTE PROCEDURE sample_page_version_bump();
+
+-- Subsamples, analyses and images: inserting, deleting or moving one already
+-- updates its parents through the counters of MetPetDB_Counts.sql, which
+-- stamps them, so only the updates leaving the parent alone are left.
+
+DROP TRIGGER IF EXISTS subsamples_sample_page_version_trg ON subsamples;
+CREATE TRIGGER subsamples_sample_page_version_trg
+AFTER UPDATE ON subsamples
+FOR EACH ROW WHEN (NEW.sample_id = OLD.sample_id)
+EXECUTE PROCEDURE sample_page_version_bump();
+
+DROP TRIGGER IF EXISTS images_sample_page_version_trg ON images;
+CREATE TRIGGER images_sample_page_version_trg
+AFTER UPDATE ON images
+FOR EACH ROW WHEN (NEW.sample_id IS NOT DISTINCT FROM OLD.sample_id AND
+                   NEW.subsample_id IS NOT DISTINCT FROM OLD.subsample_id)
+EXECUTE PROCEDURE sample_page_version_bump();
+
+DROP TRIGGER IF EXISTS images_subsample_page_version_trg ON images;
+CREATE TRIGGER images_subsample_page_version_trg
+AFTER UPDATE ON images
+FOR EACH ROW WHEN (NEW.sample_id IS NOT DISTINCT FROM OLD.sample_id AND
+                   NEW.subsample_id IS NOT DISTINCT FROM OLD.subsample_id)
+EXECUTE PROCEDURE subsample_page_version_bump();
+
+DROP TRIGGER IF EXISTS chemical_analyses_subsample_page_version_trg ON chemical_analyses;
+CREATE TRIGGER chemical_analyses_subsample_page_version_trg
+AFTER UPDATE ON chemical_analyses
+FOR EACH ROW WHEN (NEW.subsample_id = OLD.subsample_id)
+EXECUTE PROCEDURE subsample_page_version_bump();
+
+-- the elements and oxides of an analysis
+
+DROP TRIGGER IF EXISTS chemical_analysis_elements_page_version_trg ON chemical_analysis_elements;
+CREATE TRIGGER chemical_analysis_elements_page_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON chemical_analysis_elements
+FOR EACH ROW EXECUTE PROCEDURE chemical_analysis_page_version_bump();
+
+DROP TRIGGER IF EXISTS chemical_analysis_oxides_page_version_trg ON chemical_analysis_oxides;
+CREATE TRIGGER chemical_analysis_oxides_page_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON chemical_analysis_oxides
+FOR EACH ROW EXECUTE PROCEDURE chemical_analysis_page_version_bump();
+
+GRANT SELECT, UPDATE ON SEQUENCE page_version_seq to metpetdb_dev;
+
+GRANT TRIGGER ON TABLE samples to metpetdb_dev;
+GRANT TRIGGER ON TABLE subsamples to metpetdb_dev;
+GRANT TRIGGER ON TABLE chemical_analyses to metpetdb_dev;
+GRANT TRIGGER ON TABLE images to metpetdb_dev;
+GRANT TRIGGER ON TABLE sample_aliases to metpetdb_dev;
+GRANT TRIGGER ON TABLE sample_minerals to metpetdb_dev;
+GRANT TRIGGER ON TABLE sample_regions to metpetdb_dev;
+GRANT TRIGGER ON TABLE sample_metamorphic_regions to metpetdb_dev;
+GRANT TRIGGER ON TABLE sample_metamorphic_grades to metpetdb_dev;
+GRANT TRIGGER ON TABLE sample_reference to metpetdb_dev;
+GRANT TRIGGER ON TABLE chemical_analysis_elements to metpetdb_dev;
+GRANT TRIGGER ON TABLE chemical_analysis_oxides to metpetdb_dev;
+
+ALTER FUNCTION page_version_stamp() OWNER TO metpetdb_dev;
+ALTER FUNCTION sample_page_version_bump() OWNER TO metpetdb_dev;
+ALTER FUNCTION subsample_page_version_bump() OWNER TO metpetdb_dev;
+ALTER FUNCTION chemical_analysis_page_version_bump() OWNER TO metpetdb_dev;
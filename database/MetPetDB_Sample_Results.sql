@@ -0,0 +1,183 @@
+-- full_sample_results_mat: the rows of the full_sample_results view stored
+-- in an indexed table, which webservices.SampleQuery reads instead of the
+-- view once this script has run.
+--
+-- The rows of a sample are rebuilt from the view by the triggers below
+-- whenever the sample or one of its lists changes, so the table follows
+-- every edit without a full refresh.  The row triggers only queue the ids
+-- of the changed samples; a trigger run once at the end of the statement
+-- rebuilds each queued sample once, however many of its rows the statement
+-- wrote, with one DELETE and one INSERT for all of them.  Renaming a vocabulary entry (a
+-- mineral, region, user, reference...) is not followed; run
+--
+--     SELECT full_sample_results_refresh();
+--
+-- afterwards.  The refresh replaces the rows in a single transaction, so
+-- searches keep reading the previous rows until it commits.
+
+DROP TABLE IF EXISTS full_sample_results_mat;
+CREATE TABLE full_sample_results_mat AS SELECT * FROM full_sample_results;
+
+CREATE INDEX full_sample_results_mat_sample_id_idx ON full_sample_results_mat (sample_id);
+CREATE INDEX full_sample_results_mat_public_data_idx ON full_sample_results_mat (public_data);
+CREATE INDEX full_sample_results_mat_rock_type_id_idx ON full_sample_results_mat (rock_type_id);
+CREATE INDEX full_sample_results_mat_owner_id_idx ON full_sample_results_mat (owner_id);
+CREATE INDEX full_sample_results_mat_country_idx ON full_sample_results_mat (country);
+CREATE INDEX full_sample_results_mat_sample_mineral_id_idx ON full_sample_results_mat (sample_mineral_id);
+CREATE INDEX full_sample_results_mat_sample_region_id_idx ON full_sample_results_mat (sample_region_id);
+CREATE INDEX full_sample_results_mat_sample_metamorphic_grade_id_idx ON full_sample_results_mat (sample_metamorphic_grade_id);
+CREATE INDEX full_sample_results_mat_sample_metamorphic_region_id_idx ON full_sample_results_mat (sample_metamorphic_region_id);
+CREATE INDEX full_sample_results_mat_publication_id_idx ON full_sample_results_mat (publication_id);
+
+ANALYZE full_sample_results_mat;
+
+-- samples to rebuild at the end of the running statement; the rows are
+-- deleted by the statement that queued them, so none is ever committed and
+-- the table needs no WAL
+DROP TABLE IF EXISTS full_sample_results_pending;
+CREATE UNLOGGED TABLE full_sample_results_pending (sample_id bigint NOT NULL);
+
+-- rebuilding the rows of one sample, or of all of them
+
+CREATE OR REPLACE FUNCTION full_sample_results_refresh_sample(id bigint) RETURNS void AS $$
+BEGIN
+    DELETE FROM full_sample_results_mat WHERE sample_id = id ;
+    INSERT INTO full_sample_results_mat
+    SELECT * FROM full_sample_results WHERE sample_id = id ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+CREATE OR REPLACE FUNCTION full_sample_results_refresh() RETURNS void AS $$
+BEGIN
+    DELETE FROM full_sample_results_mat ;
+    INSERT INTO full_sample_results_mat SELECT * FROM full_sample_results ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+-- rows of samples and of the tables holding their lists: the row triggers
+-- queue the samples, the statement triggers rebuild them
+
+CREATE OR REPLACE FUNCTION full_sample_results_queue() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO full_sample_results_pending VALUES (NEW.sample_id) ;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO full_sample_results_pending VALUES (OLD.sample_id) ;
+    ELSE
+        INSERT INTO full_sample_results_pending VALUES (OLD.sample_id) ;
+        IF NEW.sample_id IS DISTINCT FROM OLD.sample_id THEN
+            INSERT INTO full_sample_results_pending VALUES (NEW.sample_id) ;
+        END IF ;
+    END IF ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+-- Takes the queued rows this transaction can see, which are only its own
+-- since no queued row is committed: concurrent statements do not wait on
+-- each other.  A statement run by a trigger of another statement may
+-- rebuild samples the outer statement queued so far; those it queues later
+-- are rebuilt again at its end.
+CREATE OR REPLACE FUNCTION full_sample_results_flush() RETURNS trigger AS $$
+DECLARE
+    ids bigint[] ;
+BEGIN
+    SELECT array_agg(DISTINCT sample_id) INTO ids
+    FROM full_sample_results_pending ;
+    IF ids IS NOT NULL THEN
+        DELETE FROM full_sample_results_pending WHERE sample_id = ANY(ids) ;
+        DELETE FROM full_sample_results_mat WHERE sample_id = ANY(ids) ;
+        INSERT INTO full_sample_results_mat
+        SELECT * FROM full_sample_results WHERE sample_id = ANY(ids) ;
+    END IF ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+-- only the columns the view reads, so updating the counters kept by
+-- MetPetDB_Counts.sql does not rebuild anything
+DROP TRIGGER IF EXISTS samples_full_sample_results_trg ON samples;
+CREATE TRIGGER samples_full_sample_results_trg
+AFTER INSERT OR DELETE OR UPDATE OF sample_id, number, public_data, rock_type_id, user_id, country, location, location_text ON samples
+FOR EACH ROW EXECUTE PROCEDURE full_sample_results_queue();
+
+DROP TRIGGER IF EXISTS samples_full_sample_results_flush_trg ON samples;
+CREATE TRIGGER samples_full_sample_results_flush_trg
+AFTER INSERT OR DELETE OR UPDATE OF sample_id, number, public_data, rock_type_id, user_id, country, location, location_text ON samples
+FOR EACH STATEMENT EXECUTE PROCEDURE full_sample_results_flush();
+
+DROP TRIGGER IF EXISTS denorm_sample_minerals_full_sample_results_trg ON denorm_sample_minerals;
+CREATE TRIGGER denorm_sample_minerals_full_sample_results_trg
+AFTER INSERT OR UPDATE OR DELETE ON denorm_sample_minerals
+FOR EACH ROW EXECUTE PROCEDURE full_sample_results_queue();
+
+DROP TRIGGER IF EXISTS denorm_sample_minerals_full_sample_results_flush_trg ON denorm_sample_minerals;
+CREATE TRIGGER denorm_sample_minerals_full_sample_results_flush_trg
+AFTER INSERT OR UPDATE OR DELETE ON denorm_sample_minerals
+FOR EACH STATEMENT EXECUTE PROCEDURE full_sample_results_flush();
+
+DROP TRIGGER IF EXISTS sample_metamorphic_grades_full_sample_results_trg ON sample_metamorphic_grades;
+CREATE TRIGGER sample_metamorphic_grades_full_sample_results_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_metamorphic_grades
+FOR EACH ROW EXECUTE PROCEDURE full_sample_results_queue();
+
+DROP TRIGGER IF EXISTS sample_metamorphic_grades_full_sample_results_flush_trg ON sample_metamorphic_grades;
+CREATE TRIGGER sample_metamorphic_grades_full_sample_results_flush_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_metamorphic_grades
+FOR EACH STATEMENT EXECUTE PROCEDURE full_sample_results_flush();
+
+DROP TRIGGER IF EXISTS sample_metamorphic_regions_full_sample_results_trg ON sample_metamorphic_regions;
+CREATE TRIGGER sample_metamorphic_regions_full_sample_results_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_metamorphic_regions
+FOR EACH ROW EXECUTE PROCEDURE full_sample_results_queue();
+
+DROP TRIGGER IF EXISTS sample_metamorphic_regions_full_sample_results_flush_trg ON sample_metamorphic_regions;
+CREATE TRIGGER sample_metamorphic_regions_full_sample_results_flush_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_metamorphic_regions
+FOR EACH STATEMENT EXECUTE PROCEDURE full_sample_results_flush();
+
+DROP TRIGGER IF EXISTS sample_minerals_full_sample_results_trg ON sample_minerals;
+CREATE TRIGGER sample_minerals_full_sample_results_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_minerals
+FOR EACH ROW EXECUTE PROCEDURE full_sample_results_queue();
+
+DROP TRIGGER IF EXISTS sample_minerals_full_sample_results_flush_trg ON sample_minerals;
+CREATE TRIGGER sample_minerals_full_sample_results_flush_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_minerals
+FOR EACH STATEMENT EXECUTE PROCEDURE full_sample_results_flush();
+
+DROP TRIGGER IF EXISTS sample_reference_full_sample_results_trg ON sample_reference;
+CREATE TRIGGER sample_reference_full_sample_results_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_reference
+FOR EACH ROW EXECUTE PROCEDURE full_sample_results_queue();
+
+DROP TRIGGER IF EXISTS sample_reference_full_sample_results_flush_trg ON sample_reference;
+CREATE TRIGGER sample_reference_full_sample_results_flush_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_reference
+FOR EACH STATEMENT EXECUTE PROCEDURE full_sample_results_flush();
+
+DROP TRIGGER IF EXISTS sample_regions_full_sample_results_trg ON sample_regions;
+CREATE TRIGGER sample_regions_full_sample_results_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_regions
+FOR EACH ROW EXECUTE PROCEDURE full_sample_results_queue();
+
+DROP TRIGGER IF EXISTS sample_regions_full_sample_results_flush_trg ON sample_regions;
+CREATE TRIGGER sample_regions_full_sample_results_flush_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_regions
+FOR EACH STATEMENT EXECUTE PROCEDURE full_sample_results_flush();
+
+-- replaced by the two functions above
+DROP FUNCTION IF EXISTS full_sample_results_sync();
+
+GRANT SELECT ON TABLE full_sample_results_mat to metpetdb_dev;
+GRANT INSERT, DELETE ON TABLE full_sample_results_mat to metpetdb_dev;
+GRANT TRIGGER ON TABLE samples to metpetdb_dev;
+GRANT TRIGGER ON TABLE denorm_sample_minerals to metpetdb_dev;
+
+GRANT SELECT, INSERT, DELETE ON TABLE full_sample_results_pending to metpetdb_dev;
+ALTER TABLE full_sample_results_mat OWNER TO metpetdb_dev;
+ALTER TABLE full_sample_results_pending OWNER TO metpetdb_dev;
+ALTER FUNCTION full_sample_results_refresh_sample(bigint) OWNER TO metpetdb_dev;
+ALTER FUNCTION full_sample_results_refresh() OWNER TO metpetdb_dev;
+ALTER FUNCTION full_sample_results_queue() OWNER TO metpetdb_dev;
+ALTER FUNCTION full_sample_results_flush() OWNER TO metpetdb_dev;
@@ -147,3 +147,61 @@ ALTER FUNCTION sample_metamorphic_regions_sync() OWNER TO metpetdb_dev;
 ALTER FUNCTION sample_minerals_sync() OWNER TO metpetdb_dev;
 ALTER FUNCTION sample_reference_sync() OWNER TO metpetdb_dev;
 ALTER FUNCTION sample_regions_sync() OWNER TO metpetdb_dev;
+
+
+-- search_version_seq: counter moved by every change that can alter a
+-- sample search, facet counts cached by the webservices are keyed on its
+-- last_value.  A sequence takes no row lock, so writers do not wait on each
+-- other; the triggers are deferred so the counter moves when the writing
+-- transaction commits, and a search reading the old rows before then
+-- caches them under the old value.
+
+DROP TABLE IF EXISTS search_version;
+DROP SEQUENCE IF EXISTS search_version_seq;
+CREATE SEQUENCE search_version_seq;
+
+CREATE OR REPLACE FUNCTION search_version_bump() RETURNS trigger AS $$
+BEGIN
+    PERFORM nextval('search_version_seq') ;
+    RETURN NULL ;
+END ;
+$$ LANGUAGE 'plpgsql';
+
+DROP TRIGGER IF EXISTS samples_search_version_trg ON samples;
+CREATE CONSTRAINT TRIGGER samples_search_version_trg
+AFTER INSERT OR DELETE OR UPDATE OF sample_id, number, public_data, rock_type_id, user_id, country, location, location_text ON samples
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE search_version_bump();
+
+DROP TRIGGER IF EXISTS sample_metamorphic_grades_search_version_trg ON sample_metamorphic_grades;
+CREATE CONSTRAINT TRIGGER sample_metamorphic_grades_search_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_metamorphic_grades
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE search_version_bump();
+
+DROP TRIGGER IF EXISTS sample_metamorphic_regions_search_version_trg ON sample_metamorphic_regions;
+CREATE CONSTRAINT TRIGGER sample_metamorphic_regions_search_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_metamorphic_regions
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE search_version_bump();
+
+DROP TRIGGER IF EXISTS sample_minerals_search_version_trg ON sample_minerals;
+CREATE CONSTRAINT TRIGGER sample_minerals_search_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_minerals
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE search_version_bump();
+
+DROP TRIGGER IF EXISTS sample_reference_search_version_trg ON sample_reference;
+CREATE CONSTRAINT TRIGGER sample_reference_search_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_reference
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE search_version_bump();
+
+DROP TRIGGER IF EXISTS sample_regions_search_version_trg ON sample_regions;
+CREATE CONSTRAINT TRIGGER sample_regions_search_version_trg
+AFTER INSERT OR UPDATE OR DELETE ON sample_regions
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE search_version_bump();
+
+GRANT SELECT, UPDATE ON SEQUENCE search_version_seq to metpetdb_dev;
+ALTER FUNCTION search_version_bump() OWNER TO metpetdb_dev;
@@ -1,26 +1,112 @@
+import hashlib
+import os
+import re
+
+import simplejson as sj
 from django.conf import settings
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import get_models
 from django_nose import NoseTestSuiteRunner
 
+# Fixture files, named after the tables they fill, in loading order
+FIXTURE_TABLES = ["users", "users_roles", "admin_users", "rock_type", \
+    "regions", "samples", "image_format", "image_type", "subsample_type", \
+    "subsamples", "images", "reference", "image_reference", \
+    "image_comments", "grids", "image_on_grid", "minerals", \
+    "mineral_types", "chemical_analyses", "elements", \
+    "chemical_analysis_elements", "element_mineral_types", \
+    "geometry_columns", "georeference", "mineral_relationships", \
+    "oxides", "oxide_mineral_types", "chemical_analysis_oxides", \
+    "metamorphic_grades", "metamorphic_regions", "projects", \
+    "project_invites", "project_members", "project_samples", \
+    "roles", "role_changes", "sample_aliases", \
+    "sample_comments", "sample_metamorphic_grades", \
+    "sample_metamorphic_regions", "sample_minerals", \
+    "sample_reference", "sample_regions", "spatial_ref_sys",\
+    "uploaded_files", "xray_image"]
+
+# Scripts of database/ run once the fixtures are loaded, in this order
+SQL_SCRIPTS = ["MetPetDB_Triggers.sql", "MetPetDB_Id_Sequences.sql",
+    "MetPetDB_Counts.sql", "MetPetDB_Sample_Results.sql",
+    "MetPetDB_Page_Versions.sql"]
+
+# Statements of the scripts granting to or handing objects over to the
+# metpetdb_dev role, which the test database does not have
+ROLE_STATEMENT = re.compile(r'^\s*(GRANT\b|ALTER\b.*\bOWNER TO\b)', re.I)
+
+# Rows per INSERT statement
+INSERT_BATCH_SIZE = 1000
+
+# Database holding a copy of the loaded test database
+DEFAULT_TEMPLATE_DB = 'metpetdb_test_template'
+
+# The fixtures, parsed once per process
+_fixtures = None
+
+class UnitTestSuiteRunner(NoseTestSuiteRunner):
+    """Test runner creating no database, for tests that do not use one."""
+    def setup_databases(self, **kwargs):
+        return None
+
+    def teardown_databases(self, old_config, **kwargs):
+        pass
+
 class CustomTestSuiteRunner(NoseTestSuiteRunner):
-    def setup_databases(self):
-        #from django.db import connection as con
+    """Test runner loading the MetPetDB schema, fixtures and scripts.
 
-        result = super(CustomTestSuiteRunner, self).setup_databases()
-        connections = result[0]
-        connection = connections[0][0]
+    The schema is loaded into the empty test database before syncdb, which
+    then only creates the tables of the models the schema lacks.  The
+    fixtures follow, then the scripts of database/ (SQL_SCRIPTS) without
+    their GRANT and OWNER TO statements.
 
-        cursor = connection.cursor()
+    The first run copies the loaded test database to the template database
+    named by settings.FIXTURE_TEMPLATE_DB (metpetdb_test_template by
+    default).  Later runs create the test database from the template with
+    CREATE DATABASE ... TEMPLATE, until the models, the schema or the
+    fixtures change and the template is built again.  Set the setting to
+    None to load everything on every run.
+    """
+    def setup_databases(self, **kwargs):
+        template = getattr(settings, 'FIXTURE_TEMPLATE_DB',
+                           DEFAULT_TEMPLATE_DB)
+        if template:
+            result = self._clone_template(template)
+            if result is not None:
+                return result
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        create_test_db = connection.creation._create_test_db
+
+        def create_schema(verbosity, autoclobber):
+            test_name = create_test_db(verbosity, autoclobber)
+            self._load_schema(connection, test_name)
+            return test_name
+
+        connection.creation._create_test_db = create_schema
+        try:
+            result = super(CustomTestSuiteRunner, self).setup_databases(
+                **kwargs)
+        finally:
+            del connection.creation._create_test_db
+        old_connections = result[0]
 
-        cursor.execute(self._get_create_queries())
+        cursor = connection.cursor()
 
         for query in self._get_insert_queries():
             cursor.execute(query)
 
+        for query in self._get_script_queries():
+            cursor.execute(query)
+
+        if template:
+            transaction.commit_unless_managed(using=connection.alias)
+            self._save_template(connection, old_connections[0][1], template)
+
         return result
 
     def _get_create_queries(self):
-        import os
-
         fname = os.path.join(settings.FIXTURES_DIR, 'db_creation_routine.sql')
 
         f = open(fname)
@@ -28,50 +114,180 @@ class CustomTestSuiteRunner(NoseTestSuiteRunner):
 
         return query
 
-    def _get_insert_queries(self):
-        import os
-        import simplejson as sj
-
-        db_tables = ["users", "users_roles", "admin_users", "rock_type", \
-            "regions", "samples", "image_format", "image_type", "subsample_type", \
-            "subsamples", "images", "reference", "image_reference", \
-            "image_comments", "grids", "image_on_grid", "minerals", \
-            "mineral_types", "chemical_analyses", "elements", \
-            "chemical_analysis_elements", "element_mineral_types", \
-            "geometry_columns", "georeference", "mineral_relationships", \
-            "oxides", "oxide_mineral_types", "chemical_analysis_oxides", \
-            "metamorphic_grades", "metamorphic_regions", "projects", \
-            "project_invites", "project_members", "project_samples", \
-            "roles", "role_changes", "sample_aliases", \
-            "sample_comments", "sample_metamorphic_grades", \
-            "sample_metamorphic_regions", "sample_minerals", \
-            "sample_reference", "sample_regions", "spatial_ref_sys",\
-            "uploaded_files", "xray_image"]
+    def _load_schema(self, connection, test_name):
+        """Run the schema in the new, still empty test database."""
+        old_name = connection.settings_dict['NAME']
+        connection.close()
+        connection.settings_dict['NAME'] = test_name
+        try:
+            cursor = connection.cursor()
+            cursor.execute(self._get_create_queries())
+            transaction.commit_unless_managed(using=connection.alias)
+        finally:
+            connection.close()
+            connection.settings_dict['NAME'] = old_name
 
+    def _get_script_queries(self):
+        """Return the scripts of SQL_SCRIPTS, without the statements
+        naming the metpetdb_dev role."""
         queries = []
-        for db_tablename in db_tables:
-            fname = os.path.join(settings.FIXTURES_DIR, db_tablename + '.txt')
+        for script in SQL_SCRIPTS:
+            f = open(os.path.join(settings.PROJECT_DIR, 'database', script))
+            lines = [line for line in f.read().splitlines()
+                     if not ROLE_STATEMENT.match(line)]
+            f.close()
+            queries.append("\n".join(lines))
+        return queries
 
-            f = open(fname)
+    def _get_fixtures(self):
+        """Return the fixtures as (table name, rows) pairs in loading order.
 
-            line = f.read()
-            line = line.strip("\n")
+        The values of the rows are SQL expressions.
+        """
+        global _fixtures
+        if _fixtures is None:
+            _fixtures = []
+            for db_tablename in FIXTURE_TABLES:
+                fname = os.path.join(settings.FIXTURES_DIR,
+                                     db_tablename + '.txt')
 
-            print "Loading {}...".format(fname)
-            data_val = sj.loads(line)
+                f = open(fname)
 
-            for table in data_val:
+                line = f.read()
+                line = line.strip("\n")
 
-                table_name = table['table_name']
+                if self.verbosity >= 2:
+                    print "Loading {}...".format(fname)
+                data_val = sj.loads(line)
 
-                for tuple in table['values']:
-                    line = "insert into %s(" %table_name
-                    for attr in sorted(tuple.keys()):
-                        line += attr + ","
-                    line = line.strip(",") + ") values ("
-                    for attr in sorted(tuple.keys()):
-                        line += tuple[attr] + ","
-                    line = line.strip(",") + ");"
-                    queries.append(line)
+                for table in data_val:
+                    _fixtures.append((table['table_name'], table['values']))
+        return _fixtures
+
+    def _get_insert_queries(self):
+        """Return multi-row INSERTs loading the fixtures.
+
+        Consecutive rows of a table giving the same columns are inserted
+        together, INSERT_BATCH_SIZE rows at a time, so rows keep their
+        order.
+        """
+        queries = []
+        for table_name, rows in self._get_fixtures():
+            groups = []
+            for row in rows:
+                columns = tuple(sorted(row.keys()))
+                if not groups or groups[-1][0] != columns or \
+                   len(groups[-1][1]) == INSERT_BATCH_SIZE:
+                    groups.append((columns, []))
+                groups[-1][1].append(
+                    "(" + ",".join(row[attr] for attr in columns) + ")")
+            for columns, values in groups:
+                queries.append("insert into %s(%s) values %s;"
+                               % (table_name, ",".join(columns),
+                                  ",".join(values)))
 
         return queries
+
+    def _get_model_queries(self, connection):
+        """Return the statements syncdb runs for the models.
+
+        These are the tables, including those of many-to-many fields, their
+        foreign keys, indexes and the custom SQL of the apps, as they would
+        be created in an empty database.
+        """
+        creation = connection.creation
+        style = no_style()
+        queries = []
+        pending_references = {}
+        models = get_models(include_auto_created=True)
+        for model in models:
+            output, references = creation.sql_create_model(model, style)
+            queries.extend(output)
+            for refto, refs in references.items():
+                pending_references.setdefault(refto, []).extend(refs)
+        for model in models:
+            queries.extend(creation.sql_for_pending_references(
+                model, style, pending_references))
+        for model in models:
+            queries.extend(creation.sql_indexes_for_model(model, style))
+            queries.extend(custom_sql_for_model(model, style, connection))
+        return queries
+
+    def _get_fingerprint(self, connection):
+        """Hash of every SQL input the loaded database is built from: the
+        statements of the models, the schema, the fixtures with the way
+        they are batched, and the scripts."""
+        digest = hashlib.md5()
+        for query in self._get_model_queries(connection):
+            digest.update(query.encode('utf-8'))
+        digest.update(self._get_create_queries())
+        digest.update(str(INSERT_BATCH_SIZE))
+        for db_tablename in FIXTURE_TABLES:
+            digest.update(db_tablename)
+            f = open(os.path.join(settings.FIXTURES_DIR,
+                                  db_tablename + '.txt'))
+            digest.update(f.read())
+            f.close()
+        for script, query in zip(SQL_SCRIPTS, self._get_script_queries()):
+            digest.update(script)
+            digest.update(query)
+        return digest.hexdigest()
+
+    def _clone_template(self, template):
+        """Create the test database from template if it is up to date.
+
+        Returns what setup_databases returns, or None when the template is
+        missing or out of date.
+        """
+        connection = connections[DEFAULT_DB_ALIAS]
+        qn = connection.ops.quote_name
+        old_name = connection.settings_dict['NAME']
+        test_name = connection.creation._get_test_db_name()
+        # Connected to the original database, as Django does to create the
+        # test database
+        cursor = connection.cursor()
+        connection.creation._prepare_for_test_db_ddl()
+        cursor.execute("SELECT shobj_description(oid, 'pg_database') "
+                       "FROM pg_database WHERE datname = %s", [template])
+        row = cursor.fetchone()
+        if row is None or row[0] != self._get_fingerprint(connection):
+            connection.close()
+            return None
+        if self.verbosity >= 1:
+            print "Cloning test database from {}...".format(template)
+        cursor.execute("DROP DATABASE IF EXISTS %s" % qn(test_name))
+        cursor.execute("CREATE DATABASE %s TEMPLATE %s"
+                       % (qn(test_name), qn(template)))
+        connection.close()
+        connection.settings_dict['NAME'] = test_name
+        return [(connection, old_name, True)], []
+
+    def _save_template(self, connection, old_name, template):
+        """Copy the loaded test database to template.
+
+        The copy is made under another name and renamed once complete, so
+        a concurrent run never clones a partial template.
+        """
+        qn = connection.ops.quote_name
+        test_name = connection.settings_dict['NAME']
+        building = template + '_building'
+        fingerprint = self._get_fingerprint(connection)
+        # A database can only be copied while nobody is connected to it
+        connection.close()
+        connection.settings_dict['NAME'] = old_name
+        try:
+            cursor = connection.cursor()
+            connection.creation._prepare_for_test_db_ddl()
+            if self.verbosity >= 1:
+                print "Saving test database as {}...".format(template)
+            cursor.execute("DROP DATABASE IF EXISTS %s" % qn(building))
+            cursor.execute("CREATE DATABASE %s TEMPLATE %s"
+                           % (qn(building), qn(test_name)))
+            cursor.execute("COMMENT ON DATABASE %s IS %%s" % qn(building),
+                           [fingerprint])
+            cursor.execute("DROP DATABASE IF EXISTS %s" % qn(template))
+            cursor.execute("ALTER DATABASE %s RENAME TO %s"
+                           % (qn(building), qn(template)))
+        finally:
+            connection.close()
+            connection.settings_dict['NAME'] = test_name
@@ -37,6 +37,29 @@ DATABASES = {
     }
 }
 
+# Holds the cached JSON of the webservices detail pages (see
+# webservices/responsecache.py).  With python-memcached installed
+# (requirements.txt) the cache is the memcached server on 127.0.0.1:11211,
+# shared by every worker, which evicts the least recently used entries when
+# full; start it with "memcached -d" before the server.  Without it each
+# worker keeps its own cache in memory, which is enough for development:
+# the entries are keyed on the page_version column and never served stale,
+# only built once per worker.
+try:
+    import memcache
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+        }
+    }
+except ImportError:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -105,6 +128,9 @@ TEMPLATE_LOADERS = (
 #     'django.template.loaders.eggs.Loader',
 )
 
+# On Django < 1.5, adding GZipMiddleware or ConditionalGetMiddleware, or
+# setting USE_ETAGS, makes the Exhibit feeds of webservices ignore stream=1
+# and build the whole document before sending it.
 MIDDLEWARE_CLASSES = (
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -147,9 +173,31 @@ INSTALLED_APPS = (
     'devserver'
 )
 
-#TEST_RUNNER = 'fixtures.util.CustomTestSuiteRunner'
-
-TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
+# Tests run without a database unless METPETDB_TEST_DB is set in the
+# environment; fixtures.util.CustomTestSuiteRunner then creates one on the
+# PostGIS server of DATABASES and loads the schema, fixtures and
+# database/ scripts into it.
+if os.environ.get('METPETDB_TEST_DB'):
+    TEST_RUNNER = 'fixtures.util.CustomTestSuiteRunner'
+else:
+    TEST_RUNNER = 'fixtures.util.UnitTestSuiteRunner'
+
+# Database in which fixtures.util.CustomTestSuiteRunner keeps a copy of the
+# loaded test database, cloned by later runs; None loads it every run.
+FIXTURE_TEMPLATE_DB = 'metpetdb_test_template'
+
+# Answer the sample search counts and facets from the in-memory index in
+# webservices/facetindex.py instead of SQL.
+FACET_INDEX = False
+
+# Seconds an API list keeps the total_count of a listing requested with
+# ?count=cached, see tastyapi.paginator.CountingPaginator.
+API_COUNT_CACHE_TIMEOUT = 60
+
+# Seconds the JSON of a webservices detail page stays cached, see
+# webservices/responsecache.py.  A changed page is built again at once, so
+# this only bounds how long an unread page takes room in the cache.
+RESPONSE_CACHE_TIMEOUT = 3600
 
 # A sample logging configuration. The only tangible logging
 # performed by this configuration is to send an email to
@@ -41,6 +41,7 @@ url(r'^$', 'webservices.views.index', name='index'),
 url(r'^search/$', 'webservices.views.search', name='search'),
 #api calls
 url(r'^webservices/sample/(\d+)/json/$','webservices.api.sample'),
+url(r'^webservices/samples/json/$','webservices.api.samples'),
 url(r'^webservices/subsample/(\d+)/json/$','webservices.api.subsample'),
 url(r'^webservices/chemicalanalysis/(\d+)/json$', 'webservices.api.chemical_analysis'),
 url(r'^webservices/sample/(\d+)/images/json/$','webservices.views.sample_images'),
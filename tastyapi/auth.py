@@ -1,8 +1,72 @@
+import threading
+
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import Permission, Group, User
 from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_started, request_finished
 from django.db.models import Q
-from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from .models import GroupAccess, ReadableObject
+
+
+# Permissions of each content type, filled as they are looked up; they only
+# change when the models do.  Maps a ContentType id to a dict holding the
+# list of all permission names and the 'read' and 'change' permission names.
+_ctype_perms = {}
+
+# Results of DACBackend.get_all_permissions for the request being served by
+# the current thread, keyed on (user id, ContentType id, object id).  The
+# cache only exists while a request is being served.
+_request_perms = threading.local()
+
+
+def _get_ctype_perms(ctype):
+    """Return the permissions applicable to objects of ctype.
+
+    'read' and 'change' are None unless ctype has exactly one of each.
+    """
+    perms = _ctype_perms.get(ctype.id)
+    if perms is None:
+        all_perms = list(Permission.objects.filter(content_type=ctype))
+        perms = {'all': ["%s.%s" % (ctype.app_label, p.codename)
+                         for p in all_perms]}
+        for kind in ('read', 'change'):
+            matching = [p for p in all_perms if p.codename.startswith(kind)]
+            perms[kind] = ("%s.%s" % (ctype.app_label, matching[0].codename)
+                           if len(matching) == 1 else None)
+        _ctype_perms[ctype.id] = perms
+    return perms
+
+
+def _start_request_cache(**kwargs):
+    _request_perms.cache = {}
+
+def _end_request_cache(**kwargs):
+    _request_perms.cache = None
+
+def _clear_request_cache(**kwargs):
+    """Forget the cached permissions after access rights have changed."""
+    if getattr(_request_perms, 'cache', None):
+        _request_perms.cache.clear()
+
+def _clear_ctype_perms(**kwargs):
+    _ctype_perms.clear()
+
+request_started.connect(_start_request_cache,
+                        dispatch_uid='tastyapi_auth_request_started')
+request_finished.connect(_end_request_cache,
+                         dispatch_uid='tastyapi_auth_request_finished')
+post_save.connect(_clear_request_cache, sender=GroupAccess,
+                  dispatch_uid='tastyapi_auth_groupaccess_saved')
+post_delete.connect(_clear_request_cache, sender=GroupAccess,
+                    dispatch_uid='tastyapi_auth_groupaccess_deleted')
+m2m_changed.connect(_clear_request_cache, sender=User.groups.through,
+                    dispatch_uid='tastyapi_auth_groups_changed')
+post_save.connect(_clear_ctype_perms, sender=Permission,
+                  dispatch_uid='tastyapi_auth_permission_saved')
+post_delete.connect(_clear_ctype_perms, sender=Permission,
+                    dispatch_uid='tastyapi_auth_permission_deleted')
 
 
 class DACBackend(ModelBackend):
@@ -24,11 +88,8 @@ class DACBackend(ModelBackend):
         if obj is not None:
             # Look up the permissions applicable to obj
             ctype = ContentType.objects.get_for_model(obj)
-            all_perms = Permission.objects.filter(content_type=ctype)
-            try:
-                read_perm = all_perms.get(codename__startswith='read')
-                write_perm = all_perms.get(codename__startswith='change')
-            except ObjectDoesNotExist:
+            perms = _get_ctype_perms(ctype)
+            if perms['read'] is None or perms['change'] is None:
                 # No permissions applicable, bail.
                 # This can happen if the object does not provide a read perm.
                 # Such objects don't get row-level perms, so skip 'em.
@@ -38,14 +99,12 @@ class DACBackend(ModelBackend):
                 # Find all the groups by which this user might have access
                 # NB: this queryset returns GroupAccess's, not Groups
                 groupset = obj.group_access.filter(group__user=user_obj)
-                can_read = groupset.filter(read_access=True).exists()
-                can_write = groupset.filter(write_access=True).exists()
-                if can_read:
-                    results.add("%s.%s" % (read_perm.content_type.app_label,
-                                           read_perm.codename))
-                if can_write:
-                    results.add("%s.%s" % (write_perm.content_type.app_label,
-                                           write_perm.codename))
+                access = list(groupset.values_list('read_access',
+                                                   'write_access'))
+                if any(read for (read, write) in access):
+                    results.add(perms['read'])
+                if any(write for (read, write) in access):
+                    results.add(perms['change'])
         else:
             # Check whether the user should have add permissions
             create_perms = Permission.objects.filter(codename__startswith='add')
@@ -62,33 +121,93 @@ class DACBackend(ModelBackend):
     def get_all_permissions(self, user_obj, obj=None):
         """Determine all the permissions user_obj has.
 
-        With respect to obj, if present.
+        With respect to obj, if present.  While a request is being served the
+        result is cached for the rest of the request, or until access rights
+        change.
         """
+        cache = getattr(_request_perms, 'cache', None)
+        key = None
+        if cache is not None and user_obj.pk is not None:
+            if obj is None:
+                key = (user_obj.pk, None, None)
+            elif obj.pk is not None:
+                key = (user_obj.pk,
+                       ContentType.objects.get_for_model(obj).id, obj.pk)
+        if key is not None and key in cache:
+            return set(cache[key])
+
         results = set()
         if obj is not None:
-            # look up the permissions applicable to obj
-            ctype = ContentType.objects.get_for_model(obj)
-            all_perms = Permission.objects.filter(content_type=ctype)
             if user_obj.is_superuser:
                 # If the user is the superuser, just give them all permissions.
                 # NB: Permissions need to be translated into a string format
                 #     for some bizarre reason
-                perms = (["%s.%s" % (p.content_type.app_label, p.codename) for
-                          p in all_perms])
-                results.update(perms)
+                ctype = ContentType.objects.get_for_model(obj)
+                results.update(_get_ctype_perms(ctype)['all'])
         # delegate to get_group_permissions to handle groups
         results.update(self.get_group_permissions(user_obj, obj))
         # delegate to the superclass, in case obj is None
         results.update(super(DACBackend, self).get_all_permissions(user_obj, obj))
+        if key is not None:
+            cache[key] = frozenset(results)
         return results
+    def filter_permitted(self, user_obj, perm, objects):
+        """Return the objects in objects on which user_obj has perm.
 
-
-def get_read_queryset(user, prefix=None):
+        Gives the same answers as has_perm, in the original order, but checks
+        the group-based access of the whole list with a single query.
+        """
+        objects = list(objects)
+        if user_obj.is_superuser:
+            if user_obj.is_active:
+                return objects
+            return [obj for obj in objects
+                    if self.has_perm(user_obj, perm, obj)]
+        # ContentType id -> GroupAccess field granting perm, or None when
+        # perm does not come from group-based access for that type
+        access_fields = {}
+        # ContentType id -> ids of the objects to look up
+        object_ids = {}
+        for obj in objects:
+            ctype = ContentType.objects.get_for_model(obj)
+            if ctype.id not in access_fields:
+                perms = _get_ctype_perms(ctype)
+                access_field = None
+                if hasattr(obj, "group_access") and \
+                   perms['read'] is not None and perms['change'] is not None:
+                    if perm == perms['read']:
+                        access_field = 'read_access'
+                    elif perm == perms['change']:
+                        access_field = 'write_access'
+                access_fields[ctype.id] = access_field
+            if access_fields[ctype.id] is not None and obj.pk is not None:
+                object_ids.setdefault(ctype.id, []).append(obj.pk)
+        permitted = set()
+        if object_ids:
+            query = Q()
+            for ctype_id, ids in object_ids.iteritems():
+                query |= Q(content_type=ctype_id, object_id__in=ids,
+                           **{access_fields[ctype_id]: True})
+            permitted = set(GroupAccess.objects.filter(query,
+                                                       group__user=user_obj)
+                            .values_list('content_type', 'object_id'))
+        result = []
+        for obj in objects:
+            ctype = ContentType.objects.get_for_model(obj)
+            if access_fields[ctype.id] is None or obj.pk is None:
+                # perm is not granted by group-based access, check it alone
+                if self.has_perm(user_obj, perm, obj):
+                    result.append(obj)
+            elif (ctype.id, obj.pk) in permitted:
+                result.append(obj)
+        return result
+
+def get_read_queryset(user, prefix=None, model=None):
     """Returns a Q object matching all instances which user may read.
 
     Typical usage:
 
-        query = get_read_queryset(user)
+        query = get_read_queryset(user, model=Foo)
         qs = Foo.objects.filter(query)
 
     Now qs has only those Foo objects which user may read.
@@ -99,24 +218,37 @@ def get_read_queryset(user, prefix=None):
     each object in the table.
 
     This also accepts a prefix argument, which creates indirect filters for
-    related objects instead of the current object.
+    related objects instead of the current object.  model is then the model
+    of the related objects.
 
     Typical usage:
 
-        query = get_read_queryset(user, 'bar')
+        query = get_read_queryset(user, 'bar', Bar)
         qs = Foo.objects.filter(query)
 
     Now qs has only those Foo objects whose bar attribute is readable.
 
-    This function does not perform any db access, and only creates
-    Q objects.
+    Given the model, the readable objects are those whose public_data is 'Y'
+    and those listed for user in ReadableObject, a semi-join on its unique
+    index.  Without the model, the query joins GroupAccess, the groups and
+    their members instead.
+
+    Apart from looking up the content type of model, this function does not
+    perform any db access, and only creates Q objects.
     """
     if user.is_superuser:
         return Q()
     if prefix: # NB: if prefix == "", go to else
         # Prepend a prefix
-        result_dict = {"__".join(prefix, "groupaccess__read_access"): True,
-                       "__".join(prefix, "groupaccess__group__user"): user}
-        return Q(**result_dict)
+        field = lambda name: "__".join([prefix, name])
     else:
-        return Q(groupaccess__read_access=True, groupaccess__group__user=user)
+        field = lambda name: name
+    if model is None:
+        return Q(**{field("groupaccess__read_access"): True,
+                    field("groupaccess__group__user"): user})
+    readable = ReadableObject.objects.filter(
+        user=user.id, content_type=ContentType.objects.get_for_model(model))
+    query = Q(**{field("pk__in"): readable.values('object_id')})
+    if 'public_data' in model._meta.get_all_field_names():
+        query |= Q(**{field("public_data"): 'Y'})
+    return query
@@ -0,0 +1,19 @@
+from __future__ import print_function
+from __future__ import unicode_literals
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from tastyapi.models import refresh_readable
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the readable objects table from the group grants."
+
+    def handle_noargs(self, **options):
+        """Rebuilds ReadableObject from GroupAccess and the group members."""
+        self.verbosity = int(options.get('verbosity', 1))
+
+        with transaction.commit_on_success():
+            created = refresh_readable()
+
+        if self.verbosity >= 1:
+            print(u"Created %d readable objects" % created)
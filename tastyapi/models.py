@@ -13,7 +13,7 @@ from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.contrib.gis.db.models import GeoManager, PolygonField, PointField, GeometryField
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.core.mail import EmailMessage
 from django.db import models as DjangoModels
@@ -48,6 +48,115 @@ class GroupAccess(Model):
         get_latest_by = 'id'
 
 
+class ReadableObject(Model):
+    """An object a user may read through one of their groups.
+
+    Denormalizes GroupAccess and the group memberships so that read filters
+    are a semi-join on one indexed table.  Grants of the public groups on
+    models with a public_data field are left out: those objects are matched
+    by public_data instead.  Kept in sync by the signals below; run
+    manage.py refresh_readable once the table is created, and whenever it
+    may have missed changes, to rebuild it from scratch.
+    """
+    user = ForeignKey(AuthUser, db_index=False)
+    content_type = ForeignKey(ContentType, db_index=False)
+    object_id = PositiveIntegerField()
+    class Meta:
+        # The unique index on (user, content_type, object_id) serves the
+        # read filters
+        unique_together = ('user', 'content_type', 'object_id')
+
+
+def get_public_data_ctypes():
+    """The ids of the content types whose models have a public_data field."""
+    return [ContentType.objects.get_for_model(model).id
+            for model in DjangoModels.get_models()
+            if 'public_data' in model._meta.get_all_field_names()]
+
+
+# Rows deleted or created per query by refresh_readable()
+READABLE_BATCH_SIZE = 1000
+
+
+def refresh_readable(users=None, content_type=None, object_id=None):
+    """Recompute the ReadableObject rows of users on the given objects.
+
+    Any argument left as None stands for all users, content types or
+    objects.  The rows are deleted and created READABLE_BATCH_SIZE at a
+    time, so rebuilding the whole table does not hold it in memory.
+    Returns the number of rows created.
+    """
+    rows = ReadableObject.objects.all()
+    grants = GroupAccess.objects.filter(read_access=True)
+    if users is not None:
+        rows = rows.filter(user__in=users)
+        grants = grants.filter(group__user__in=users)
+    if content_type is not None:
+        rows = rows.filter(content_type=content_type)
+        grants = grants.filter(content_type=content_type)
+    if object_id is not None:
+        rows = rows.filter(object_id=object_id)
+        grants = grants.filter(object_id=object_id)
+    grants = grants.exclude(
+        content_type__in=get_public_data_ctypes(),
+        group__in=Group.objects.filter(groupextra__group_type='public'))
+    while True:
+        ids = list(rows.values_list('pk', flat=True)[:READABLE_BATCH_SIZE])
+        if not ids:
+            break
+        ReadableObject.objects.filter(pk__in=ids).delete()
+    readable = grants.values_list('group__user', 'content_type',
+                                  'object_id').distinct()
+    created = 0
+    batch = []
+    for (user_id, ctype_id, object_id) in readable.iterator():
+        if user_id is None:
+            # a group without members
+            continue
+        batch.append(ReadableObject(user_id=user_id,
+                                    content_type_id=ctype_id,
+                                    object_id=object_id))
+        if len(batch) == READABLE_BATCH_SIZE:
+            ReadableObject.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+    if batch:
+        ReadableObject.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+@receiver(post_save, sender=GroupAccess)
+@receiver(post_delete, sender=GroupAccess)
+def sync_readable_access(sender, instance, raw=False, **kwargs):
+    """Keep ReadableObject in step with a changed GroupAccess."""
+    if raw:
+        # DB is in an inconsistent state; abort
+        return
+    refresh_readable(content_type=instance.content_type_id,
+                     object_id=instance.object_id)
+
+
+@receiver(m2m_changed, sender=AuthUser.groups.through)
+def sync_readable_members(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """Keep ReadableObject in step with the members of groups."""
+    if not reverse:
+        # instance is a user
+        users = [instance.pk]
+    elif action == 'pre_clear':
+        # instance is a group; remember who is about to leave it
+        instance._readable_members = list(
+            instance.user_set.values_list('pk', flat=True))
+        return
+    elif action == 'post_clear':
+        users = getattr(instance, '_readable_members', [])
+    else:
+        users = list(pk_set or [])
+    if action in ('post_add', 'post_remove', 'post_clear') and users:
+        refresh_readable(users=users)
+
+
 def get_public_groups():
     """Get or create the public group(s) as a queryset."""
     public_groups = Group.objects.filter(groupextra__group_type='public')
@@ -129,7 +238,6 @@ def create_group_access(sender, instance, created, **kwargs):
                                                    )
         except GroupAccess.DoesNotExist:
             GroupAccess.objects.create(
-                id = utils.get_next_id(GroupAccess),
                 group_id = group_id,
                 read_access = True,
                 write_access = True,
@@ -466,8 +574,6 @@ def create_sample_group_access(sender, instance, created, **kwargs):
     ctype = ContentType.objects.get_for_model(instance)
     group_id = instance.user.django_user.groups.filter(
                     name__iendswith=instance.user.django_user.username)[0].id
-    try: id = GroupAccess.objects.latest('id').id + 1
-    except GroupAccess.DoesNotExist: id = 1
 
     # Create a group access only if one doesn't already exists.
     # This will be true when we are updating an existing sample.
@@ -477,7 +583,6 @@ def create_sample_group_access(sender, instance, created, **kwargs):
                                                object_id = instance.sample_id)
     except GroupAccess.DoesNotExist:
         GroupAccess.objects.create(
-            id = id,
             group_id = group_id,
             read_access = True,
             write_access = True,
@@ -565,9 +670,7 @@ class Subsample(models.Model):
     def save(self, **kwargs):
         # Assign a sample ID only for create requests
         if self.subsample_id is None:
-            try: id = Subsample.objects.latest('subsample_id').subsample_id + 1
-            except Subsample.DoesNotExist: id = 1
-            self.subsample_id = id
+            self.subsample_id = utils.get_next_id(Subsample)
         subsample = super(Subsample, self).save()
 
 @receiver(post_save, sender=Subsample)
@@ -577,8 +680,6 @@ def create_subsample_group_access(sender, instance, created, **kwargs):
     group_id = instance.user.django_user.groups.filter(
                     name__endswith=instance.user.django_user.username)[0].id
     logger.error("sender: {}, instance: {}, created: {}, kwargs: {}".format(sender, instance, created, kwargs))
-    try: id = GroupAccess.objects.latest('id').id + 1
-    except GroupAccess.DoesNotExist: id = 1
 
     # Create a group access only if one doesn't already exists.
     # This will be true when we are updating an existing sample.
@@ -589,7 +690,6 @@ def create_subsample_group_access(sender, instance, created, **kwargs):
                                                object_id = instance.subsample_id)
     except GroupAccess.DoesNotExist:
         GroupAccess.objects.create(
-            id = id,
             group_id = group_id,
             read_access = True,
             write_access = True,
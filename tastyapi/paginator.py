@@ -0,0 +1,197 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from tastypie.paginator import Paginator
+from tastypie.exceptions import BadRequest
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+def encode_cursor(key):
+    """Make an opaque cursor from the key of the last object of a page."""
+    return base64.urlsafe_b64encode(str(key)).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the key encoded in cursor, or None for an empty cursor.
+
+    Raises ValueError if the cursor was not made by encode_cursor.
+    """
+    if not cursor:
+        return None
+    cursor = str(cursor)
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except TypeError:
+        raise ValueError(cursor)
+
+
+class CountingPaginator(Paginator):
+    """Paginator which can avoid counting every matching object.
+
+    The ``count`` parameter chooses how ``total_count`` is found:
+
+    * ``exact`` (default): counted for this request.
+    * ``cached``: an exact count, kept in the cache for
+      ``settings.API_COUNT_CACHE_TIMEOUT`` seconds (60 by default) under the
+      SQL of the listing, which holds both the filters and the permission
+      restrictions of the user.  It may lag behind recent changes.
+    * ``estimated``: the row estimate of the query planner, which costs no
+      scan but may be off, especially for filtered listings.
+    * ``none``: not counted; ``total_count`` is null and ``next`` is found
+      by fetching one more object than the page holds.
+
+    ``meta['estimated']`` tells whether ``total_count`` may be inexact:
+    it is true for estimates and for counts served from the cache.
+    """
+    count_mode = 'exact'
+    count_modes = ('cached', 'exact', 'estimated', 'none')
+
+    def get_count_mode(self):
+        mode = self.request_data.get('count', self.count_mode)
+        if mode not in self.count_modes:
+            raise BadRequest("Invalid count '%s' provided. Please provide "
+                             "one of %s." % (mode, ", ".join(self.count_modes)))
+        return mode
+
+    def get_sql(self):
+        """Return the SQL and parameters of the listing, or None."""
+        try:
+            # the count does not depend on the ordering
+            return self.objects.order_by().query.sql_with_params()
+        except AttributeError:
+            return None
+
+    def get_cached_count(self):
+        """Return the count and whether it came from the cache."""
+        sql = self.get_sql()
+        if sql is None:
+            return (self.get_count(), False)
+        key = 'api_count:' + hashlib.md5(repr(sql)).hexdigest()
+        count = cache.get(key)
+        if count is not None:
+            return (count, True)
+        count = self.get_count()
+        cache.set(key, count, getattr(settings, 'API_COUNT_CACHE_TIMEOUT', 60))
+        return (count, False)
+
+    def get_estimated_count(self):
+        sql = self.get_sql()
+        if sql is None:
+            return self.get_count()
+        (query, params) = sql
+        cursor = connections[self.objects.db].cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cursor.fetchone()[0]
+        if not isinstance(plan, list):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_total_count(self, mode):
+        """Return the total count for mode and whether it is estimated."""
+        if mode == 'none':
+            return (None, False)
+        elif mode == 'estimated':
+            return (self.get_estimated_count(), True)
+        elif mode == 'cached':
+            return self.get_cached_count()
+        return (self.get_count(), False)
+
+    def page(self):
+        limit = self.get_limit()
+        offset = self.get_offset()
+        mode = self.get_count_mode()
+        (count, estimated) = self.get_total_count(mode)
+        if count is None and limit:
+            # one more object than needed tells whether there is a next page
+            objects = list(self.get_slice(limit + 1, offset))
+            more = len(objects) > limit
+            objects = objects[:limit]
+        else:
+            objects = self.get_slice(limit, offset)
+        meta = {
+            'offset': offset,
+            'limit': limit,
+            'total_count': count,
+            'estimated': estimated,
+        }
+
+        if limit:
+            meta['previous'] = self.get_previous(limit, offset)
+            if count is None:
+                meta['next'] = (self._generate_uri(limit, offset + limit)
+                                if more else None)
+            else:
+                meta['next'] = self.get_next(limit, offset, count)
+
+        return {
+            self.collection_name: objects,
+            'meta': meta,
+        }
+
+
+class KeysetPaginator(CountingPaginator):
+    """Paginator which can page on the primary key instead of an offset.
+
+    Requests with a ``cursor`` parameter (empty for the first page) get the
+    objects whose primary key follows the one encoded in the cursor, ordered
+    by primary key, and a ``next`` link carrying the cursor of the following
+    page.  Each page is an index range scan, so its cost does not depend on
+    how deep it is.  Requests without a cursor are paginated by offset as
+    before.  Keyset pages only report a ``total_count`` when a ``count``
+    mode is requested.
+    """
+    def page(self):
+        if 'cursor' not in self.request_data:
+            return super(KeysetPaginator, self).page()
+        try:
+            last = decode_cursor(self.request_data['cursor'])
+        except ValueError:
+            raise BadRequest("Invalid cursor '%s' provided."
+                             % self.request_data['cursor'])
+        limit = self.get_limit()
+        pk = self.objects.model._meta.pk.name
+        objects = self.objects.order_by(pk)
+        if last is not None:
+            objects = objects.filter(**{pk + '__gt': last})
+        if limit:
+            # one more object than needed tells whether there is a next page
+            objects = list(objects[:limit + 1])
+            more = len(objects) > limit
+            objects = objects[:limit]
+        else:
+            objects = list(objects)
+            more = False
+        meta = {
+            'limit': limit,
+            'cursor': self.request_data['cursor'],
+            'next': None,
+        }
+        if more:
+            meta['next'] = self._generate_cursor_uri(
+                limit, encode_cursor(getattr(objects[-1], pk)))
+        if 'count' in self.request_data:
+            (meta['total_count'], meta['estimated']) = \
+                self.get_total_count(self.get_count_mode())
+        return {
+            self.collection_name: objects,
+            'meta': meta,
+        }
+
+    def _generate_cursor_uri(self, limit, cursor):
+        if self.resource_uri is None:
+            return None
+        request_params = dict((k, v.encode('utf-8')
+                                  if isinstance(v, unicode) else v)
+                              for k, v in self.request_data.items())
+        for name in ('limit', 'offset', 'cursor'):
+            request_params.pop(name, None)
+        request_params.update({'limit': limit, 'cursor': cursor})
+        return '%s?%s' % (self.resource_uri, urlencode(request_params))
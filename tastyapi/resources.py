@@ -1,4 +1,5 @@
-from django.db import transaction, IntegrityError
+from django.conf.urls import url
+from django.db import transaction
 from django.db.models import Q
 from django.core.exceptions import ObjectDoesNotExist
 from tastypie.resources import ModelResource
@@ -7,15 +8,20 @@ from tastypie import fields
 from tastypie.validation import Validation
 from tastypie.authorization import Authorization
 from tastypie.authentication import ApiKeyAuthentication
-from tastypie.exceptions import Unauthorized, InvalidFilterError, ImmediateHttpResponse
+from tastypie.exceptions import Unauthorized, InvalidFilterError, ImmediateHttpResponse, BadRequest
+from tastypie.utils import dict_strip_unicode_keys, trailing_slash
+from tastypie import http
+from django.core.urlresolvers import resolve, get_script_prefix
 
 from .models import User, Sample, MetamorphicGrade, MetamorphicRegion, Region,\
                     RockType, Subsample, SubsampleType, Mineral, Reference, \
                     ChemicalAnalyses, SampleRegion, SampleReference, \
                     SampleMineral, SampleMetamorphicGrade, \
                     SampleMetamorphicRegion
+from .paginator import KeysetPaginator
 from . import auth
 from . import utils
+from . import vocabulary
 import logging
 
 logging.basicConfig()
@@ -31,6 +37,17 @@ CLASS_MAPPING = {'regions': SampleRegion,
                  'metamorphic_grades': SampleMetamorphicGrade,
                  'metamorphic_regions': SampleMetamorphicRegion}
 
+# Fields of SampleResource holding names rather than URIs
+FREE_TEXT_FIELDS = ('regions', 'references')
+
+# Rows inserted by one statement of bulk_insert
+BULK_BATCH_SIZE = 500
+
+def bulk_insert(model, objects):
+    """Insert objects with bulk_create, BULK_BATCH_SIZE rows at a time."""
+    for start in range(0, len(objects), BULK_BATCH_SIZE):
+        model.objects.bulk_create(objects[start:start + BULK_BATCH_SIZE])
+
 class BaseResource(ModelResource):
     @transaction.commit_manually
     def dispatch(self, *args, **kwargs):
@@ -94,11 +111,8 @@ def _filter_by_permission_closure(permission_lambda):
     def closure(self, object_list, bundle):
         """Filter object_list for objects to which we have the given permission."""
         permission = permission_lambda(self)
-        result = []
-        for item in object_list:
-            if bundle.request.user.has_perm(permission, bundle.obj):
-                result.append(bundle.obj)
-        return result
+        return auth.DACBackend().filter_permitted(bundle.request.user,
+                                                  permission, object_list)
     return closure
 
 def _check_perm_closure(permission_lambda):
@@ -126,7 +140,8 @@ class ObjectAuthorization(Authorization):
         super(ObjectAuthorization, self).__init__(*args, **kwargs)
     def read_list(self, object_list, bundle):
         """Make a queryset of all the objects we can read."""
-        filters = auth.get_read_queryset(bundle.request.user)
+        filters = auth.get_read_queryset(bundle.request.user,
+                                         model=object_list.model)
         qs = object_list.filter(filters)
         logger.info("qs = {}".format(qs))
         return qs
@@ -197,8 +212,15 @@ class FirstOrderResource(ModelResource):
             except AttributeError:
                 is_related = False
             if is_related:
-                # Field.attribute is the name of the relationship
-                extra_filter_prefixes.append(field.attribute)
+                target_resource = field.get_related_resource(None)
+                # Only ObjectAuthorization restricts reads, as in
+                # remove_inaccessible
+                if isinstance(target_resource._meta.authorization,
+                              ObjectAuthorization):
+                    # Field.attribute is the name of the relationship
+                    extra_filter_prefixes.append(
+                        (field.attribute,
+                         target_resource._meta.queryset.model))
         result = super(FirstOrderResource, self).build_filters(filters)
         # We can't apply our restrictions at this point, and it would be
         # unwise to attach this to object-wide state since there's only one
@@ -219,9 +241,10 @@ class FirstOrderResource(ModelResource):
             extra_filter_prefixes = applicable_filters[PREFIX_STRING]
             # Make sure it doesn't interfere with the ORM
             del applicable_filters[PREFIX_STRING]
-            for prefix in extra_filter_prefixes:
+            for prefix, model in extra_filter_prefixes:
                 # Attach some read limits to the query
-                auth_read_limit &= auth.get_read_queryset(request.user, prefix)
+                auth_read_limit &= auth.get_read_queryset(request.user, prefix,
+                                                          model)
         return self.get_object_list(request).filter(auth_read_limit,
                                                     **applicable_filters)
     def check_filtering(self, field_name, filter_type='exact', filter_bits=None):
@@ -265,45 +288,79 @@ class FirstOrderResource(ModelResource):
                 raise InvalidFilterError("Second-order relationship traversal"+
                                          " is not allowed.")
         return result()
+    def get_list(self, request, **kwargs):
+        """Return a list, checking the related objects of all its bundles at
+        once in alter_list_data_to_serialize instead of one by one."""
+        request.deferred_visibility = self
+        try:
+            return super(FirstOrderResource, self).get_list(request, **kwargs)
+        finally:
+            request.deferred_visibility = None
+    def alter_list_data_to_serialize(self, request, data):
+        """Remove references to inaccessible objects from the whole list."""
+        if getattr(request, 'deferred_visibility', None) is self:
+            self.remove_inaccessible(request, data[self._meta.collection_name])
+        return data
     def dehydrate(self, bundle):
         """Remove references to inaccessible objects."""
-        for field_name in bundle.data:
-            # For every field
-            if field_name not in self.fields:
-                # Don't know what it is, abort
-                continue
-            # Get the corresponding field object
-            target_field = self.fields[field_name]
+        if getattr(bundle.request, 'deferred_visibility', None) is not self:
+            self.remove_inaccessible(bundle.request, [bundle])
+        return bundle
+    def remove_inaccessible(self, request, bundles):
+        """Remove references to objects the user may not read from bundles.
+
+        The related objects of each related resource are checked together,
+        with one query for all the bundles.  Only resources authorized by
+        ObjectAuthorization restrict reads; references to anything else are
+        kept.
+        """
+        for field_name, target_field in self.fields.items():
             # Figure out whether it's a relationship field
-            try:
-                is_related = target_field.is_related
-            except AttributeError:
-                # it isn't; abort
+            if not getattr(target_field, 'is_related', False):
                 continue
-            if not is_related:
-                # it isn't; abort
+            target_resource = target_field.get_related_resource(None)
+            if not isinstance(target_resource._meta.authorization,
+                              ObjectAuthorization):
                 continue
-            # Get the value we're providing for this field
-            value = bundle.data[field_name]
-            # Many-to-many fields will produce a list here, but a foreign key
-            # won't
-            if not isinstance(value, list):
-                value = [value]
-                # NB: Now value is not bundle.data[field_name], so we'll need
-                # to re-unify them afterwards
-            for item in value[:]:
-                try:
-                    # Check whether we have permission to access item
-                    target_resource = target_field.get_related_resource(None)
-                    target_resource.get_via_uri(item, bundle.request)
-                except ImmediateHttpResponse:
-                    # We don't have permission, remove it
-                    value.remove(item)
-            if value is not bundle.data[field_name] and not value:
-                # For ToOne fields: value was a singleton, and now it's empty,
-                # so null out the corresponding entry in bundle.data
-                bundle.data[field_name] = None
-        return bundle
+            # Find the primary keys of every object we're providing
+            pks = {}
+            for bundle in bundles:
+                value = bundle.data.get(field_name)
+                # Many-to-many fields will produce a list here, but a foreign
+                # key won't
+                if not isinstance(value, list):
+                    value = [value]
+                for item in value:
+                    if item is not None and item not in pks:
+                        pks[item] = self._uri_to_pk(target_resource, item)
+            if not pks:
+                continue
+            queryset = target_resource._meta.queryset.model.objects
+            readable = set(queryset.filter(pk__in=pks.values())
+                                   .filter(auth.get_read_queryset(
+                                       request.user,
+                                       model=queryset.model))
+                                   .values_list('pk', flat=True))
+            for bundle in bundles:
+                value = bundle.data.get(field_name)
+                if isinstance(value, list):
+                    # NB: modify the list in place so bundle.data sees it
+                    value[:] = [item for item in value
+                                if pks[item] in readable]
+                elif value is not None and pks[value] not in readable:
+                    # For ToOne fields: null out the entry in bundle.data
+                    bundle.data[field_name] = None
+    def _uri_to_pk(self, target_resource, uri):
+        """Pull the primary key out of a URI of target_resource."""
+        prefix = get_script_prefix()
+        chomped_uri = uri
+        if prefix and chomped_uri.startswith(prefix):
+            chomped_uri = chomped_uri[len(prefix)-1:]
+        view, args, kwargs = resolve(chomped_uri)
+        kwargs = target_resource.remove_api_resource_names(kwargs)
+        pk = kwargs[target_resource._meta.detail_uri_name]
+        # The URI holds a string, compare it the way the database would
+        return target_resource._meta.queryset.model._meta.pk.to_python(pk)
 
 class UserResource(BaseResource):
     class Meta:
@@ -334,6 +391,7 @@ class SampleResource(VersionedResource, FirstOrderResource):
         allowed_methods = ['get', 'post', 'put', 'delete']
         authentication = ApiKeyAuthentication()
         authorization = ObjectAuthorization('tastyapi', 'sample')
+        paginator_class = KeysetPaginator
         excludes = ['user', 'collector']
         filtering = {
                 'version': ALL,
@@ -344,6 +402,58 @@ class SampleResource(VersionedResource, FirstOrderResource):
                 'regions': ALL_WITH_RELATIONS,
                 }
         validation = VersionValidation(queryset, 'sample_id')
+        bulk_allowed_methods = ['post']
+
+    def prepend_urls(self):
+        return [
+            url(r"^(?P<resource_name>%s)/bulk%s$" % (self._meta.resource_name,
+                                                      trailing_slash()),
+                self.wrap_view('dispatch_bulk'), name="api_dispatch_bulk"),
+        ]
+
+    def dispatch_bulk(self, request, **kwargs):
+        return self.dispatch('bulk', request, **kwargs)
+
+    def post_bulk(self, request, **kwargs):
+        """Create every sample in the "objects" list of the request body.
+
+        Each sample is checked and saved as by a POST to the list, but the
+        free-text regions and references of all the samples are resolved
+        together and the rows of the through tables are inserted in
+        batches.  The request runs in one transaction, so if any sample is
+        rejected none is created.
+        """
+        deserialized = self.deserialize(request, request.body,
+                format=request.META.get('CONTENT_TYPE', 'application/json'))
+        deserialized = self.alter_deserialized_list_data(request, deserialized)
+        if 'objects' not in deserialized:
+            raise BadRequest("Invalid data sent.")
+        bundles = []
+        free_text = []
+        links = []
+        for data in deserialized['objects']:
+            data = dict_strip_unicode_keys(data)
+            free_text.append(self.pop_free_text(data))
+            bundle = self.build_bundle(data=data, request=request)
+            bundle.obj = self._meta.object_class()
+            bundle = self.full_hydrate(bundle)
+            self.is_valid(bundle)
+            if bundle.errors:
+                raise ImmediateHttpResponse(
+                    response=self.error_response(request, bundle.errors))
+            self.authorized_create_detail(self.get_object_list(request),
+                                          bundle)
+            self.save_related(bundle)
+            bundle.obj.save()
+            links.extend(self.get_links(self.hydrate_m2m(bundle)))
+            bundles.append(bundle)
+        links.extend(self.get_free_text_links(
+            [bundle.obj for bundle in bundles], free_text))
+        self.save_links(links)
+        return self.create_response(
+            request,
+            {'objects': [self.get_resource_uri(bundle) for bundle in bundles]},
+            response_class=http.HttpCreated)
 
     def obj_create(self, bundle, **kwargs):
         """ Save free-text fields: regions and references.
@@ -357,31 +467,27 @@ class SampleResource(VersionedResource, FirstOrderResource):
         """ Remove free-text fields "regions" and "references" from the bundle
         and save them for later, so that Tastypie doesn't try to save them
         on its own and fail"""
-        free_text_fields = {'regions': bundle.data.pop('regions'),
-                           'references': bundle.data.pop('references')}
-        super(SampleResource, self).obj_create(bundle, **kwargs)
-        sample = Sample.objects.get(pk=bundle.obj.sample_id)
-
-        for field_name, entries in free_text_fields.iteritems():
-            for entry in entries:
-                obj_class = CLASS_MAPPING[field_name[:-1] + "_class"]
-
-                try:
-                    obj = obj_class.objects.get(name=entry)
-                except ObjectDoesNotExist:
-                    id = utils.get_next_id(CLASS_MAPPING[field_name[:-1] +
-                                                                     "_class"])
-                    obj_args = {field_name[:-1] + "_id": id, 'name': entry}
-                    obj = obj_class.objects.create( **obj_args )
-
-                obj_args = {'id': utils.get_next_id(CLASS_MAPPING[field_name]),
-                            'sample': sample,
-                            field_name[:-1]: obj}
-
-                try: CLASS_MAPPING[field_name].objects.get_or_create(**obj_args)
-                except IntegrityError: continue
+        free_text = self.pop_free_text(bundle.data)
+        bundle = super(SampleResource, self).obj_create(bundle, **kwargs)
+        self.save_links(self.get_free_text_links([bundle.obj], [free_text]))
+        return bundle
 
     def save_m2m(self, bundle):
+        self.save_links(self.get_links(bundle))
+
+    def pop_free_text(self, data):
+        """Remove the free-text fields from data and return their entries."""
+        return dict((field_name, data.pop(field_name, None) or [])
+                    for field_name in FREE_TEXT_FIELDS)
+
+    def get_links(self, bundle):
+        """List the M2M records passed in the request for bundle.obj.
+
+        Each is a (field name, sample, related object id) triple; the
+        CLASS_MAPPING global variable defined at the top specifies which
+        classes are currently accepted.
+        """
+        links = []
         for field_name, field_object in self.fields.items():
             if not getattr(field_object, 'is_m2m', False):
                 continue
@@ -392,18 +498,59 @@ class SampleResource(VersionedResource, FirstOrderResource):
             if field_object.readonly:
                 continue
 
-            """This will get or create a new record for each M2M record passed
-               in the request. The CLASS_MAPPING global variable defined at
-               the top specifies which classes are currently accepted."""
             for field in bundle.data[field_name]:
-                sample = Sample.objects.get(pk=bundle.obj.sample_id)
+                links.append((field_name, bundle.obj, field.obj.pk))
+        return links
 
-                obj_args = {'id': utils.get_next_id(CLASS_MAPPING[field_name]),
-                            'sample': sample,
-                            field_name[:-1]: field.obj}
+    def get_free_text_links(self, samples, free_text):
+        """List the free-text entries of each sample as links.
 
-                try: CLASS_MAPPING[field_name].objects.get_or_create(**obj_args)
-                except IntegrityError: continue
+        free_text holds the entries popped from the data of each sample.
+        Entries are resolved through the vocabulary cache, which looks up
+        the names it lacks with one query per field, and the missing ones
+        are created together.
+        """
+        links = []
+        for field_name in FREE_TEXT_FIELDS:
+            obj_class = CLASS_MAPPING[field_name[:-1] + "_class"]
+            names = set(name for entries in free_text
+                        for name in entries[field_name])
+            if not names:
+                continue
+            ids = vocabulary.get_ids(obj_class, names)
+            missing = [obj_class(**{obj_class._meta.pk.attname:
+                                        utils.get_next_id(obj_class),
+                                    'name': name})
+                       for name in sorted(names) if name not in ids]
+            bulk_insert(obj_class, missing)
+            vocabulary.add(obj_class, missing)
+            ids.update((obj.name, obj.pk) for obj in missing)
+            for sample, entries in zip(samples, free_text):
+                for name in entries[field_name]:
+                    links.append((field_name, sample, ids[name]))
+        return links
+
+    def save_links(self, links):
+        """Create the through-table records of links.
+
+        Records which exist already are skipped, and the others are
+        inserted BULK_BATCH_SIZE at a time.
+        """
+        by_field = {}
+        for field_name, sample, obj_id in links:
+            by_field.setdefault(field_name, set()).add((sample.pk, obj_id))
+        for field_name, pairs in by_field.items():
+            through_class = CLASS_MAPPING[field_name]
+            related_name = field_name[:-1]
+            sample_ids = set(sample_id for sample_id, obj_id in pairs)
+            existing = set(through_class.objects
+                           .filter(sample__in=sample_ids)
+                           .values_list('sample', related_name))
+            bulk_insert(through_class,
+                        [through_class(id=utils.get_next_id(through_class),
+                                       sample_id=sample_id,
+                                       **{related_name + '_id': obj_id})
+                         for sample_id, obj_id in sorted(pairs - existing)])
 
 
 class RegionResource(BaseResource):
@@ -473,6 +620,7 @@ class SubsampleResource(VersionedResource, FirstOrderResource):
         allowed_methods = ['get', 'post', 'put', 'delete']
         authorization = ObjectAuthorization('tastyapi', 'subsample')
         authentication = ApiKeyAuthentication()
+        paginator_class = KeysetPaginator
         filtering = {
                 'public_data': ALL,
                 'grid_id': ALL,
@@ -501,6 +649,7 @@ class ChemicalAnalysisResource(VersionedResource, FirstOrderResource):
         excludes = ['image', 'user']
         authorization = ObjectAuthorization('tastyapi', 'chemical_analysis')
         authentication = ApiKeyAuthentication()
+        paginator_class = KeysetPaginator
         filtering = {
                 'subsample': ALL_WITH_RELATIONS,
                 'reference': ALL_WITH_RELATIONS,
@@ -5,13 +5,13 @@ logger = logging.getLogger(__name__)
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User as AuthUser
 from django.contrib.auth.models import Group
-from django.db import transaction
+from django.db import connection, transaction
 
-from .models import get_public_groups
+from .models import get_public_groups, refresh_readable
 from .models import User as MetpetUser
 from .models import Group, GroupExtra, GroupAccess
 from .models import Sample, Image
-from .models import Subsample, ChemicalAnalysis, Grids
+from .models import Subsample, ChemicalAnalyses, Grid
 
 def translate(raw_crypt):
     """Translates a metpetdb salted password into a Django salted password."""
@@ -28,7 +28,10 @@ def translate(raw_crypt):
     return cooked_crypt
 
 
-@transaction.commit_on_success
+# GroupAccess rows inserted per statement, and per transaction, by
+# backfill_grants
+BATCH_SIZE = 1000
+
 def main():
     """Imports metpetdb's various tables into Django for auth purposes.
     
@@ -38,7 +41,15 @@ def main():
         auth_user(id); 
 
     This function is idempotent, but shouldn't need to be run multiple times.
+    The group accesses are added in batches which are committed one by one,
+    so an interrupted run picks up where it stopped when started again.
     """
+    transition_users()
+    backfill_group_access()
+
+@transaction.commit_on_success
+def transition_users():
+    """Creates a Django user for every metpetdb user lacking one."""
     for metpet_user in MetpetUser.objects.filter(django_user=None):
         logger.info("Transitioning %s.", metpet_user.name)
         email = metpet_user.email
@@ -69,32 +80,84 @@ def main():
             logger.info("Adding %s to personal group.", metpet_user.name)
             metpet_user.manual_verify()
         metpet_user.save()
+
+def backfill_group_access():
+    """Grants owners and the public groups access to the existing items.
+
+    Owners get read and write access to their samples and images, through
+    their personal group, and the public groups read access to everything
+    public.  Only the missing grants are added.
+    """
     models_with_owners = [Sample, Image]
-    models_with_public_data = [Sample, Image, Subsample, ChemicalAnalysis, Grids]
-    public_groups = get_public_groups()
+    models_with_public_data = [Sample, Image, Subsample, ChemicalAnalyses,
+                               Grid]
+    users = MetpetUser._meta
+    owner_groups = ("SELECT ge.group_id, u." + users.pk.column + " AS owner "
+                    "FROM " + GroupExtra._meta.db_table + " ge "
+                    "JOIN " + users.db_table + " u "
+                    "ON u." + users.get_field('django_user').column +
+                    " = ge.owner_id "
+                    "WHERE ge.group_type = 'u_uid'")
+    public_groups = ("SELECT group_id FROM " + GroupExtra._meta.db_table + " "
+                     "WHERE group_type = 'public'")
+    get_public_groups() # Make sure there is one
     for Model in models_with_owners:
-        ctype = ContentType.objects.get_for_model(Model)
-        for item in Model.objects.all():
-            owner = item.owner
-            owner_django = owner.django_user
-            try:
-                owner_group = Group.objects.get(groupextra__owner=owner_django,
-                                                groupextra__group_type='u_uid')
-            except Group.DoesNotExist:
-                logger.warning("Skipping item %s, owner %s doesn't have a group.",
-                               item, owner)
-                continue # skip this item
-            if GroupAccess.objects.filter(group=owner_group, content_type=ctype,
-                                          object_id=item.pk).exists():
-                continue # Already been done, skip it
-            GroupAccess(group=owner_group, read_access=True, write_access=True,
-                        content_type=ctype, object_id=item.pk).save()
+        owner = "item." + Model._meta.get_field('user').column
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM " + Model._meta.db_table + " item "
+                       "WHERE NOT EXISTS (SELECT 1 FROM (" + owner_groups +
+                       ") g WHERE g.owner = " + owner + ")")
+        skipped = cursor.fetchone()[0]
+        if skipped:
+            logger.warning("Skipping %d %s items, their owners don't have a "
+                           "group.", skipped, Model.__name__)
+        backfill_grants(Model, owner_groups, "g.owner = " + owner,
+                        write_access=True)
     for Model in models_with_public_data:
-        ctype = ContentType.objects.get_for_model(Model)
-        for item in Model.objects.filter(public_data__iexact='y'):
-            for group in public_groups:
-                if GroupAccess.objects.filter(group=group, content_type=ctype,
-                                              object_id=item.pk).exists():
-                    continue # Object is already in this group
-                GroupAccess(group=group, content_type=ctype, object_id=item.pk,
-                            read_access=True, write_access=False).save()
+        backfill_grants(Model, public_groups, "upper(item.public_data) = 'Y'",
+                        write_access=False)
+    for Model in set(models_with_owners + models_with_public_data):
+        # bulk_create does not send the signals which maintain ReadableObject
+        refresh_readable(content_type=ContentType.objects.get_for_model(Model))
+
+def backfill_grants(Model, groups, condition, write_access):
+    """Adds the missing read grants of groups on the items of Model.
+
+    groups is SQL selecting the ids of the groups as group_id, and
+    condition SQL telling which items a group (g) gets access to (item).
+    Returns the number of grants added.
+    """
+    ctype = ContentType.objects.get_for_model(Model)
+    pk = "item." + Model._meta.pk.column
+    missing = ("SELECT " + pk + ", g.group_id "
+               "FROM " + Model._meta.db_table + " item "
+               "JOIN (" + groups + ") g ON " + condition + " "
+               "WHERE NOT EXISTS (SELECT 1 FROM " +
+               GroupAccess._meta.db_table + " ga "
+               "WHERE ga.group_id = g.group_id "
+               "AND ga.content_type_id = %s "
+               "AND ga.object_id = " + pk + ")")
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM (" + missing + ") m", [ctype.id])
+    total = cursor.fetchone()[0]
+    done = 0
+    last = (-1, -1)
+    while done < total:
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            cursor.execute(missing + " AND (" + pk + ", g.group_id) > (%s, %s) "
+                           "ORDER BY 1, 2 LIMIT %s",
+                           [ctype.id, last[0], last[1], BATCH_SIZE])
+            rows = cursor.fetchall()
+            GroupAccess.objects.bulk_create(
+                [GroupAccess(group_id=group_id, content_type=ctype,
+                             object_id=object_id, read_access=True,
+                             write_access=write_access)
+                 for object_id, group_id in rows])
+        if not rows:
+            break
+        done += len(rows)
+        last = rows[-1]
+        logger.info("%s: added %d of %d group accesses.", Model.__name__,
+                    done, total)
+    return done
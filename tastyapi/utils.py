@@ -1,4 +1,69 @@
+import os
+import threading
+
+from django.db import connections, router
+from django.db.models import Max
+
+# Ids reserved by one nextval call, unless listed in BLOCK_SIZES.  The
+# sequences are created by database/MetPetDB_Id_Sequences.sql, which must
+# use the same increments.
+BLOCK_SIZE = 100
+# db_table -> ids reserved by one nextval call
+BLOCK_SIZES = {'regions': 1}
+
+# sequence name -> [next id, end of the block] reserved by this process
+_blocks = {}
+# sequence name -> whether the sequence exists
+_sequences = {}
+_blocks_pid = None
+_lock = threading.Lock()
+
+
+def get_sequence_name(model):
+    return "%s_id_block_seq" % model._meta.db_table
+
+
+def _has_sequence(connection, sequence):
+    if sequence not in _sequences:
+        if connection.vendor != 'postgresql':
+            _sequences[sequence] = False
+        else:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1 FROM pg_class "
+                           "WHERE relkind = 'S' AND relname = %s", [sequence])
+            _sequences[sequence] = cursor.fetchone() is not None
+    return _sequences[sequence]
+
+
 def get_next_id(model):
-    try: id = model.objects.latest().pk + 1
-    except model.DoesNotExist: id = 1
-    return id
+    """Return an unused primary key for a new instance of model.
+
+    Ids come from blocks reserved with a single nextval call on the
+    sequence of the model, so concurrent writers never pick the same id and
+    most calls do not touch the database.  Ids of a block left unused when
+    the process exits are skipped.  Without the sequence, falls back to one
+    more than the largest id in the table.
+    """
+    global _blocks_pid
+    db = router.db_for_write(model)
+    connection = connections[db]
+    sequence = get_sequence_name(model)
+    with _lock:
+        if _blocks_pid != os.getpid():
+            # A forked process must not hand out the blocks of its parent
+            _blocks.clear()
+            _blocks_pid = os.getpid()
+        if _has_sequence(connection, sequence):
+            block = _blocks.get(sequence)
+            if block is None or block[0] >= block[1]:
+                cursor = connection.cursor()
+                cursor.execute("SELECT nextval(%s)", [sequence])
+                start = cursor.fetchone()[0]
+                size = BLOCK_SIZES.get(model._meta.db_table, BLOCK_SIZE)
+                block = _blocks[sequence] = [start, start + size]
+            id = block[0]
+            block[0] += 1
+            return id
+    largest = model.objects.using(db).aggregate(
+        largest=Max(model._meta.pk.name))['largest']
+    return (largest or 0) + 1
@@ -0,0 +1,115 @@
+"""Process-local cache of the ids of vocabulary entries by name.
+
+Free-text fields and search parameters name regions, references, minerals
+and so on; looking each name up costs a query per entry.  The cache of a
+model is filled with the whole vocabulary, up to CACHE_SIZE entries, the
+first time it is used, and names missing from it are looked up together
+with one query.  Entries saved or deleted in this process update the cache
+through signals; entries created with bulk_create must be passed to add().
+Entries renamed or deleted by another process keep their old name here
+until the process restarts.
+"""
+import threading
+from collections import OrderedDict
+
+from django.db.models.signals import post_save, post_delete
+
+from .models import Region, Reference, Mineral, RockType, MetamorphicGrade, \
+                    MetamorphicRegion
+
+# Model -> field holding the name of its entries
+NAME_FIELDS = {Region: 'name',
+               Reference: 'name',
+               Mineral: 'name',
+               RockType: 'rock_type',
+               MetamorphicGrade: 'name',
+               MetamorphicRegion: 'name'}
+
+# Names kept per model; the least recently used go first
+CACHE_SIZE = 10000
+
+
+class Vocabulary(object):
+    """Ids of the entries of model by name, least recently used first."""
+    def __init__(self, model, size=CACHE_SIZE):
+        self.model = model
+        self.field = NAME_FIELDS[model]
+        self.size = size
+        self.ids = None
+        self.lock = threading.Lock()
+    def warm(self):
+        """Fill the cache with the first size entries of the vocabulary."""
+        rows = (self.model.objects.order_by(self.model._meta.pk.name)
+                .values_list(self.field, 'pk')[:self.size])
+        with self.lock:
+            self.ids = OrderedDict(rows)
+    def get_ids(self, names):
+        """Return the ids of the entries named in names, by name.
+
+        Names without an entry are left out.
+        """
+        if self.ids is None:
+            self.warm()
+        result = {}
+        missing = set()
+        with self.lock:
+            for name in names:
+                if name in self.ids:
+                    self.ids[name] = self.ids.pop(name)
+                    result[name] = self.ids[name]
+                else:
+                    missing.add(name)
+        if missing:
+            found = self.model.objects.filter(
+                **{self.field + '__in': missing}).values_list(self.field, 'pk')
+            found = list(found)
+            result.update(found)
+            self.add(found)
+        return result
+    def add(self, items):
+        """Remember the (name, id) pairs of items."""
+        with self.lock:
+            if self.ids is None:
+                return
+            for name, id in items:
+                self.ids.pop(name, None)
+                self.ids[name] = id
+            while len(self.ids) > self.size:
+                self.ids.popitem(last=False)
+    def discard(self, id):
+        """Forget the entry with the given id, whatever its name."""
+        with self.lock:
+            if self.ids is None:
+                return
+            for name in [name for name, value in self.ids.iteritems()
+                         if value == id]:
+                del self.ids[name]
+
+
+_vocabularies = dict((model, Vocabulary(model)) for model in NAME_FIELDS)
+
+
+def get_ids(model, names):
+    """Return the ids of the entries of model named in names, by name."""
+    return _vocabularies[model].get_ids(names)
+
+
+def add(model, objects):
+    """Remember the entries of model in objects, which were just created."""
+    field = NAME_FIELDS[model]
+    _vocabularies[model].add((getattr(obj, field), obj.pk) for obj in objects)
+
+
+def _entry_saved(sender, instance, **kwargs):
+    # A renamed entry must not be found under its old name
+    _vocabularies[sender].discard(instance.pk)
+    add(sender, [instance])
+
+def _entry_deleted(sender, instance, **kwargs):
+    _vocabularies[sender].discard(instance.pk)
+
+for model in NAME_FIELDS:
+    post_save.connect(_entry_saved, sender=model,
+                      dispatch_uid='vocabulary_saved_%s' % model.__name__)
+    post_delete.connect(_entry_deleted, sender=model,
+                        dispatch_uid='vocabulary_deleted_%s' % model.__name__)
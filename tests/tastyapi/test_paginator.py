@@ -0,0 +1,33 @@
+from unittest import TestCase
+import nose.tools as nt
+from tastyapi.paginator import encode_cursor, decode_cursor
+
+
+class CursorTest(TestCase):
+
+    def test_round_trip(self):
+        for key in [0, 1, 42, 1000, 123456789, 2 ** 40]:
+            nt.assert_equal(decode_cursor(encode_cursor(key)), key)
+
+    def test_no_padding(self):
+        for key in [1, 12, 123, 1234]:
+            nt.assert_false('=' in encode_cursor(key))
+
+    def test_url_safe(self):
+        for key in range(0, 5000, 7):
+            cursor = encode_cursor(key)
+            nt.assert_false('+' in cursor or '/' in cursor)
+
+    def test_unicode_cursor(self):
+        # query strings arrive as unicode
+        nt.assert_equal(decode_cursor(unicode(encode_cursor(77))), 77)
+
+    def test_empty_cursor(self):
+        nt.assert_is_none(decode_cursor(''))
+        nt.assert_is_none(decode_cursor(None))
+
+    def test_invalid_cursor(self):
+        # not base64
+        nt.assert_raises(ValueError, decode_cursor, '!!!')
+        # base64 of something other than a key
+        nt.assert_raises(ValueError, decode_cursor, 'YWJj')
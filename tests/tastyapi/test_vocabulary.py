@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from unittest import TestCase
+import nose.tools as nt
+from tastyapi.models import Region
+from tastyapi.vocabulary import Vocabulary
+
+
+class VocabularyTest(TestCase):
+
+    def setUp(self):
+        # filled by hand instead of warm(), so no query is run
+        self.vocabulary = Vocabulary(Region, size=3)
+        self.vocabulary.ids = OrderedDict([('alps', 1), ('andes', 2),
+                                           ('urals', 3)])
+
+    def test_get_ids(self):
+        nt.assert_equal(self.vocabulary.get_ids(['alps', 'urals']),
+                        {'alps': 1, 'urals': 3})
+
+    def test_add_evicts_least_recently_used(self):
+        self.vocabulary.add([('tibet', 4)])
+        nt.assert_equal(list(self.vocabulary.ids),
+                        ['andes', 'urals', 'tibet'])
+
+    def test_get_ids_marks_used(self):
+        self.vocabulary.get_ids(['alps'])
+        self.vocabulary.add([('tibet', 4)])
+        nt.assert_equal(list(self.vocabulary.ids),
+                        ['urals', 'alps', 'tibet'])
+
+    def test_add_known_name(self):
+        self.vocabulary.add([('alps', 5)])
+        nt.assert_equal(self.vocabulary.ids.items(),
+                        [('andes', 2), ('urals', 3), ('alps', 5)])
+
+    def test_discard(self):
+        self.vocabulary.discard(2)
+        nt.assert_equal(list(self.vocabulary.ids), ['alps', 'urals'])
+
+    def test_discard_every_name(self):
+        # a renamed entry may be known under its old and new names
+        self.vocabulary.add([('ural mountains', 3)])
+        self.vocabulary.discard(3)
+        nt.assert_equal(list(self.vocabulary.ids), ['andes'])
+
+    def test_discard_unknown(self):
+        self.vocabulary.discard(9)
+        nt.assert_equal(len(self.vocabulary.ids), 3)
+
+    def test_cold(self):
+        vocabulary = Vocabulary(Region, size=3)
+        # add() and discard() wait for warm() to read the whole vocabulary
+        vocabulary.add([('alps', 1)])
+        vocabulary.discard(1)
+        nt.assert_is_none(vocabulary.ids)
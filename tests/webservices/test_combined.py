@@ -0,0 +1,101 @@
+from unittest import TestCase
+import nose.tools as nt
+import webservices.db
+from webservices.db import _DbGetQuery
+
+INT4 = 23
+FLOAT8 = 701
+# a type psycopg2 has no converter for, left as text
+UNKNOWN = 99999
+
+
+class OpsStub(object):
+
+    def quote_name(self, name):
+        return '"%s"' % name
+
+
+class CursorStub(object):
+    """ Answers the LIMIT 0 queries reading the columns of the many-queries
+        from columns and any other query with the row of the combined query.
+
+    """
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        if query.endswith("LIMIT 0"):
+            for many, columns in self.columns.iteritems():
+                if many in query:
+                    self.description = columns
+        else:
+            self.description = [(name,) for name in sorted(self.row)]
+
+    def fetchone(self):
+        return tuple(self.row[name] for name in sorted(self.row))
+
+
+class ConnectionStub(object):
+    vendor = 'postgresql'
+    ops = OpsStub()
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+class Query(_DbGetQuery):
+
+    def __init__(self):
+        self.oneQuery = "SELECT 1 AS id"
+        self.manyQueries = {"minerals": "SELECT minerals",
+                            "notes": "SELECT notes"}
+
+
+class CombinedTest(TestCase):
+
+    def setUp(self):
+        self.con = webservices.db.con
+        self.cursor = CursorStub(
+            {"SELECT minerals": [("mineral_id", INT4), ("amount", FLOAT8)],
+             "SELECT notes": [("note", UNKNOWN)]},
+            {"id": 1, "minerals": ["4", "0.5", "7", None], "notes": []})
+        webservices.db.con = ConnectionStub(self.cursor)
+        _DbGetQuery.manyColumns.clear()
+
+    def tearDown(self):
+        webservices.db.con = self.con
+        _DbGetQuery.manyColumns.clear()
+
+    def test_rows(self):
+        data = Query().execute({})
+        nt.assert_equal(data, {
+            "id": 1,
+            "minerals": [{"mineral_id": 4, "amount": 0.5},
+                         {"mineral_id": 7, "amount": None}],
+            "notes": []})
+
+    def test_one_round_trip(self):
+        Query().execute({})
+        Query().execute({})
+        # the columns are read once, then each object costs one query
+        nt.assert_equal(len(self.cursor.queries), 4)
+
+    def test_query(self):
+        query = Query()
+        columns = {"minerals": [("mineral_id", INT4), ("amount", FLOAT8)],
+                   "notes": [("note", UNKNOWN)]}
+        nt.assert_equal(
+            query.combinedQuery(columns),
+            'SELECT one.*, '
+            'ARRAY(SELECT unnest(ARRAY[many."mineral_id"::text, '
+            'many."amount"::text]) FROM (SELECT minerals) many) '
+            'AS "minerals", '
+            'ARRAY(SELECT unnest(ARRAY[many."note"::text]) '
+            'FROM (SELECT notes) many) AS "notes" '
+            'FROM (SELECT 1 AS id) one')
@@ -0,0 +1,116 @@
+from unittest import TestCase
+import nose.tools as nt
+import webservices.db
+from webservices.db import _DbBatchGetQuery
+from webservices.sample import SampleBatchObject
+
+
+class CursorStub(object):
+    """ Answers each query with the rows given for it in results, a map of
+        query to (columns, rows).
+
+    """
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        columns, self.rows = self.results[query]
+        self.description = [(column,) for column in columns]
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+class ConnectionStub(object):
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+class BatchQuery(_DbBatchGetQuery):
+
+    def __init__(self):
+        self.oneQuery = "one"
+        self.manyQueries = {"aliases": "aliases", "minerals": "minerals"}
+
+
+class DbBatchGetQueryTest(TestCase):
+
+    def setUp(self):
+        self.con = webservices.db.con
+
+    def tearDown(self):
+        webservices.db.con = self.con
+
+    def execute(self, results):
+        self.cursor = CursorStub(results)
+        webservices.db.con = ConnectionStub(self.cursor)
+        return BatchQuery().execute({"sample_ids": [1, 2, 3]})
+
+    def test_grouped_by_parent(self):
+        data = self.execute({
+            "one": (["id", "number"], [(2, "b"), (1, "a")]),
+            "aliases": (["parent_id", "name"],
+                        [(1, "a1"), (2, "b1"), (1, "a2")]),
+            "minerals": (["parent_id", "name"], [(2, "quartz")])
+        })
+        nt.assert_equal(data, {"*": [
+            {"id": 2, "number": "b", "aliases": [{"name": "b1"}],
+             "minerals": [{"name": "quartz"}]},
+            {"id": 1, "number": "a",
+             "aliases": [{"name": "a1"}, {"name": "a2"}], "minerals": []}
+        ]})
+
+    def test_unknown_parent(self):
+        data = self.execute({
+            "one": (["id"], [(1,)]),
+            "aliases": (["parent_id", "name"], [(1, "a1"), (9, "x")]),
+            "minerals": (["parent_id", "name"], [])
+        })
+        nt.assert_equal(data, {"*": [
+            {"id": 1, "aliases": [{"name": "a1"}], "minerals": []}]})
+
+    def test_no_objects(self):
+        data = self.execute({"one": (["id"], [])})
+        nt.assert_equal(data, {"*": []})
+        # nothing to group, the many-queries are not run
+        nt.assert_equal(self.cursor.queries, ["one"])
+
+
+class BatchQueryStub(object):
+    """ Returns the samples of rows with an id in ids, in the order of
+        rows, like the database may.
+
+    """
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, conditions):
+        return {"*": [dict(row) for row in self.rows
+                      if row["id"] in conditions["sample_ids"]]}
+
+
+class SampleBatchObjectTest(TestCase):
+
+    def get(self, ids):
+        batch = SampleBatchObject()
+        batch.getQuery = BatchQueryStub([{"id": 1}, {"id": 2}, {"id": 3}])
+        exists = batch.get(ids)
+        return exists, [data["id"] for data in batch.attributes["*"]]
+
+    def test_order_of_ids(self):
+        nt.assert_equal(self.get([3, 1, 2]), (True, [3, 1, 2]))
+
+    def test_missing_ids(self):
+        nt.assert_equal(self.get([4, 2, 1]), (True, [2, 1]))
+
+    def test_repeated_ids(self):
+        nt.assert_equal(self.get([2, 3, 2]), (True, [2, 3]))
+
+    def test_no_samples(self):
+        nt.assert_equal(self.get([4]), (False, []))
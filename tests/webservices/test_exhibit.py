@@ -0,0 +1,53 @@
+from unittest import TestCase
+import nose.tools as nt
+from webservices.exhibit import _Children
+
+
+class ChildrenTest(TestCase):
+
+    def setUp(self):
+        # parent id, value; ordered by parent id like the child queries
+        self.children = _Children([(1, 'a'), (1, 'b'), (3, 'c'), (5, 'd')])
+
+    def test_get(self):
+        nt.assert_equal(self.children.get(1), [('a',), ('b',)])
+        nt.assert_equal(self.children.get(3), [('c',)])
+
+    def test_missing_key(self):
+        nt.assert_equal(self.children.get(2), [])
+        nt.assert_equal(self.children.get(3), [('c',)])
+
+    def test_skipped_keys(self):
+        nt.assert_equal(self.children.get(5), [('d',)])
+        nt.assert_equal(self.children.get(6), [])
+
+    def test_same_key_twice(self):
+        nt.assert_equal(self.children.get(1), [('a',), ('b',)])
+        nt.assert_equal(self.children.get(1), [('a',), ('b',)])
+
+    def test_column(self):
+        nt.assert_equal(self.children.column(1), ['a', 'b'])
+        nt.assert_equal(self.children.column(2), [])
+
+    def test_first(self):
+        nt.assert_equal(self.children.first(1), 'a')
+        nt.assert_equal(self.children.first(2, 'none'), 'none')
+        nt.assert_is_none(self.children.first(4))
+
+    def test_no_rows(self):
+        children = _Children([])
+        nt.assert_equal(children.get(1), [])
+
+    def test_key_length(self):
+        children = _Children([(1, 10, 'x'), (1, 10, 'y'), (1, 11, 'z'),
+                              (2, 10, 'w')], keyLength=2)
+        nt.assert_equal(children.column((1, 10)), ['x', 'y'])
+        nt.assert_equal(children.column((1, 11)), ['z'])
+        nt.assert_equal(children.column((2, 9)), [])
+        nt.assert_equal(children.column((2, 10)), ['w'])
+
+    def test_iterator(self):
+        # the rows of stream() come from a generator read once
+        children = _Children(iter([(1, 'a'), (2, 'b')]))
+        nt.assert_equal(children.column(1), ['a'])
+        nt.assert_equal(children.column(2), ['b'])
@@ -0,0 +1,131 @@
+from unittest import TestCase
+import itertools
+import nose.tools as nt
+from webservices.SampleQuery import SampleQuery, FACET_FIELDS
+from webservices.facetindex import FacetIndex, facet_value, popcount
+from webservices.facetcache import FACETS
+
+# sample id -> facet name -> list of (id, label), as full_sample_results
+# joins them
+samples = {
+    1: {'owner': [(139, 'owner a')], 'rock_type': [(3, 'gneiss')],
+        'country': [('Brazil', 'Brazil')],
+        'mineral': [(10, 'garnet'), (11, 'quartz')],
+        'region': [(-1, '')], 'metamorphic_region': [(-1, '')],
+        'metamorphic_grade': [(7, 'amphibolite')],
+        'publication': [(None, None)]},
+    2: {'owner': [(140, 'owner b')], 'rock_type': [(3, 'gneiss')],
+        'country': [('Norway', 'Norway')], 'mineral': [(11, 'quartz')],
+        'region': [(52, 'north'), (53, 'south')],
+        'metamorphic_region': [(-1, '')],
+        'metamorphic_grade': [(7, 'amphibolite'), (8, 'eclogite')],
+        'publication': [(4, 'author')]},
+    3: {'owner': [(139, 'owner a')], 'rock_type': [(5, 'schist')],
+        'country': [('Brazil', 'Brazil')], 'mineral': [(-1, '')],
+        'region': [(52, 'north')], 'metamorphic_region': [(2, 'alps')],
+        'metamorphic_grade': [(8, 'eclogite')],
+        'publication': [(4, 'author')]},
+}
+
+fields = dict((name, FACET_FIELDS[name].split(",")[0].strip())
+              for name in FACET_FIELDS)
+
+
+def view_rows():
+    names = sorted(FACET_FIELDS)
+    for sample_id in sorted(samples):
+        for values in itertools.product(
+                *[samples[sample_id][name] for name in names]):
+            yield sample_id, dict(zip(names, values))
+
+
+def sql_facets(query):
+    """ What the SQL of SampleQuery returns, evaluated row by row. """
+    selections = dict(query.get_selection_key())
+    matching = []
+    for (sample_id, row) in view_rows():
+        if all(row[name][0] in selections[fields[name]]
+               for name in FACET_FIELDS if fields[name] in selections):
+            matching.append((sample_id, row))
+    facets = {}
+    for (returntype, name) in FACETS:
+        counts = {}
+        for (sample_id, row) in matching:
+            counts.setdefault(row[name], set()).add(sample_id)
+        facets[returntype] = sorted(
+            facet_value(id, label, len(ids))
+            for ((id, label), ids) in counts.iteritems())
+    count = len(set(sample_id for (sample_id, row) in matching))
+    return count, facets
+
+
+class FacetIndexTest(TestCase):
+
+    def setUp(self):
+        rows = {}
+        for name in FACET_FIELDS:
+            rows[name] = [(sample_id, id, label)
+                          for sample_id in samples
+                          for (id, label) in samples[sample_id][name]]
+        self.index = FacetIndex(rows)
+
+    def check(self, query):
+        (count, facets) = sql_facets(query)
+        nt.assert_equal(self.index.get_count(query), count)
+        got = self.index.get_facets(query)
+        for (returntype, name) in FACETS:
+            nt.assert_equal(sorted(got[returntype]), facets[returntype])
+
+    def test_no_conditions(self):
+        self.check(SampleQuery())
+
+    def test_conditions(self):
+        self.check(SampleQuery(rock_type=['3']))
+        self.check(SampleQuery(mineral_id=['11'], region_id=['52', '53']))
+        self.check(SampleQuery(owner_id=[139], mineral_id=[-1, 10]))
+        self.check(SampleQuery(country=["'Brazil'"],
+                               metamorphic_grade_id=['8']))
+
+    def test_conditions_not_set(self):
+        # SampleQuery ignores these selections unless another one is set
+        query = SampleQuery(metamorphic_grade_id=['8'])
+        nt.assert_equal(self.index.get_count(query), 3)
+        self.check(query)
+
+    def test_sample_ids(self):
+        nt.assert_equal(
+            self.index.get_sample_ids(SampleQuery(mineral_id=['11'])),
+            [1, 2])
+
+    def test_quoted_country(self):
+        nt.assert_equal(self.index.get_count(SampleQuery(country=['Brazil'])),
+                        2)
+        nt.assert_equal(
+            self.index.get_count(SampleQuery(country=["'Brazil'"])), 2)
+
+    def test_sample_ids_page(self):
+        query = SampleQuery()
+        nt.assert_equal(self.index.get_sample_ids(query, 2), [1, 2])
+        nt.assert_equal(self.index.get_sample_ids(query, 2, 2), [3])
+        nt.assert_equal(self.index.get_sample_ids(query, 2, 3), [])
+        nt.assert_equal(
+            self.index.get_sample_ids(SampleQuery(mineral_id=['11']), 5, 1),
+            [2])
+
+    def test_disjoint_values(self):
+        # no sample of mineral 10 is in region 52, so it is skipped
+        query = SampleQuery(mineral_id=['10', '11'], region_id=['52'])
+        self.check(query)
+        minerals = self.index.get_facets(query)['mineral_facet']
+        nt.assert_equal([value['id'] for value in minerals], [u'11'])
+
+    def test_no_match(self):
+        self.check(SampleQuery(rock_type=['4']))
+
+
+class PopcountTest(TestCase):
+
+    def test_popcount(self):
+        for bitmap in [0, 1, 2, 255, 256, 0x1f0f, (1 << 1000) | 5,
+                       (1 << 4099) - 1]:
+            nt.assert_equal(popcount(bitmap), bin(bitmap).count('1'))
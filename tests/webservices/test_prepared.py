@@ -0,0 +1,92 @@
+from unittest import TestCase
+import nose.tools as nt
+import webservices.util
+from webservices.util import execute_prepared
+
+
+class CursorStub(object):
+    """ Records the statements executed; fails the ones containing fail. """
+    def __init__(self, fail=None, count=0):
+        self.fail = fail
+        self.count = count
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+        if self.fail and self.fail in query:
+            raise RuntimeError(query)
+
+    def fetchone(self):
+        return (self.count,)
+
+
+class ConnectionStub(object):
+    vendor = 'postgresql'
+    connection = object()
+
+
+QUERY = "SELECT * FROM samples WHERE sample_id = ANY(%(ids)s) " \
+        "AND owner_id = ANY(%(owners)s) OR sample_id = ANY(%(ids)s)"
+
+
+class ExecutePreparedTest(TestCase):
+
+    def setUp(self):
+        self.con = webservices.util.con
+        webservices.util.con = ConnectionStub()
+
+    def tearDown(self):
+        webservices.util.con = self.con
+
+    def test_first_execution(self):
+        cursor = CursorStub()
+        execute_prepared(cursor, QUERY, {'ids': [1], 'owners': [2]})
+        [(query, params)] = cursor.executed
+        nt.assert_true(query.startswith("PREPARE prepared_"))
+        nt.assert_true("sample_id = ANY($1) AND owner_id = ANY($2) "
+                       "OR sample_id = ANY($1)" in query)
+        nt.assert_true(query.endswith(" (%s, %s)"))
+        nt.assert_equal(params, [[1], [2]])
+
+    def test_reused(self):
+        execute_prepared(CursorStub(), QUERY, {'ids': [1], 'owners': [2]})
+        cursor = CursorStub()
+        execute_prepared(cursor, QUERY, {'ids': [3], 'owners': [4]})
+        [(query, params)] = cursor.executed
+        nt.assert_true(query.startswith("EXECUTE prepared_"))
+        nt.assert_equal(params, [[3], [4]])
+
+    def test_new_connection(self):
+        execute_prepared(CursorStub(), QUERY, {'ids': [1], 'owners': [2]})
+        # Django reconnected
+        webservices.util.con.connection = object()
+        cursor = CursorStub()
+        execute_prepared(cursor, QUERY, {'ids': [1], 'owners': [2]})
+        nt.assert_true(cursor.executed[0][0].startswith("PREPARE"))
+
+    def failFirstExecution(self):
+        nt.assert_raises(RuntimeError, execute_prepared,
+                         CursorStub(fail="PREPARE"), QUERY,
+                         {'ids': [1], 'owners': [2]})
+
+    def test_failed_but_prepared(self):
+        self.failFirstExecution()
+        # the statement is looked up before being prepared again
+        cursor = CursorStub(count=1)
+        execute_prepared(cursor, QUERY, {'ids': [1], 'owners': [2]})
+        nt.assert_true("pg_prepared_statements" in cursor.executed[0][0])
+        nt.assert_true(cursor.executed[1][0].startswith("EXECUTE"))
+
+    def test_failed_not_prepared(self):
+        self.failFirstExecution()
+        cursor = CursorStub(count=0)
+        execute_prepared(cursor, QUERY, {'ids': [1], 'owners': [2]})
+        nt.assert_true("pg_prepared_statements" in cursor.executed[0][0])
+        nt.assert_true(cursor.executed[1][0].startswith("PREPARE"))
+
+    def test_no_parameters(self):
+        cursor = CursorStub()
+        execute_prepared(cursor, "SELECT 1", {})
+        [(query, params)] = cursor.executed
+        nt.assert_true(query.endswith("; EXECUTE " + query.split()[1]))
+        nt.assert_equal(params, [])
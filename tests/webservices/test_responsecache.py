@@ -0,0 +1,125 @@
+from unittest import TestCase
+import nose.tools as nt
+from django.test.client import RequestFactory
+import webservices.responsecache as responsecache
+from webservices.responsecache import etag_matches, cached_json, get_key, \
+    get_version
+
+
+class CacheStub(object):
+    """ The part of Django's cache API the module uses, in a dict. """
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.entries[key] = value
+
+
+class ObjectStub(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def request(etags=None):
+    factory = RequestFactory()
+    if etags is None:
+        return factory.get('/')
+    return factory.get('/', HTTP_IF_NONE_MATCH=etags)
+
+
+class EtagMatchesTest(TestCase):
+
+    def test_no_header(self):
+        nt.assert_false(etag_matches(request(), '"a"'))
+
+    def test_match(self):
+        nt.assert_true(etag_matches(request('"a"'), '"a"'))
+
+    def test_list(self):
+        nt.assert_true(etag_matches(request('"b", "a"'), '"a"'))
+        nt.assert_false(etag_matches(request('"b", "c"'), '"a"'))
+
+    def test_star(self):
+        nt.assert_true(etag_matches(request('*'), '"a"'))
+
+    def test_unquoted(self):
+        nt.assert_false(etag_matches(request('a'), '"a"'))
+
+
+class CachedJsonTest(TestCase):
+
+    def setUp(self):
+        self.cache = responsecache.cache
+        self.get_version = responsecache.get_version
+        responsecache.cache = CacheStub()
+        self.version = 1
+        responsecache.get_version = lambda page, id: self.version
+        self.made = 0
+
+    def tearDown(self):
+        responsecache.cache = self.cache
+        responsecache.get_version = self.get_version
+
+    def make_object(self, id):
+        self.made += 1
+        return ObjectStub('{"id": %s, "version": %s}' % (id, self.version))
+
+    def get(self, etags=None):
+        return cached_json(request(etags), 'sample', 7, self.make_object)
+
+    def test_cached(self):
+        first = self.get()
+        second = self.get()
+        nt.assert_equal(first.status_code, 200)
+        nt.assert_equal(second.content, first.content)
+        nt.assert_equal(second['ETag'], first['ETag'])
+        nt.assert_equal(self.made, 1)
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        response = self.get(etag)
+        nt.assert_equal(response.status_code, 304)
+        nt.assert_equal(response['ETag'], etag)
+        nt.assert_equal(self.made, 1)
+
+    def test_stale_etag(self):
+        response = self.get('"stale"')
+        nt.assert_equal(response.status_code, 200)
+        nt.assert_equal(response.content, '{"id": 7, "version": 1}')
+
+    def test_new_version(self):
+        etag = self.get()['ETag']
+        self.version = 2
+        response = self.get(etag)
+        nt.assert_equal(response.status_code, 200)
+        nt.assert_equal(response.content, '{"id": 7, "version": 2}')
+        nt.assert_false(response['ETag'] == etag)
+        nt.assert_equal(self.made, 2)
+
+    def test_missing_row(self):
+        self.version = None
+        response = self.get('*')
+        nt.assert_equal(response.status_code, 200)
+        nt.assert_false(response.has_header('ETag'))
+        nt.assert_false(get_key('sample', 7) in responsecache.cache.entries)
+
+
+class GetVersionTest(TestCase):
+
+    def setUp(self):
+        self.has_page_versions = responsecache.has_page_versions
+        responsecache.has_page_versions = lambda: False
+
+    def tearDown(self):
+        responsecache.has_page_versions = self.has_page_versions
+
+    def test_no_page_versions(self):
+        # without MetPetDB_Page_Versions.sql nothing is cached
+        nt.assert_is_none(get_version('sample', 7))
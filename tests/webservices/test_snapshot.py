@@ -0,0 +1,152 @@
+from unittest import TestCase
+import nose.tools as nt
+from webservices.snapshot import SamplesSnapshot, ChemicalAnalysesSnapshot, \
+    SAMPLE_TABLES, ANALYSIS_TABLES
+
+
+class Touched(object):
+    """ Answers touched() from a map of table to touched keys instead of
+        reading the *_dup tables.
+
+    """
+    touchedKeys = {}
+
+    def touched(self, table, mark):
+        return self.touchedKeys.get(table, set())
+
+
+class SamplesSnapshotStub(Touched, SamplesSnapshot):
+    pass
+
+
+class ChemicalAnalysesSnapshotStub(Touched, ChemicalAnalysesSnapshot):
+    pass
+
+
+def marks(tables):
+    return dict((table, [0, 0]) for table in tables)
+
+
+class SamplesSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.snapshot = SamplesSnapshotStub("samples.json")
+        self.marks = marks(SAMPLE_TABLES)
+
+    def test_changed_versions(self):
+        old = {1: 1, 2: 1}
+        new = {1: 1, 2: 2, 3: 1}
+        nt.assert_equal(self.snapshot.changed(old, new, self.marks), set([2, 3]))
+
+    def test_touched_lists(self):
+        self.snapshot.touchedKeys = {"sample_minerals_dup": set([1])}
+        nt.assert_equal(self.snapshot.changed({1: 1}, {1: 1}, self.marks),
+                        set([1]))
+
+    def test_missing_mark_rebuilds(self):
+        nt.assert_is_none(self.snapshot.changed({1: 1}, {1: 1}, {}))
+
+    def test_removed_rows_rebuild(self):
+        self.snapshot.touched = lambda table, mark: None
+        nt.assert_is_none(self.snapshot.changed({1: 1}, {1: 1}, self.marks))
+
+
+class ChemicalAnalysesSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.snapshot = ChemicalAnalysesSnapshotStub("analyses.json")
+        self.marks = marks(SAMPLE_TABLES + ANALYSIS_TABLES)
+        # analysis id -> sample id, subsample id, versions
+        self.old = {10: [1, 100, 1, 1, 1], 11: [1, 100, 1, 1, 1],
+                    20: [2, 200, 1, 1, 1]}
+
+    def test_unchanged(self):
+        nt.assert_equal(
+            self.snapshot.changed(self.old, dict(self.old), self.marks),
+            set())
+
+    def test_changed_analysis_exports_its_sample(self):
+        new = dict(self.old)
+        new[10] = [1, 100, 2, 1, 1]
+        nt.assert_equal(self.snapshot.changed(self.old, new, self.marks),
+                        set([10, 11]))
+
+    def test_touched_sample_lists(self):
+        self.snapshot.touchedKeys = {"sample_regions_dup": set([2])}
+        nt.assert_equal(
+            self.snapshot.changed(self.old, dict(self.old), self.marks),
+            set([20]))
+
+    def test_touched_analysis_lists(self):
+        self.snapshot.touchedKeys = {"chemical_analysis_oxides_dup": set([20])}
+        nt.assert_equal(
+            self.snapshot.changed(self.old, dict(self.old), self.marks),
+            set([20]))
+
+    def test_touched_private_analysis(self):
+        # 999 is not in the feed, its oxides changed all the same
+        self.snapshot.touchedKeys = {
+            "chemical_analysis_oxides_dup": set([999]),
+            "chemical_analysis_elements_dup": set([999, 11])}
+        nt.assert_equal(
+            self.snapshot.changed(self.old, dict(self.old), self.marks),
+            set([10, 11]))
+
+    def test_deleted_analysis(self):
+        new = dict(self.old)
+        del new[20]
+        nt.assert_equal(self.snapshot.changed(self.old, new, self.marks),
+                        set())
+
+
+class RowsStub(SamplesSnapshot):
+    """ Answers the queries of touched() from the rows of a *_dup table as
+        (id, sample_id, xmin) triples.
+
+    """
+    dupRows = []
+
+    def rows(self, query, params=None):
+        if query.startswith("SELECT md5"):
+            xmins = [xmin for (id, key, xmin) in self.dupRows
+                     if id <= params[0]]
+            return [(",".join(xmins),)]
+        if query.startswith("SELECT COUNT"):
+            return [(len(self.dupRows),)]
+        if query.startswith("SELECT COALESCE"):
+            return [(max(id for (id, key, xmin) in self.dupRows),
+                     len(self.dupRows))]
+        return [(key,) for (id, key, xmin) in self.dupRows if id > params[0]]
+
+
+class TouchedTest(TestCase):
+
+    def setUp(self):
+        self.snapshot = RowsStub("samples.json")
+        self.snapshot.dupRows = [(1, 10, "100"), (2, 11, "100")]
+        self.mark = self.snapshot.marks()["sample_minerals_dup"]
+
+    def test_unchanged(self):
+        nt.assert_equal(self.snapshot.touched("sample_minerals_dup",
+                                              self.mark), set())
+
+    def test_added(self):
+        self.snapshot.dupRows.append((3, 12, "105"))
+        nt.assert_equal(self.snapshot.touched("sample_minerals_dup",
+                                              self.mark), set([12]))
+
+    def test_removed(self):
+        del self.snapshot.dupRows[0]
+        self.snapshot.dupRows.append((3, 12, "105"))
+        nt.assert_is_none(self.snapshot.touched("sample_minerals_dup",
+                                                self.mark))
+
+    def test_updated_in_place(self):
+        # same ids and count, new xmin
+        self.snapshot.dupRows[1] = (2, 12, "105")
+        nt.assert_is_none(self.snapshot.touched("sample_minerals_dup",
+                                                self.mark))
+
+    def test_mark_without_stamp(self):
+        nt.assert_is_none(self.snapshot.touched("sample_minerals_dup",
+                                                self.mark[:2]))
@@ -0,0 +1,38 @@
+"""
+   Counts the queries issued by the Exhibit feed exports and reports
+   them per 1,000 items, together with the wall clock time.
+
+   Run from the project root against a populated database:
+       python utility/benchmarkExports.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'metpetdb.settings')
+
+from django.conf import settings
+from django.db import connection, reset_queries
+from webservices.exhibit import SamplesExport, ChemicalAnalysesExport
+
+
+def benchmark(name, export):
+	# queries are only recorded by the debug cursor
+	settings.DEBUG = True
+	reset_queries()
+	start = time.time()
+	items = export.items()
+	elapsed = time.time() - start
+	queries = len(connection.queries)
+	if items:
+		perThousand = queries * 1000.0 / len(items)
+	else:
+		perThousand = float(queries)
+	print "%s: %d items, %d queries (%.2f per 1,000 items), %.2fs" % \
+		(name, len(items), queries, perThousand, elapsed)
+
+
+if __name__=="__main__":
+	benchmark("samples", SamplesExport())
+	benchmark("chemical analyses", ChemicalAnalysesExport())
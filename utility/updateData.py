@@ -1,25 +1,47 @@
 import urllib2
+import shutil
 import sys
+import os
 
+#bytes copied to disk at a time
+CHUNK_SIZE=65536
 
 def getSamples(filePath):
-        response = urllib2.urlopen('http://metpetdb.rpi.edu/metpetdb-py/webservices/samples')
+        response = urllib2.urlopen('http://metpetdb.rpi.edu/metpetdb-py/webservices/samples?stream=1')
 	fileObj=open(filePath+'web/samples/samples.json','w')
-	fileObj.write(str(response.read()))
+	shutil.copyfileobj(response, fileObj, CHUNK_SIZE)
+	fileObj.close()
 
 def getChemicalAnalyses(filePath):
-        response = urllib2.urlopen('http://metpetdb.rpi.edu/metpetdb-py/webservices/chemicalanalyses')
+        response = urllib2.urlopen('http://metpetdb.rpi.edu/metpetdb-py/webservices/chemicalanalyses?stream=1')
         fileObj=open(filePath+'web/chemical_analyses/chemical_analyses.json','w')
-	fileObj.write(str(response.read()))
+	shutil.copyfileobj(response, fileObj, CHUNK_SIZE)
+	fileObj.close()
 
+def updateSnapshots(filePath):
+	# talks to the database directly instead of the webservice, and only
+	# re-exports the items that changed since the last run
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+	os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'metpetdb.settings')
+	from webservices.snapshot import SamplesSnapshot, ChemicalAnalysesSnapshot
+	for snapshot in [SamplesSnapshot(filePath+'web/samples/samples.json'),
+			 ChemicalAnalysesSnapshot(filePath+'web/chemical_analyses/chemical_analyses.json')]:
+		exported=snapshot.update()
+		if exported is None:
+			print snapshot.path+": rebuilt"
+		else:
+			print snapshot.path+": "+str(exported)+" items exported"
 
 
 
 if __name__=="__main__":
 	try:
 		filePath=sys.argv[1]
-		getSamples(filePath)
-        	getChemicalAnalyses(filePath)
+		if '--incremental' in sys.argv[2:]:
+			updateSnapshots(filePath)
+		else:
+			getSamples(filePath)
+			getChemicalAnalyses(filePath)
 	except Exception as e:
-		print "Exception :"+str(e)+" Please enter filePath. Eg: /home/user/projectfolder/"
+		print "Exception :"+str(e)+" Please enter filePath. Eg: /home/user/projectfolder/ [--incremental]"
 
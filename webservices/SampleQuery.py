@@ -21,24 +21,45 @@
    condition. To be used to double check whether to load all of them
    to the interface. Use: q.get_count()
 
+   All Facets Query: will return the values and counts of every facet
+   in a single query. Use: q.get_all_facets()
+
    Limit Query: instead of returning all the tuples in Where, we can
-   limit them to a specific number, N. Use: q.get_main_limit(N)
+   limit them to a specific number, N. Use: q.get_main(N)
+   The next N are those after the last sample_id S of the previous
+   ones. Use: q.get_main(N, S)
 
 
-   To do: 
+   Every query is returned as a (query string, parameters) pair to be
+   passed to cursor.execute. The selected values are sent as array
+   parameters, so the text of a query only depends on which fields have
+   a selection and PostgreSQL can reuse its plan.
 
-   1. For queries, we can return the query string and the parameters
-   separately.  We need to figure out how to use them in the code. The
-   WHERE query then needs to be changed.
+   To do: 
 
-   2. Add the counts to the WHERE query.
+   1. Add the counts to the WHERE query.
 
 """
 
+from webservices.util import has_counts, has_materialized_results
+
+# Columns of the view holding the id and the label of each facet
+FACET_FIELDS = {
+    'owner': "owner_id, owner_name ",
+    'rock_type': "rock_type_id, rock_type_name ",
+    'country': "country, country ",
+    'mineral': "sample_mineral_id, sample_mineral_name ",
+    'region': "sample_region_id, sample_region_name ",
+    'metamorphic_region': "sample_metamorphic_region_id, sample_metamorphic_region",
+    'metamorphic_grade': "sample_metamorphic_grade_id, sample_metamorphic_grade",
+    'publication': "publication_id, author"
+}
+
 
 class SampleQuery(object):
     """ Query object for sample searches. Queries the view given by
-        VIEW_NAME (current full sample results)
+        VIEW_NAME (current full sample results), or its indexed copy
+        MATERIALIZED_VIEW_NAME when it has been installed.
         Holds all query conditions in lists with names _selections
         and constructs queries for the given conditions.
 
@@ -64,6 +85,7 @@ class SampleQuery(object):
         self.publication_id_selections = publication_id
         self.VIEW_NAME = 'full_sample_results'
         self.SHORT_VIEW_NAME = 'basic_sample_results'
+        self.MATERIALIZED_VIEW_NAME = 'full_sample_results_mat'
         if len (rock_type + country + owner_id + mineral_id + region_id) == 0:
             self.conditions_set = False
         else:
@@ -83,7 +105,17 @@ class SampleQuery(object):
                   len(self.publication_id_selections)) == 0:
             return self.SHORT_VIEW_NAME
         else:
-            return self.VIEW_NAME
+            return self.get_full_view_name()
+
+    def get_full_view_name( self ):
+        """ The indexed copy of VIEW_NAME kept by
+            database/MetPetDB_Sample_Results.sql once it has been
+            installed, VIEW_NAME otherwise.
+
+        """
+        if has_materialized_results():
+            return self.MATERIALIZED_VIEW_NAME
+        return self.VIEW_NAME
 
     def set_rock_type( self, rock_type_list ):
         """ Specify a list of rock_type_ids as input, -1 for null values. """
@@ -146,42 +178,84 @@ class SampleQuery(object):
         """
         (where_str, params) = self.get_where()
         str = "SELECT " + field + ", count(distinct sample_id) " \
-            "FROM " + self.VIEW_NAME + " " + where_str + \
+            "FROM " + self.get_full_view_name() + " " + where_str + \
             "GROUP BY " + field
-        str = str %params
-        return str
+        return (str, params)
 
     def owner_facet( self ) :
         """ Return list of owners for the given query. """
-        return self.get_facet( "owner_id, owner_name " )
+        return self.get_facet( FACET_FIELDS['owner'] )
 
     def rock_type_facet( self ) :
         """ Return list of rock types for the given query. """
-        return self.get_facet( "rock_type_id, rock_type_name " )
+        return self.get_facet( FACET_FIELDS['rock_type'] )
 
     def country_facet( self ) :
         """ Return list of countries for the given query. """
-        return self.get_facet( "country " )
+        return self.get_facet( FACET_FIELDS['country'] )
 
     def mineral_facet( self ) :
         """ Return list of minerals for the given query. """
-        return self.get_facet( "sample_mineral_id, sample_mineral_name " )
+        return self.get_facet( FACET_FIELDS['mineral'] )
 
     def region_facet( self ) :
         """ Return list of regions for the given query. """
-        return self.get_facet( "sample_region_id, sample_region_name " )
+        return self.get_facet( FACET_FIELDS['region'] )
 
     def metamorphic_region_facet( self ) :
         """ Return list of metamorphic regions for the given query. """
-        return self.get_facet( "sample_metamorphic_region_id, sample_metamorphic_region" )
+        return self.get_facet( FACET_FIELDS['metamorphic_region'] )
 
     def metamorphic_grade_facet( self ) :
         """ Return list of metamorphic grades for the given query. """
-        return self.get_facet( "sample_metamorphic_grade_id, sample_metamorphic_grade" )
+        return self.get_facet( FACET_FIELDS['metamorphic_grade'] )
 
     def publication_facet( self ) :
         """ Return all publication info in a single facet. """
-        return self.get_facet( "publication_id, author" )
+        return self.get_facet( FACET_FIELDS['publication'] )
+
+    def get_all_facets ( self ) :
+        """ Constructs a single query for every facet. The rows of the
+            view matching the conditions are read once into a CTE, and
+            each facet is grouped from it. Returns rows of facet name
+            (a key of FACET_FIELDS), id and label as text, and count.
+
+        """
+        (where_str, params) = self.get_where()
+        columns = ["sample_id"]
+        for name in sorted(FACET_FIELDS):
+            for field in FACET_FIELDS[name].split(","):
+                if field.strip() not in columns:
+                    columns.append(field.strip())
+        facets = []
+        for name in sorted(FACET_FIELDS):
+            (id_field, label_field) = \
+                [field.strip() for field in FACET_FIELDS[name].split(",")]
+            facets.append(
+                "SELECT '" + name + "', " + id_field + "::text, " + \
+                    label_field + "::text, count(distinct sample_id) " \
+                "FROM selected GROUP BY " + id_field + ", " + label_field)
+        str = "WITH selected AS (SELECT " + ", ".join(columns) + " " \
+            "FROM " + self.get_full_view_name() + " " + where_str + ") " + \
+            " UNION ALL ".join(facets)
+        return (str, params)
+
+    def get_values ( self, field, value_set ) :
+        """ Returns the values of a selection as the field compares them:
+            integers for ids, and strings for countries, where the quotes
+            of a value given as an SQL literal are removed.
+            Raises ValueError for an id that is not an integer.
+
+        """
+        if field != 'country':
+            return [int(item) for item in value_set]
+        values = []
+        for item in value_set:
+            item = unicode(item).strip()
+            if len(item) >= 2 and item[0] == item[-1] == "'":
+                item = item[1:-1].replace("''", "'")
+            values.append(item)
+        return values
 
     def get_selection ( self, field, value_set ) :
         """ Assumes the values are integers corresponding to ids,
@@ -189,21 +263,10 @@ class SampleQuery(object):
             Example: 'rock_type_id' [1,2,3]
         """
 
-        where_segment = ""
-        params = {}
         if len(value_set) == 0:
             return ("", {})
-        elif len(value_set) == 1:
-            params[field] = str(value_set[0])
-            return (" and " + field + " = %(" + field + ")s ", \
-                        params)
-        else: # more than 1 value in the set
-            params[field] = ""
-            where_segment = " and (" + field + " in (%(" + field + ")s)) "
-            for item in value_set:
-                params[field] += str(item) + ","
-            params[field] = params[field].strip(",") 
-        return (where_segment, params)
+        params = {field: self.get_values(field, value_set)}
+        return (" and " + field + " = ANY(%(" + field + ")s) ", params)
 
     def merge( self, query_str, params, (q,p)):
         query_str += q
@@ -254,9 +317,32 @@ class SampleQuery(object):
 
         return (query_str + " ", params)
 
+    def get_selection_key ( self ) :
+        """ Returns the conditions get_where() applies, as a tuple of
+            (field, sorted values) pairs. Queries selecting the same
+            samples have the same key whatever the order of the values.
+
+        """
+        if not self.conditions_set:
+            return ()
+        selections = [('rock_type_id', self.rock_type_selections),
+                      ('country', self.country_selections),
+                      ('owner_id', self.owner_id_selections),
+                      ('sample_mineral_id', self.mineral_id_selections),
+                      ('sample_region_id', self.region_id_selections),
+                      ('sample_metamorphic_grade_id',
+                       self.metamorphic_grade_id_selections),
+                      ('sample_metamorphic_region_id',
+                       self.metamorphic_region_id_selections),
+                      ('publication_id', self.publication_id_selections)]
+        return tuple((field,
+                      tuple(sorted(set(self.get_values(field, value_set)))))
+                     for (field, value_set) in selections
+                     if len(value_set) > 0)
+
 
     def __str__ ( self ) :
-        return self.get_main()
+        return self.get_main()[0]
 
     def get_main_brief ( self, limit=None ) :
         (where_str,params) = self.get_where() 
@@ -267,31 +353,75 @@ class SampleQuery(object):
             "FROM  " + self.get_view_name() + " " + where_str + \
             "GROUP BY" + attributes
         if limit != None:
-            query_str += " LIMIT " + str(limit)
-        return query_str %params
+            query_str += " LIMIT %(limit)s"
+            params['limit'] = int(limit)
+        return (query_str, params)
 
 #comma after current_location
-    def get_main ( self, limit=None ) :
-        (where_str,params) = self.get_where() 
+    def get_main ( self, limit=None, after=None, sample_ids=None ) :
+        """ Results are ordered by sample_id. To page through them, pass
+            the sample_id of the last result of a page as after to get
+            the next one; unlike an offset this does not get slower for
+            later pages. sample_ids restricts the results to the samples
+            with those ids in place of the conditions, for ids found by
+            webservices.facetindex.
+
+        """
+        if sample_ids is not None:
+            where_str = "WHERE public_data = 'Y' " \
+                "AND sample_id = ANY(%(sample_ids)s) "
+            params = {'sample_ids': [int(id) for id in sample_ids]}
+            view = self.SHORT_VIEW_NAME
+        else:
+            (where_str,params) = self.get_where() 
+            view = self.get_view_name()
+        if after != None:
+            where_str += " AND sample_id > %(after)s "
+            params['after'] = int(after)
+
+        if has_counts():
+            # the counters kept on samples are read for the samples of
+            # the page only, without aggregating their child rows
+            attributes = " sample_id, sample_number, rock_type_name, " + \
+                "owner_name, latitude, longitude, current_location "
+            query_str =\
+                "SELECT " + attributes + \
+                "FROM  " + view + " " + where_str + \
+                "GROUP BY" + attributes + \
+                "ORDER BY sample_id"
+            if limit != None:
+                query_str += " LIMIT %(limit)s"
+                params['limit'] = int(limit)
+            query_str =\
+                "SELECT results.*, " \
+                    "samples.subsample_count AS num_subsamples, " \
+                    "samples.chemical_analysis_count AS num_chemical_analyses, " \
+                    "samples.image_count AS num_images " \
+                "FROM (" + query_str + ") results, samples " \
+                "WHERE samples.sample_id = results.sample_id " \
+                "ORDER BY results.sample_id"
+            return (query_str, params)
+
         attributes = " sample_id, sample_number, rock_type_name, " + \
             "owner_name, latitude, longitude, current_location, " + \
             "num_subsamples, num_chemical_analyses, num_images "
-
         query_str =\
             "SELECT " + attributes + \
-            "FROM  " + self.get_view_name() + ",sample_counts_view " +  \
+            "FROM  " + view + ",sample_counts_view " +  \
             where_str + " AND sample_id = count_sample_id "\
-            "GROUP BY" + attributes
+            "GROUP BY" + attributes + \
+            "ORDER BY sample_id"
         if limit != None:
-            query_str += " LIMIT " + str(limit)
-        return query_str %params
+            query_str += " LIMIT %(limit)s"
+            params['limit'] = int(limit)
+        return (query_str, params)
 
     def get_count ( self ) :
         (where_str,params) = self.get_where() 
         query_str =\
             "SELECT count(DISTINCT sample_id) " \
             "FROM  " + self.get_view_name() + " " + where_str 
-        return query_str %params
+        return (query_str, params)
 
 if __name__ == '__main__':
     q = SampleQuery()
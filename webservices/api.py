@@ -1,28 +1,41 @@
-from django.http import HttpResponse
-from webservices.sample import SampleObject
+from django.http import HttpResponse, HttpResponseBadRequest
+from webservices.sample import SampleObject, SampleBatchObject
 from webservices.subsample import SubsampleObject, SubsampleImagesTableObject, SubsampleTableObject
 from webservices.chemicalanalysis import ChemicalAnalysisObject, ChemicalAnalysisTableObject
+from webservices.responsecache import cached_json
+
+# most samples /webservices/samples/json/ returns at once
+MAX_BATCH_SAMPLES = 1000
         
 def sample(request, sample_id):
-    sampleObj = SampleObject(sample_id)
-    return HttpResponse(sampleObj.json())
+    return cached_json(request, 'sample', sample_id, SampleObject)
+
+def samples(request):
+    """ The samples listed in the ids parameter, comma separated, in that
+        order, each as sample() returns it.
+
+    """
+    try:
+        ids = [int(id) for id in request.GET.get('ids', '').split(',') if id]
+    except ValueError:
+        return HttpResponseBadRequest("Ids must be integers")
+    if len(ids) > MAX_BATCH_SAMPLES:
+        return HttpResponseBadRequest("At most %d ids" % MAX_BATCH_SAMPLES)
+    sampleBatchObj = SampleBatchObject(ids)
+    return HttpResponse(sampleBatchObj.json())
     
 def subsample(request, subsample_id):
-    subsampleObj = SubsampleObject(subsample_id)
-    return HttpResponse(subsampleObj.json())
+    return cached_json(request, 'subsample', subsample_id, SubsampleObject)
 
 def subsample_images(request, subsample_id):
     subsampleImagesTableObj = SubsampleImagesTableObject(subsample_id)
     return HttpResponse(subsampleImagesTableObj.json())
     
 def subsamples(request, sample_id):
-    subsampleTableObj = SubsampleTableObject(sample_id)
-    return HttpResponse(subsampleTableObj.json())
+    return cached_json(request, 'subsamples', sample_id, SubsampleTableObject)
 
 def chemical_analysis(request, chemical_analysis_id):
-    chemicalAnalysisObj = ChemicalAnalysisObject(chemical_analysis_id)
-    return HttpResponse(chemicalAnalysisObj.json())
+    return cached_json(request, 'chemical_analysis', chemical_analysis_id, ChemicalAnalysisObject)
     
 def chemical_analyses(request, subsample_id):
-    chemicalAnalysisTableObj = ChemicalAnalysisTableObject(subsample_id)
-    return HttpResponse(chemicalAnalysisTableObj.json())
\ No newline at end of file
+    return cached_json(request, 'chemical_analyses', subsample_id, ChemicalAnalysisTableObject)
\ No newline at end of file
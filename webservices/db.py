@@ -20,11 +20,21 @@ class _DbObject(object):
 class _DbGetQuery(object):
     oneQuery = None
     manyQueries = None
+    # run oneQuery and manyQueries as one statement on PostgreSQL
+    combined = True
+
+    # many-query -> its columns as (name, type oid), read once per process
+    manyColumns = {}
 
     def __init__(self):
         raise NotImplementedError("Should have implemented this")
 
     def execute(self, conditions):
+        # without oneQuery there is no round trip to save
+        if self.combined and self.oneQuery and self.manyQueries and \
+           self.canCombine():
+            return self.executeCombined(conditions)
+
         data = {}
         cursor = con.cursor()
 
@@ -38,3 +48,113 @@ class _DbGetQuery(object):
                 data[item] = dictfetchall(cursor)
         
         return data
+
+    def canCombine(self):
+        """ Array constructors work on every supported PostgreSQL """
+        return con.vendor == 'postgresql'
+
+    def columns(self, query, conditions):
+        """ Names and type oids of the columns query returns. """
+        if query not in self.manyColumns:
+            cursor = con.cursor()
+            cursor.execute("SELECT * FROM (" + query + ") many LIMIT 0",
+                           conditions)
+            self.manyColumns[query] = [(column[0], column[1])
+                                       for column in cursor.description]
+        return self.manyColumns[query]
+
+    def combinedQuery(self, columns):
+        """ oneQuery with the values of the rows of every many-query, as
+            text and row after row, in an array column named after its
+            item; columns gives the columns of each item.
+
+        """
+        qn = con.ops.quote_name
+        arrays = []
+        for item, query in sorted(self.manyQueries.iteritems()):
+            values = ", ".join("many." + qn(name) + "::text"
+                               for (name, oid) in columns[item])
+            arrays.append(
+                "ARRAY(SELECT unnest(ARRAY[" + values + "]) "
+                "FROM (" + query + ") many) AS " + qn(item)
+            )
+        return ("SELECT one.*, " + ", ".join(arrays) + " "
+                "FROM (" + self.oneQuery + ") one")
+
+    def executeCombined(self, conditions):
+        """ Same as execute, in a single round trip once the columns of the
+            many-queries are known.
+
+        """
+        columns = {}
+        for item, query in self.manyQueries.iteritems():
+            columns[item] = self.columns(query, conditions)
+        cursor = con.cursor()
+        cursor.execute(self.combinedQuery(columns), conditions)
+        data = dictfetchone(cursor)
+        if "error" in data:
+            return data
+        for item in self.manyQueries:
+            data[item] = castrows(data[item], columns[item], cursor)
+        return data
+
+
+def castrows(values, columns, cursor):
+    """ Rows of a many-query, as dictfetchall returns them, from the text
+        values of a combined query; each value is converted the way
+        psycopg2 converts a column of its type.
+
+    """
+    from psycopg2.extensions import string_types
+
+    # the converters take the psycopg2 cursor itself
+    cursor = getattr(cursor, "cursor", cursor)
+    casts = [string_types.get(oid) for (name, oid) in columns]
+    width = len(columns)
+    rows = []
+    for start in range(0, len(values), width):
+        row = {}
+        for (i, (name, oid)) in enumerate(columns):
+            value = values[start + i]
+            if value is not None and casts[i] is not None:
+                value = casts[i](value, cursor)
+            row[name] = value
+        rows.append(row)
+    return rows
+
+
+class _DbBatchGetQuery(object):
+    """ _DbGetQuery for many objects at once: oneQuery returns a row per
+        object, with its id in the id column, and every many-query returns
+        the id of the object its rows belong to in the parent_id column.
+        The rows of each many-query are grouped by object in Python, so
+        the objects cost one query each for oneQuery and every many-query,
+        however many there are.
+
+    """
+    oneQuery = None
+    manyQueries = None
+
+    def __init__(self):
+        raise NotImplementedError("Should have implemented this")
+
+    def execute(self, conditions):
+        """ The objects in the order oneQuery returns them, under "*". """
+        cursor = con.cursor()
+        cursor.execute(self.oneQuery, conditions)
+        objects = dictfetchall(cursor)
+        byId = {}
+        for data in objects:
+            byId[data["id"]] = data
+            for item in self.manyQueries:
+                data[item] = []
+
+        if objects:
+            for item, query in self.manyQueries.iteritems():
+                cursor.execute(query, conditions)
+                for row in dictfetchall(cursor):
+                    parent = row.pop("parent_id")
+                    if parent in byId:
+                        byId[parent][item].append(row)
+
+        return {"*": objects}
@@ -0,0 +1,492 @@
+"""
+   Exhibit feeds: builds the {"items": [...]} documents served by
+   webservices.views.samples and webservices.views.chemical_analyses and
+   read by the Exhibit pages under web/.
+
+   Every feed is assembled from a fixed number of set-based queries.
+   The parent query and each child query are ordered by the parent id,
+   so the rows are merged in a single pass instead of being looked up
+   per item.
+
+   Use: SamplesExport().json() or ChemicalAnalysesExport().json(), or
+   stream() instead of json() to produce the document in fragments.
+
+"""
+
+from django.db import connection as con
+from webservices.utility import formatOxide
+import json
+
+
+SAMPLE_LINK = 'http://metpetdb.rpi.edu/metpetweb/#sample/'
+
+# Samples shown on the public site: public ones plus the demo account.
+VISIBLE_SAMPLES = "(samples.public_data = 'Y' OR samples.user_id = 139)"
+
+# Analyses shown on the public site, restricted to mineral or bulk rock ones.
+VISIBLE_ANALYSES = "(ca.public_data = 'Y' OR ca.user_id = 139) AND " \
+                   "(ca.large_rock = 'Y' OR ca.mineral_id IS NOT NULL)"
+
+
+
+def _analysedSamples(restriction):
+    """ Subquery for the ids of the samples with an analysis matching
+        restriction (a condition on chemical_analyses aliased as ca).
+
+    """
+    return (
+        "SELECT "
+            "subsamples.sample_id "
+        "FROM "
+            "chemical_analyses ca, "
+            "subsamples "
+        "WHERE "
+            "ca.subsample_id = subsamples.subsample_id AND "
+            + restriction
+    )
+
+
+class _Children(object):
+    """ Walks child rows ordered by parent key next to the parent rows.
+        The first keyLength columns of each row are the parent key, the
+        remaining columns are the values. Keys must be requested in
+        ascending order; asking for the same key twice returns the same
+        values.
+
+    """
+
+    def __init__(self, rows, keyLength=1):
+        self.rows = iter(rows)
+        self.keyLength = keyLength
+        self.row = next(self.rows, None)
+        self.key = None
+        self.values = []
+
+    def _rowKey(self):
+        if self.keyLength == 1:
+            return self.row[0]
+        return tuple(self.row[:self.keyLength])
+
+    def get(self, key):
+        if key != self.key:
+            self.key = key
+            self.values = []
+            while self.row is not None and self._rowKey() < key:
+                self.row = next(self.rows, None)
+            while self.row is not None and self._rowKey() == key:
+                self.values.append(self.row[self.keyLength:])
+                self.row = next(self.rows, None)
+        return self.values
+
+    def column(self, key, index=0):
+        """ Return a single column of the values for key. """
+        return [values[index] for values in self.get(key)]
+
+    def first(self, key, default=None):
+        """ Return the first value for key, default if there is none. """
+        values = self.get(key)
+        if values:
+            return values[0][0]
+        return default
+
+
+def _sampleQueries(restriction):
+    """ Queries for the lists attached to a sample, limited to the samples
+        matching restriction (a condition on the samples table) and ordered
+        by sample_id.
+
+    """
+    return {
+        "metamorphic_regions": (
+            "SELECT "
+                "smr.sample_id, "
+                "metamorphic_regions.name "
+            "FROM "
+                "sample_metamorphic_regions_dup smr, "
+                "metamorphic_regions, "
+                "samples "
+            "WHERE "
+                "smr.metamorphic_region_id = metamorphic_regions.metamorphic_region_id AND "
+                "smr.sample_id = samples.sample_id AND "
+                + restriction + " "
+            "ORDER BY "
+                "smr.sample_id, smr.id"
+        ),
+        "metamorphic_grades": (
+            "SELECT "
+                "smg.sample_id, "
+                "metamorphic_grades.name "
+            "FROM "
+                "sample_metamorphic_grades_dup smg, "
+                "metamorphic_grades, "
+                "samples "
+            "WHERE "
+                "smg.metamorphic_grade_id = metamorphic_grades.metamorphic_grade_id AND "
+                "smg.sample_id = samples.sample_id AND "
+                + restriction + " "
+            "ORDER BY "
+                "smg.sample_id, smg.id"
+        ),
+        "minerals": (
+            "SELECT "
+                "sm.sample_id, "
+                "minerals.name "
+            "FROM "
+                "sample_minerals_dup sm, "
+                "minerals, "
+                "samples "
+            "WHERE "
+                "sm.mineral_id = minerals.mineral_id AND "
+                "sm.sample_id = samples.sample_id AND "
+                + restriction + " "
+            "ORDER BY "
+                "sm.sample_id, sm.id"
+        ),
+        "regions": (
+            "SELECT "
+                "sr.sample_id, "
+                "regions.name "
+            "FROM "
+                "sample_regions_dup sr, "
+                "regions, "
+                "samples "
+            "WHERE "
+                "sr.region_id = regions.region_id AND "
+                "sr.sample_id = samples.sample_id AND "
+                + restriction + " "
+            "ORDER BY "
+                "sr.sample_id, sr.id"
+        ),
+        "references": (
+            "SELECT "
+                "sr.sample_id, "
+                "georeference.first_author, "
+                "georeference.journal_name_2, "
+                "georeference.publication_year "
+            "FROM "
+                "sample_reference_dup sr, "
+                "reference, "
+                "georeference, "
+                "samples "
+            "WHERE "
+                "sr.reference_id = reference.reference_id AND "
+                "georeference.reference_number = reference.name AND "
+                "sr.sample_id = samples.sample_id AND "
+                + restriction + " "
+            "ORDER BY "
+                "sr.sample_id, sr.id, georeference.georef_id"
+        )
+    }
+
+
+class _ExhibitExport(object):
+    """ Runs oneQuery for the parent rows and every entry of manyQueries
+        for the child rows, then hands both to item() for each parent row.
+        keyLengths gives the parent key width of a child query when it is
+        not a single column.
+
+        json() builds the whole document in memory; stream() yields it in
+        fragments while reading every query through a server-side cursor,
+        so memory use does not depend on the number of items.
+
+    """
+    oneQuery = None
+    manyQueries = None
+    keyLengths = {}
+    params = None
+
+    # rows fetched per round trip by the server-side cursors
+    FETCH_SIZE = 2000
+    # bytes of JSON collected before a fragment is yielded
+    FRAGMENT_SIZE = 65536
+
+    def rows(self, query):
+        cursor = con.cursor()
+        cursor.execute(query, self.params)
+        return cursor.fetchall()
+
+    def serverRows(self, query, name):
+        """ Iterate over the rows of query using a named (server-side)
+            cursor, fetching FETCH_SIZE rows at a time.
+
+        """
+        # make sure the connection is open before using it directly
+        con.cursor()
+        cursor = con.connection.cursor(name)
+        cursor.itersize = self.FETCH_SIZE
+        try:
+            cursor.execute(query, self.params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+    def items(self):
+        children = {}
+        for name, query in self.manyQueries.iteritems():
+            children[name] = _Children(self.rows(query),
+                                       self.keyLengths.get(name, 1))
+        return [self.item(row, children) for row in self.rows(self.oneQuery)]
+
+    def item(self, row, children):
+        raise NotImplementedError("Should have implemented this")
+
+    def json(self):
+        return "{\"items\":" + json.dumps(self.items()) + "}"
+
+    def stream(self):
+        """ Yield the same document as json() in fragments.
+
+            The connection is rolled back and closed once the document is
+            done: before Django 1.5 the connection of the request is closed
+            when the view returns, so the cursors reopen one that nothing
+            else would end, leaving it idle in transaction.
+
+        """
+        cursors = []
+        try:
+            children = {}
+            for name, query in self.manyQueries.iteritems():
+                rows = self.serverRows(query, "exhibit_" + name)
+                cursors.append(rows)
+                children[name] = _Children(rows, self.keyLengths.get(name, 1))
+            items = self.serverRows(self.oneQuery, "exhibit_items")
+            cursors.append(items)
+            # json.dumps separates list items with ", "
+            fragment = ["{\"items\":["]
+            size = 0
+            separator = ""
+            for row in items:
+                data = json.dumps(self.item(row, children))
+                fragment.append(separator + data)
+                separator = ", "
+                size += len(data)
+                if size >= self.FRAGMENT_SIZE:
+                    yield "".join(fragment)
+                    fragment = []
+                    size = 0
+            fragment.append("]}")
+            yield "".join(fragment)
+        finally:
+            # closes the server-side cursors of unfinished queries
+            for rows in cursors:
+                rows.close()
+            if con.connection is not None:
+                con.connection.rollback()
+            con.close()
+
+
+class SamplesExport(_ExhibitExport):
+    """ Feed for web/samples/samples.json, six queries in total.
+        Pass ids to export only those samples.
+
+    """
+
+    def __init__(self, ids=None):
+        restriction = VISIBLE_SAMPLES
+        if ids is not None:
+            restriction += " AND samples.sample_id = ANY(%(ids)s)"
+            self.params = {"ids": list(ids)}
+
+        self.oneQuery = (
+            "SELECT "
+                "samples.sample_id, "
+                "samples.number, "
+                "samples.country, "
+                "users.name, "
+                "rock_type.rock_type, "
+                "st_x(samples.location), "
+                "st_y(samples.location) "
+            "FROM "
+                "samples, "
+                "users, "
+                "rock_type "
+            "WHERE "
+                "samples.user_id = users.user_id AND "
+                "samples.rock_type_id = rock_type.rock_type_id AND "
+                + restriction + " "
+            "ORDER BY "
+                "samples.sample_id"
+        )
+
+        self.manyQueries = _sampleQueries(restriction)
+
+    def item(self, row, children):
+        (sample_id, number, country, owner, rock_type, x, y) = row
+        references = children["references"]
+
+        # Keys are added in the same order as the original per-sample view
+        # so the serialized document does not change.
+        sample_data = {}
+        sample_data["sample_id"] = sample_id
+        sample_data["label"] = number
+        sample_data['sample_link'] = SAMPLE_LINK + str(sample_id)
+        sample_data["sample_metamorphic_regions"] = \
+            children["metamorphic_regions"].column(sample_id)
+        sample_data["sample_country"] = country
+        sample_data["sample_owner"] = owner
+        sample_data["sample_rock_type"] = rock_type
+        sample_data["sample_metamorphic_grades"] = \
+            children["metamorphic_grades"].column(sample_id)
+        sample_data["sample_minerals"] = children["minerals"].column(sample_id)
+        sample_data["sample_regions"] = children["regions"].column(sample_id)
+        sample_data["sample_reference_first_authors"] = \
+            references.column(sample_id, 0)
+        sample_data["sample_reference_journal_names"] = \
+            references.column(sample_id, 1)
+        sample_data['sample_reference_publication_years'] = \
+            references.column(sample_id, 2)
+        sample_data["sample_latlon"] = str(y) + "," + str(x)
+        return sample_data
+
+
+class ChemicalAnalysesExport(_ExhibitExport):
+    """ Feed for web/chemical_analyses/chemical_analyses.json, nine queries
+        in total. Analyses are emitted ordered by sample and then by id so
+        the per-sample lists can be merged in the same pass. Pass ids to
+        export only those analyses.
+
+    """
+
+    def __init__(self, ids=None):
+        restriction = VISIBLE_ANALYSES
+        if ids is not None:
+            restriction += " AND ca.chemical_analysis_id = ANY(%(ids)s)"
+            self.params = {"ids": list(ids)}
+
+        self.oneQuery = (
+            "SELECT "
+                "ca.chemical_analysis_id, "
+                "samples.sample_id, "
+                "samples.number, "
+                "ca.large_rock, "
+                "ca.mineral_id, "
+                "minerals.name, "
+                "ca.analysis_method, "
+                "users.name, "
+                "ca.total, "
+                "rock_type.rock_type, "
+                "st_x(samples.location), "
+                "st_y(samples.location) "
+            "FROM (((( "
+                "chemical_analyses ca "
+                "INNER JOIN subsamples "
+                "ON ca.subsample_id = subsamples.subsample_id ) "
+                "INNER JOIN samples "
+                "ON subsamples.sample_id = samples.sample_id ) "
+                "INNER JOIN users "
+                "ON ca.user_id = users.user_id ) "
+                "INNER JOIN rock_type "
+                "ON samples.rock_type_id = rock_type.rock_type_id ) "
+                "LEFT OUTER JOIN minerals "
+                "ON ca.mineral_id = minerals.mineral_id "
+            "WHERE "
+                + restriction + " "
+            "ORDER BY "
+                "samples.sample_id, ca.chemical_analysis_id"
+        )
+
+        self.manyQueries = _sampleQueries(
+            "samples.sample_id IN (" + _analysedSamples(restriction) + ")")
+
+        self.manyQueries["oxides"] = (
+            "SELECT "
+                "subsamples.sample_id, "
+                "cao.chemical_analysis_id, "
+                "oxides.species "
+            "FROM "
+                "chemical_analysis_oxides_dup cao, "
+                "oxides, "
+                "chemical_analyses ca, "
+                "subsamples "
+            "WHERE "
+                "cao.oxide_id = oxides.oxide_id AND "
+                "cao.chemical_analysis_id = ca.chemical_analysis_id AND "
+                "ca.subsample_id = subsamples.subsample_id AND "
+                + restriction + " "
+            "ORDER BY "
+                "subsamples.sample_id, cao.chemical_analysis_id, cao.id"
+        )
+        self.manyQueries["elements"] = (
+            "SELECT "
+                "subsamples.sample_id, "
+                "cae.chemical_analysis_id, "
+                "elements.name "
+            "FROM "
+                "chemical_analysis_elements_dup cae, "
+                "elements, "
+                "chemical_analyses ca, "
+                "subsamples "
+            "WHERE "
+                "cae.element_id = elements.element_id AND "
+                "cae.chemical_analysis_id = ca.chemical_analysis_id AND "
+                "ca.subsample_id = subsamples.subsample_id AND "
+                + restriction + " "
+            "ORDER BY "
+                "subsamples.sample_id, cae.chemical_analysis_id, cae.id"
+        )
+        # The feed has always counted the analyses whose subsample_id equals
+        # the sample id; keep that so chemical_analysis_count is unchanged.
+        self.manyQueries["counts"] = (
+            "SELECT "
+                "chemical_analyses.subsample_id, "
+                "COUNT(chemical_analyses.chemical_analysis_id) "
+            "FROM "
+                "chemical_analyses "
+            "WHERE "
+                "chemical_analyses.subsample_id IN (" +
+                    _analysedSamples(restriction) + ") "
+            "GROUP BY "
+                "chemical_analyses.subsample_id "
+            "ORDER BY "
+                "chemical_analyses.subsample_id"
+        )
+        self.keyLengths = {"oxides": 2, "elements": 2}
+
+    def item(self, row, children):
+        (chemical_analysis_id, sample_id, number, large_rock, mineral_id,
+         mineral_name, method, owner, total, rock_type, x, y) = row
+        analysis = (sample_id, chemical_analysis_id)
+        references = children["references"]
+
+        if large_rock == 'Y' and mineral_id is None:
+            mineral_name = 'Bulk Rock'
+        elif large_rock == 'N' and mineral_id is None:
+            mineral_name = None
+        elif large_rock != 'N':
+            mineral_name = ""
+
+        chemical_analysis_data = {}
+        chemical_analysis_data['chemical_analysis_id'] = chemical_analysis_id
+        chemical_analysis_data['sample_id'] = sample_id
+        chemical_analysis_data['label'] = number
+        chemical_analysis_data['chemical_analysis_link'] = \
+            SAMPLE_LINK + str(sample_id)
+        chemical_analysis_data['chemical_analysis_count'] = \
+            children["counts"].first(sample_id, 0)
+        chemical_analysis_data['chemical_analysis_latlon'] = \
+            str(y) + "," + str(x)
+        chemical_analysis_data['chemical_analysis_large_rock'] = large_rock
+        chemical_analysis_data['chemical_analysis_mineral_name'] = mineral_name
+        chemical_analysis_data['chemical_analysis_method'] = method
+        chemical_analysis_data['chemical_analysis_owner'] = owner
+        chemical_analysis_data['chemical_analysis_total_weight'] = total
+        chemical_analysis_data['chemical_analysis_oxides'] = \
+            [formatOxide(str(species))
+             for species in children["oxides"].column(analysis)]
+        chemical_analysis_data['chemical_analysis_elements'] = \
+            children["elements"].column(analysis)
+        chemical_analysis_data['chemical_analysis_rock_type'] = rock_type
+        chemical_analysis_data['chemical_analysis_metamorphic_grade'] = \
+            children["metamorphic_grades"].column(sample_id)
+        chemical_analysis_data['chemical_analysis_metamorphic_regions'] = \
+            children["metamorphic_regions"].column(sample_id)
+        chemical_analysis_data['chemical_analysis_first_authors'] = \
+            references.column(sample_id, 0)
+        chemical_analysis_data['chemical_analysis_publication_journal_names'] = \
+            references.column(sample_id, 1)
+        chemical_analysis_data['chemical_analysis_publication_years'] = \
+            references.column(sample_id, 2)
+        chemical_analysis_data['chemical_analysis_sample_minerals'] = \
+            children["minerals"].column(sample_id)
+        return chemical_analysis_data
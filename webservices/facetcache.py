@@ -0,0 +1,80 @@
+"""
+   Facet counts for a SampleQuery, computed together and cached.
+
+   The search page asks for every facet of the same selection in turn, so
+   the first request computes all of them in one query and the others are
+   served from the cache.  Entries are keyed on the normalized selection
+   and on the search_version_seq sequence, which the triggers in
+   database/MetPetDB_Triggers.sql move when a change to the samples and
+   their lists commits; a change therefore retires every cached entry at
+   once.  Without that sequence the counts are computed on every request.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db import connection as con
+from webservices.utility import getAllFacetData
+
+# returntype of the metpetdb view -> facet name in SampleQuery.FACET_FIELDS
+FACETS = [('rocktype_facet', 'rock_type'),
+          ('country_facet', 'country'),
+          ('mineral_facet', 'mineral'),
+          ('region_facet', 'region'),
+          ('owner_facet', 'owner'),
+          ('metamorphicgrade_facet', 'metamorphic_grade'),
+          ('metamorphicregion_facet', 'metamorphic_region'),
+          ('publication_facet', 'publication')]
+
+# seconds an entry is kept, stale entries are never read since the key
+# changes with search_version
+FACET_TIMEOUT = 3600
+
+# whether the search_version_seq sequence exists, looked up once per
+# process
+versioned = None
+
+
+def get_search_version():
+    """ Current value of the search_version counter, or None when the
+        counter has not been installed.
+
+    """
+    global versioned
+    cursor = con.cursor()
+    if versioned is None:
+        cursor.execute("SELECT 1 FROM pg_class "
+                       "WHERE relkind = 'S' AND relname = 'search_version_seq'")
+        versioned = cursor.fetchone() is not None
+    if not versioned:
+        return None
+    cursor.execute("SELECT last_value FROM search_version_seq")
+    return cursor.fetchone()[0]
+
+
+def compute_facets(samples):
+    """ Every facet of the SampleQuery samples, by returntype, read in a
+        single query.
+
+    """
+    data = getAllFacetData(*samples.get_all_facets())
+    facets = {}
+    for (returntype, name) in FACETS:
+        facets[returntype] = data.get(name, [])
+    return facets
+
+
+def get_facets(samples):
+    """ Every facet of the SampleQuery samples, by returntype, from the
+        cache when the data has not changed since they were computed.
+
+    """
+    version = get_search_version()
+    if version is None:
+        return compute_facets(samples)
+    key = "facets:%d:%s" % (version,
+        hashlib.md5(repr(samples.get_selection_key())).hexdigest())
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(samples)
+        cache.set(key, facets, FACET_TIMEOUT)
+    return facets
@@ -0,0 +1,261 @@
+"""
+   In-memory index answering SampleQuery counts, sample ids and facets.
+
+   Every public sample gets a position, and every facet value (the id and
+   label pair a facet groups on) a bitmap, held in a Python long, of the
+   samples having that value, along with its number of samples and the
+   positions of its first and last sample.  full_sample_results joins the lists of a
+   sample independently of each other, so a sample has a row matching the
+   conditions exactly when, for every field with a selection, one of its
+   values is selected.  The samples of a query are then the intersection
+   of one union of bitmaps per selected field, and the count of a facet
+   value is the size of its bitmap intersected with the matches of every
+   other field; this gives the same numbers as the SQL of SampleQuery.
+   Without a selection on the other fields the count is the one kept with
+   the value, and values whose samples lie outside the positions of the
+   other matches are skipped without counting.
+
+   The index is used when settings.FACET_INDEX is true.  It is rebuilt
+   on first use after the search_version counter moves or a sample is
+   saved in this process.
+"""
+import binascii
+import bisect
+import threading
+
+from django.conf import settings
+from django.db import connection as con
+from django.db.models.signals import post_save, post_delete
+from tastyapi.models import Sample
+from webservices.SampleQuery import SampleQuery, FACET_FIELDS
+from webservices.util import execute_prepared
+from webservices.facetcache import FACETS, get_facets as get_cached_facets, \
+    get_search_version
+
+# facet name -> field of full_sample_results SampleQuery selects on
+SELECTION_FIELDS = {
+    'owner': 'owner_id',
+    'rock_type': 'rock_type_id',
+    'country': 'country',
+    'mineral': 'sample_mineral_id',
+    'region': 'sample_region_id',
+    'metamorphic_region': 'sample_metamorphic_region_id',
+    'metamorphic_grade': 'sample_metamorphic_grade_id',
+    'publication': 'publication_id'
+}
+
+
+# number of bits set in each byte
+BYTE_COUNTS = str(bytearray(bin(i).count('1') for i in range(256)))
+
+
+def popcount(bitmap):
+    """ Number of samples in bitmap, counted a byte at a time. """
+    digits = '%x' % bitmap
+    if len(digits) % 2:
+        digits = '0' + digits
+    return sum(bytearray(binascii.unhexlify(digits).translate(BYTE_COUNTS)))
+
+
+def bounds(bitmap):
+    """ Positions of the first and past the last sample of bitmap. """
+    return ((bitmap & -bitmap).bit_length() - 1, bitmap.bit_length())
+
+
+class FacetIndex(object):
+    """ Bitmaps of the samples by facet value, built from rows of
+        (sample_id, id, label) for every facet name.
+
+    """
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        sample_ids = set()
+        for name in rows:
+            sample_ids.update(row[0] for row in rows[name])
+        self.sample_ids = sorted(sample_ids)
+        position = dict((sample_id, i)
+                        for (i, sample_id) in enumerate(self.sample_ids))
+        self.all = (1 << len(self.sample_ids)) - 1
+        # facet name -> (id, label) -> bitmap
+        self.bitmaps = {}
+        # facet name -> id -> union of the bitmaps of its labels
+        self.ids = {}
+        # facet name -> list of (id, label, bitmap, count, first, last)
+        self.values = {}
+        for name in FACET_FIELDS:
+            bitmaps = {}
+            for (sample_id, id, label) in rows.get(name, []):
+                bitmaps[(id, label)] = bitmaps.get((id, label), 0) | \
+                    (1 << position[sample_id])
+            self.bitmaps[name] = bitmaps
+            ids = {}
+            values = []
+            for ((id, label), bitmap) in bitmaps.iteritems():
+                ids[id] = ids.get(id, 0) | bitmap
+                values.append((id, label, bitmap, popcount(bitmap)) +
+                              bounds(bitmap))
+            self.ids[name] = ids
+            self.values[name] = values
+
+    def matches(self, samples):
+        """ The selected values of each selected field and the bitmap of
+            the samples having one of them, by facet name.
+
+        """
+        fields = dict((field, name)
+                      for (name, field) in SELECTION_FIELDS.iteritems())
+        matches = {}
+        for (field, values) in samples.get_selection_key():
+            name = fields[field]
+            selected = set(values)
+            bitmap = 0
+            for id in selected:
+                bitmap |= self.ids[name].get(id, 0)
+            matches[name] = (selected, bitmap)
+        return matches
+
+    def selected(self, matches, excluded=None):
+        bitmap = self.all
+        for (name, (selected, match)) in matches.iteritems():
+            if name != excluded:
+                bitmap &= match
+        return bitmap
+
+    def get_count(self, samples):
+        """ Same as executing samples.get_count(). """
+        matches = self.matches(samples)
+        return popcount(self.selected(matches))
+
+    def get_sample_ids(self, samples, limit=None, after=None):
+        """ Sorted ids of the samples get_main(limit, after) returns. """
+        matches = self.matches(samples)
+        bitmap = self.selected(matches)
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(self.sample_ids, after)
+        bitmap >>= start
+        ids = []
+        while bitmap and (limit is None or len(ids) < limit):
+            lowest = bitmap & -bitmap
+            start += lowest.bit_length() - 1
+            ids.append(self.sample_ids[start])
+            bitmap >>= lowest.bit_length()
+            start += 1
+        return ids
+
+    def get_facets(self, samples):
+        """ Every facet by returntype, as facetcache.get_facets returns
+            them.
+
+        """
+        matches = self.matches(samples)
+        facets = {}
+        for (returntype, name) in FACETS:
+            others = self.selected(matches, name)
+            values = []
+            facets[returntype] = values
+            if not others:
+                continue
+            (first, last) = bounds(others)
+            for (id, label, bitmap, count, start, end) in self.values[name]:
+                # a value outside the selection of its own field has no rows
+                if name in matches and id not in matches[name][0]:
+                    continue
+                if others != self.all:
+                    # no sample in common
+                    if end <= first or start >= last:
+                        continue
+                    count = popcount(bitmap & others)
+                if count:
+                    values.append(facet_value(id, label, count))
+        return facets
+
+
+def facet_value(id, label, count):
+    # the same values webservices.utility.getFacetValue makes of a row
+    label = unicode(label)
+    if label == '':
+        label = 'Missing Value'
+    return {'id': unicode(id), 'label': label, 'count': unicode(count)}
+
+
+def load(version=None):
+    """ Build a FacetIndex from the public rows of full_sample_results. """
+    cursor = con.cursor()
+    view = SampleQuery().get_full_view_name()
+    rows = {}
+    for name in FACET_FIELDS:
+        cursor.execute(
+            "SELECT DISTINCT sample_id, " + FACET_FIELDS[name] + " "
+            "FROM " + view + " WHERE public_data = 'Y'")
+        rows[name] = cursor.fetchall()
+    return FacetIndex(rows, version)
+
+
+index = None
+stale = True
+lock = threading.Lock()
+
+
+def get_index():
+    """ The current FacetIndex, or None when it is disabled. """
+    global index, stale
+    if not getattr(settings, 'FACET_INDEX', False):
+        return None
+    version = get_search_version()
+    current = index
+    if current is None or stale or current.version != version:
+        lock.acquire()
+        try:
+            if index is None or stale or index.version != version:
+                stale = False
+                index = load(version)
+            current = index
+        finally:
+            lock.release()
+    return current
+
+
+def get_facets(samples):
+    """ Every facet of the SampleQuery samples, by returntype, from the
+        index when it is enabled.
+
+    """
+    current = get_index()
+    if current is not None:
+        return current.get_facets(samples)
+    return get_cached_facets(samples)
+
+
+def get_count(samples):
+    """ Number of samples matching the SampleQuery samples. """
+    current = get_index()
+    if current is not None:
+        return current.get_count(samples)
+    cursor = con.cursor()
+    (query, params) = samples.get_count()
+    execute_prepared(cursor, query, params)
+    return cursor.fetchall()[0][0]
+
+
+def get_sample_ids(samples, limit=None, after=None):
+    """ Ids of the samples samples.get_main(limit, after) returns, or None
+        when the index is disabled.
+
+    """
+    current = get_index()
+    if current is None:
+        return None
+    return current.get_sample_ids(samples, limit, after)
+
+
+def invalidate(sender, **kwargs):
+    global stale
+    stale = True
+
+
+post_save.connect(invalidate, sender=Sample,
+                  dispatch_uid='facetindex_sample_saved')
+post_delete.connect(invalidate, sender=Sample,
+                    dispatch_uid='facetindex_sample_deleted')
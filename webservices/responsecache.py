@@ -0,0 +1,94 @@
+"""
+   Cached JSON of the webservices detail pages, with strong ETags.
+
+   A page is cached under its name and the id it is about, together with
+   the page_version column of that row (the sample of a sample page or of
+   its subsample table, the subsample of its analysis table...) and the ETag
+   of the body, an MD5 of the JSON.  A request costs one query reading the
+   page_version; when it matches the cached entry the page is served from
+   the cache, or answered with 304 Not Modified when If-None-Match carries
+   its ETag, without running the queries of the page.
+
+   The triggers of database/MetPetDB_Page_Versions.sql give page_version a
+   new value whenever a row the page shows changes, through Django, raw SQL
+   or the counter triggers alike, and the new value becomes visible with
+   the change when its transaction commits.  Without that script the pages
+   are not cached.
+
+   Entries go to Django's default cache, memcached when settings.CACHES can
+   use it so that an entry built by one worker serves all of them.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection as con
+from django.http import HttpResponse, HttpResponseNotModified
+from webservices.util import has_page_versions
+
+# page -> query of the version of the row the page is keyed on
+VERSION_QUERIES = {
+    'sample': "SELECT page_version FROM samples WHERE sample_id = %s",
+    'subsamples': "SELECT page_version FROM samples WHERE sample_id = %s",
+    'subsample':
+        "SELECT page_version FROM subsamples WHERE subsample_id = %s",
+    'chemical_analyses':
+        "SELECT page_version FROM subsamples WHERE subsample_id = %s",
+    'chemical_analysis':
+        "SELECT page_version FROM chemical_analyses "
+        "WHERE chemical_analysis_id = %s"
+}
+
+
+def get_key(page, id):
+    return "page:%s:%s" % (page, id)
+
+
+def get_version(page, id):
+    """ Version of the row page id is keyed on, None when it is missing or
+        has no page_version.
+
+    """
+    if not has_page_versions():
+        return None
+    cursor = con.cursor()
+    cursor.execute(VERSION_QUERIES[page], [id])
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+
+def etag_matches(request, etag):
+    """ Whether the If-None-Match header of request names etag. """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = [tag.strip() for tag in header.split(',')]
+    return '*' in etags or etag in etags
+
+
+def cached_json(request, page, id, make_object):
+    """ Response with the JSON of page id, make_object(id) giving the
+        _DbObject of the page when it is not cached.
+
+    """
+    version = get_version(page, id)
+    if version is None:
+        # nothing to key on; the object reports it does not exist, or the
+        # page is not cached
+        return HttpResponse(make_object(id).json())
+    key = get_key(page, id)
+    entry = cache.get(key)
+    if entry is None or entry[0] != version:
+        body = make_object(id).json()
+        entry = (version, '"%s"' % hashlib.md5(body).hexdigest(), body)
+        cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+    (version, etag, body) = entry
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body)
+    response['ETag'] = etag
+    return response
+
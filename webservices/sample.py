@@ -1,4 +1,5 @@
-from webservices.db import _DbObject, _DbGetQuery
+from webservices.db import _DbObject, _DbGetQuery, _DbBatchGetQuery
+from webservices.util import has_counts
 
 class SampleObject(_DbObject):
     def __init__(self, id = None):
@@ -17,14 +18,94 @@ class _SamplePermissionsQuery(_DbGetQuery):
     def __init__(self):
         self.oneQuery = ()
 
-       
-class _SampleGetQuery(_DbGetQuery):
-    def __init__(self):
-        self.oneQuery = (
+class SampleBatchObject(_DbObject):
+    """ The samples with the given ids, as SampleObject has them, in the
+        order of ids under "*"; ids without a sample are left out.
+
+    """
+    def __init__(self, ids = None):
+        self.getQuery = _SampleBatchGetQuery();
+        self.attributes = {"*": []}
+
+        if ids:
+            self.get(ids)
+
+    def get(self, ids):
+        ids = list(ids)
+        exists = self._get({"sample_ids": ids})
+        position = {}
+        for (i, id) in enumerate(ids):
+            position.setdefault(id, i)
+        self.attributes["*"].sort(key=lambda data: position[data["id"]])
+        return exists
+
+    def exists(self):
+        return "*" in self.attributes and len(self.attributes["*"]) > 0
+
+
+def _countingOneQuery(match):
+    """ oneQuery of _sampleQueries counting the subsamples of each sample. """
+    return (
+        "SELECT "
+            "samples.sample_id AS id, "
+            "samples.number, "
+            "samples.collection_date, "   
+            "CASE WHEN samples.public_data = 'Y' THEN TRUE ELSE FALSE END AS public_data, "
+            "samples.country, "
+            "samples.description, "
+            "samples.location_text, "
+            "st_y(samples.location) AS latitude, "
+            "st_x(samples.location) AS longitude, "
+            "owner.name AS owner_name, "
+            "collector.name AS collector_name, "
+            "rock_type.rock_type AS rock_type_name, "
+            "COUNT(subsamples.subsample_id) AS subsamples_count "
+        "FROM (((( "
+            "samples "
+            "LEFT OUTER JOIN subsamples "
+            "ON samples.sample_id = subsamples.sample_id ) "
+            "LEFT OUTER JOIN users owner "
+            "ON samples.user_id = owner.user_id ) "
+            "LEFT OUTER JOIN users collector "
+            "ON samples.collector_id = collector.user_id ) "
+            "LEFT OUTER JOIN rock_type "
+            "ON samples.rock_type_id = rock_type.rock_type_id ) "
+        "WHERE "
+            "samples.sample_id " + match + " "
+        "GROUP BY "
+            "samples.sample_id, "
+            "samples.number, "
+            "samples.collection_date, "
+            "samples.public_data, "
+            "samples.country, "
+            "samples.description, "
+            "samples.location_text, "
+            "st_y(samples.location), "
+            "st_x(samples.location), "
+            "owner.name, "
+            "collector.name, "
+            "rock_type.rock_type "
+    )
+
+
+def _sampleQueries(match, keyed=False):
+    """ oneQuery and manyQueries of the samples whose id matches match, an
+        SQL fragment following the id column such as "= %(sample_id)s".
+        keyed adds the id of the sample to the many-queries as parent_id.
+
+    """
+    def parent(column):
+        if keyed:
+            return column + " AS parent_id, "
+        return ""
+
+    if has_counts():
+        # subsample_count is kept by database/MetPetDB_Counts.sql
+        oneQuery = (
             "SELECT "
                 "samples.sample_id AS id, "
                 "samples.number, "
-                "samples.collection_date, "   
+                "samples.collection_date, "
                 "CASE WHEN samples.public_data = 'Y' THEN TRUE ELSE FALSE END AS public_data, "
                 "samples.country, "
                 "samples.description, "
@@ -34,11 +115,9 @@ class _SampleGetQuery(_DbGetQuery):
                 "owner.name AS owner_name, "
                 "collector.name AS collector_name, "
                 "rock_type.rock_type AS rock_type_name, "
-                "COUNT(subsamples.subsample_id) AS subsamples_count "
-            "FROM (((( "
+                "samples.subsample_count AS subsamples_count "
+            "FROM ((( "
                 "samples "
-                "LEFT OUTER JOIN subsamples "
-                "ON samples.sample_id = subsamples.sample_id ) "
                 "LEFT OUTER JOIN users owner "
                 "ON samples.user_id = owner.user_id ) "
                 "LEFT OUTER JOIN users collector "
@@ -46,96 +125,105 @@ class _SampleGetQuery(_DbGetQuery):
                 "LEFT OUTER JOIN rock_type "
                 "ON samples.rock_type_id = rock_type.rock_type_id ) "
             "WHERE "
-                "samples.sample_id = %(sample_id)s "
-            "GROUP BY "
-                "samples.sample_id, "
-                "samples.number, "
-                "samples.collection_date, "
-                "samples.public_data, "
-                "samples.country, "
-                "samples.description, "
-                "samples.location_text, "
-                "st_y(samples.location), "
-                "st_x(samples.location), "
-                "owner.name, "
-                "collector.name, "
-                "rock_type.rock_type "
+                "samples.sample_id " + match
         )
-                       
-        self.manyQueries = {
-            "aliases": (
-                "SELECT "
-                    "alias AS name "
-                "FROM "
-                    "sample_aliases "
-                "WHERE "
-                    "sample_aliases.sample_id = %(sample_id)s"
-            ),
-            "minerals": (
-                "SELECT "
-                    "name "
-                "FROM "
-                    "minerals, "
-                    "sample_minerals "
-                "WHERE "
-                    "minerals.mineral_id = sample_minerals.mineral_id AND "
-                    "sample_minerals.sample_id = %(sample_id)s"
-            ),
-            "regions": (
-                "SELECT "
-                    "name "
-                "FROM "
-                    "regions, "
-                    "sample_regions "
-                "WHERE "
-                    "regions.region_id = sample_regions.region_id AND "
-                    "sample_regions.sample_id = %(sample_id)s"
-            ),
-            "metamorphic_regions": (
-                "SELECT "
-                    "name "
-                "FROM "
-                    "metamorphic_regions, "
-                    "sample_metamorphic_regions "
-                "WHERE "
-                    "metamorphic_regions.metamorphic_region_id = sample_metamorphic_regions.metamorphic_region_id AND "
-                    "sample_metamorphic_regions.sample_id = %(sample_id)s"
-            ),
-            "metamorphic_grades": (
-                "SELECT "
-                    "name "
-                "FROM "
-                    "metamorphic_grades, "
-                    "sample_metamorphic_grades "
-                "WHERE "
-                    "metamorphic_grades.metamorphic_grade_id = sample_metamorphic_grades.metamorphic_grade_id AND "
-                    "sample_metamorphic_grades.sample_id = %(sample_id)s"
-            ),
-            "references": (
-                "SELECT "
-                    "name "
-                "FROM "
-                    "reference, "
-                    "sample_reference "
-                "WHERE "
-                    "reference.reference_id = sample_reference.reference_id AND "
-                    "sample_id = %(sample_id)s"
-            ),
-            "images": (
-                "SELECT "
-                    "images.filename, "
-                    "images.checksum_64x64, "
-                    "images.checksum_half, "
-                    "images.height, "
-                    "images.width, "
-                    "image_type.image_type "
-                "FROM images, "
-                    "image_type "
-                "WHERE "
-                    "images.image_type_id = image_type.image_type_id AND "
-                    "sample_id = %(sample_id)s"
-            )
-        }
+    else:
+        oneQuery = _countingOneQuery(match)
+
+    manyQueries = {
+        "aliases": (
+            "SELECT "
+                + parent("sample_aliases.sample_id") +
+                "alias AS name "
+            "FROM "
+                "sample_aliases "
+            "WHERE "
+                "sample_aliases.sample_id " + match
+        ),
+        "minerals": (
+            "SELECT "
+                + parent("sample_minerals.sample_id") +
+                "name "
+            "FROM "
+                "minerals, "
+                "sample_minerals "
+            "WHERE "
+                "minerals.mineral_id = sample_minerals.mineral_id AND "
+                "sample_minerals.sample_id " + match
+        ),
+        "regions": (
+            "SELECT "
+                + parent("sample_regions.sample_id") +
+                "name "
+            "FROM "
+                "regions, "
+                "sample_regions "
+            "WHERE "
+                "regions.region_id = sample_regions.region_id AND "
+                "sample_regions.sample_id " + match
+        ),
+        "metamorphic_regions": (
+            "SELECT "
+                + parent("sample_metamorphic_regions.sample_id") +
+                "name "
+            "FROM "
+                "metamorphic_regions, "
+                "sample_metamorphic_regions "
+            "WHERE "
+                "metamorphic_regions.metamorphic_region_id = sample_metamorphic_regions.metamorphic_region_id AND "
+                "sample_metamorphic_regions.sample_id " + match
+        ),
+        "metamorphic_grades": (
+            "SELECT "
+                + parent("sample_metamorphic_grades.sample_id") +
+                "name "
+            "FROM "
+                "metamorphic_grades, "
+                "sample_metamorphic_grades "
+            "WHERE "
+                "metamorphic_grades.metamorphic_grade_id = sample_metamorphic_grades.metamorphic_grade_id AND "
+                "sample_metamorphic_grades.sample_id " + match
+        ),
+        "references": (
+            "SELECT "
+                + parent("sample_reference.sample_id") +
+                "name "
+            "FROM "
+                "reference, "
+                "sample_reference "
+            "WHERE "
+                "reference.reference_id = sample_reference.reference_id AND "
+                "sample_reference.sample_id " + match
+        ),
+        "images": (
+            "SELECT "
+                + parent("images.sample_id") +
+                "images.filename, "
+                "images.checksum_64x64, "
+                "images.checksum_half, "
+                "images.height, "
+                "images.width, "
+                "image_type.image_type "
+            "FROM images, "
+                "image_type "
+            "WHERE "
+                "images.image_type_id = image_type.image_type_id AND "
+                "images.sample_id " + match
+        )
+    }
+
+    return (oneQuery, manyQueries)
+
+       
+class _SampleGetQuery(_DbGetQuery):
+    def __init__(self):
+        (self.oneQuery, self.manyQueries) = _sampleQueries("= %(sample_id)s")
+
+
+class _SampleBatchGetQuery(_DbBatchGetQuery):
+    def __init__(self):
+        (self.oneQuery, self.manyQueries) = _sampleQueries(
+            "= ANY(%(sample_ids)s)", keyed=True)
 
 
 class SampleImagesObject(_DbObject):
@@ -0,0 +1,274 @@
+"""
+   Incremental rebuilds of the Exhibit feeds written to disk.
+
+   A snapshot keeps a state file next to the JSON document holding the
+   signature (row versions) of every exported item and a high-water mark
+   (largest id, row count and a digest of the xmin of the rows) of every
+   *_dup table the feed reads.  On the next update only the items whose
+   signature changed, that disappeared, or that gained *_dup rows above the
+   mark are exported again; the document is patched and replaced
+   atomically.  Anything the marks cannot account for (a missing or
+   unreadable state file, rows deleted from a *_dup table or updated in
+   place, which gives them a new xmin) falls back to the full export.
+
+   Renaming a vocabulary entry (a mineral, region, user...) does not change
+   the version of the rows that use it; pass full=True to rebuild after
+   such edits.
+"""
+import json
+import os
+from collections import OrderedDict
+
+from django.db import connection as con
+from webservices.exhibit import SamplesExport, ChemicalAnalysesExport, \
+    VISIBLE_SAMPLES, VISIBLE_ANALYSES
+
+# *_dup tables holding the lists attached to a sample
+SAMPLE_TABLES = ["sample_metamorphic_regions_dup",
+                 "sample_metamorphic_grades_dup",
+                 "sample_minerals_dup",
+                 "sample_regions_dup",
+                 "sample_reference_dup"]
+# *_dup tables holding the lists attached to an analysis
+ANALYSIS_TABLES = ["chemical_analysis_oxides_dup",
+                   "chemical_analysis_elements_dup"]
+
+
+class _Snapshot(object):
+    """ Keeps the document at path in step with export.  Subclasses give
+        the export class, the signature query and how the *_dup tables map
+        to the items of the feed.
+
+    """
+    export = None
+    # key of the item id in the exported items
+    idKey = None
+    # table name -> column of the table holding the key
+    tables = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.statePath = path + ".state"
+
+    def rows(self, query, params=None):
+        cursor = con.cursor()
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+    def signatures(self):
+        """ Map of item id to signature for every item in the feed. """
+        raise NotImplementedError("Should have implemented this")
+
+    def stamp(self, table, largest):
+        """ Digest of the xmin of the rows of table up to id largest, which
+            changes when one of them is updated or replaced.
+
+        """
+        return self.rows(
+            "SELECT md5(COALESCE(string_agg(xmin::text, ',' ORDER BY id), '')) "
+            "FROM " + table + " WHERE id <= %s", [largest])[0][0]
+
+    def marks(self):
+        marks = {}
+        for table in self.tables:
+            (largest, count) = self.rows(
+                "SELECT COALESCE(MAX(id), 0), COUNT(*) FROM " + table)[0]
+            marks[table] = [largest, count, self.stamp(table, largest)]
+        return marks
+
+    def touched(self, table, mark):
+        """ Keys of the rows added to table after mark, or None when rows
+            were also removed or updated and the changes cannot be told
+            apart.
+
+        """
+        if len(mark) != 3:
+            # state written before the marks had a stamp
+            return None
+        (largest, count, stamp) = mark
+        keys = self.rows(
+            "SELECT " + self.tables[table] + " FROM " + table + " "
+            "WHERE id > %s", [largest])
+        current = self.rows("SELECT COUNT(*) FROM " + table)[0][0]
+        if current != count + len(keys):
+            return None
+        if self.stamp(table, largest) != stamp:
+            return None
+        return set(key for (key,) in keys)
+
+    def changed(self, old, new, marks):
+        """ Ids of the items to export again given the previous signatures
+            and marks, or None for a full rebuild.
+
+        """
+        raise NotImplementedError("Should have implemented this")
+
+    def key(self, item):
+        raise NotImplementedError("Should have implemented this")
+
+    def update(self, full=False):
+        """ Bring the document up to date.  Returns the number of items
+            exported, or None when the whole feed was rebuilt.
+
+        """
+        state = None if full else self.loadState()
+        # Read the signatures before exporting so that anything changed
+        # while the export runs is picked up by the next update.
+        signatures = self.signatures()
+        marks = self.marks()
+        if state is None:
+            return self.rebuild(signatures, marks)
+
+        old = dict((int(id), signature)
+                   for id, signature in state["signatures"].iteritems())
+        changed = self.changed(old, signatures, state["marks"])
+        if changed is None:
+            return self.rebuild(signatures, marks)
+        changed = set(id for id in changed if id in signatures)
+        deleted = set(old) - set(signatures)
+
+        if changed or deleted:
+            fileObj = open(self.path)
+            items = json.load(fileObj, object_pairs_hook=OrderedDict)["items"]
+            fileObj.close()
+            items = [item for item in items
+                     if item[self.idKey] not in changed and
+                        item[self.idKey] not in deleted]
+            if changed:
+                items.extend(self.export(ids=sorted(changed)).items())
+            items.sort(key=self.key)
+            self.write(self.path,
+                       ["{\"items\":", json.dumps(items), "}"])
+        self.saveState(signatures, marks)
+        return len(changed)
+
+    def rebuild(self, signatures, marks):
+        self.write(self.path, self.export().stream())
+        self.saveState(signatures, marks)
+        return None
+
+    def loadState(self):
+        if not (os.path.exists(self.path) and os.path.exists(self.statePath)):
+            return None
+        try:
+            fileObj = open(self.statePath)
+            try:
+                return json.load(fileObj)
+            finally:
+                fileObj.close()
+        except ValueError:
+            return None
+
+    def saveState(self, signatures, marks):
+        self.write(self.statePath,
+                   [json.dumps({"signatures": signatures, "marks": marks})])
+
+    def write(self, path, fragments):
+        """ Write fragments to a temporary file and move it over path so
+            readers never see a partial document.
+
+        """
+        temporary = path + ".tmp"
+        fileObj = open(temporary, 'w')
+        try:
+            for fragment in fragments:
+                fileObj.write(fragment)
+        finally:
+            fileObj.close()
+        os.rename(temporary, path)
+
+
+class SamplesSnapshot(_Snapshot):
+    """ Snapshot of web/samples/samples.json. """
+    export = SamplesExport
+    idKey = "sample_id"
+    tables = dict((table, "sample_id") for table in SAMPLE_TABLES)
+
+    def signatures(self):
+        rows = self.rows(
+            "SELECT "
+                "samples.sample_id, "
+                "samples.version "
+            "FROM "
+                "samples "
+            "WHERE "
+                + VISIBLE_SAMPLES
+        )
+        return dict((sample_id, version) for (sample_id, version) in rows)
+
+    def changed(self, old, new, marks):
+        changed = set(id for id in new if old.get(id) != new[id])
+        for table in self.tables:
+            if table not in marks:
+                return None
+            touched = self.touched(table, marks[table])
+            if touched is None:
+                return None
+            changed |= touched
+        return changed
+
+    def key(self, item):
+        return item["sample_id"]
+
+
+class ChemicalAnalysesSnapshot(_Snapshot):
+    """ Snapshot of web/chemical_analyses/chemical_analyses.json.  Every
+        item repeats the lists of its sample, so a change to a sample
+        exports all of its analyses again.
+
+    """
+    export = ChemicalAnalysesExport
+    idKey = "chemical_analysis_id"
+    tables = dict([(table, "sample_id") for table in SAMPLE_TABLES] +
+                  [(table, "chemical_analysis_id")
+                   for table in ANALYSIS_TABLES])
+
+    def signatures(self):
+        rows = self.rows(
+            "SELECT "
+                "ca.chemical_analysis_id, "
+                "samples.sample_id, "
+                "ca.subsample_id, "
+                "ca.version, "
+                "subsamples.version, "
+                "samples.version "
+            "FROM "
+                "chemical_analyses ca, "
+                "subsamples, "
+                "samples "
+            "WHERE "
+                "ca.subsample_id = subsamples.subsample_id AND "
+                "subsamples.sample_id = samples.sample_id AND "
+                + VISIBLE_ANALYSES
+        )
+        return dict((row[0], list(row[1:])) for row in rows)
+
+    def changed(self, old, new, marks):
+        changed = set(id for id in new if old.get(id) != new[id])
+        samples = set()
+        # the *_dup tables also hold the rows of analyses left out of the
+        # feed, which have no signature
+        known = set(old) | set(new)
+        for table in self.tables:
+            if table not in marks:
+                return None
+            touched = self.touched(table, marks[table])
+            if touched is None:
+                return None
+            if table in SAMPLE_TABLES:
+                samples |= touched
+            else:
+                changed |= touched & known
+        # chemical_analysis_count counts the analyses whose subsample_id
+        # equals the sample id, so adding or removing an analysis changes
+        # the items of the sample with that id as well.
+        for id in changed | (set(old) ^ set(new)):
+            signature = new.get(id) or old[id]
+            samples.add(signature[0])
+            samples.add(signature[1])
+        changed |= set(id for id, signature in new.iteritems()
+                       if signature[0] in samples)
+        return changed
+
+    def key(self, item):
+        return (item["sample_id"], item["chemical_analysis_id"])
@@ -1,4 +1,67 @@
 from webservices.db import _DbObject, _DbGetQuery
+from webservices.util import has_counts
+
+
+def _subsampleQuery(condition):
+    """ Query of the subsamples matching condition, with their counts of
+        chemical analyses and images.
+
+    """
+    if has_counts():
+        # counters kept by database/MetPetDB_Counts.sql
+        return (
+            "SELECT "
+                "subsamples.subsample_id AS id, "
+                "subsamples.name, "
+                "subsamples.public_data AS public, "
+                "subsample_type.subsample_type AS type, "
+                "users.name AS owner_name, "
+                "subsamples.chemical_analysis_count, "
+                "subsamples.image_count "
+            "FROM ( "
+                "subsamples "
+                "LEFT OUTER JOIN users "
+                "ON subsamples.user_id = users.user_id ) "
+                "LEFT OUTER JOIN subsample_type "
+                "ON subsamples.subsample_type_id = subsample_type.subsample_type_id "
+            "WHERE "
+                + condition
+        )
+
+    return (
+        "SELECT "
+            "subsamples.subsample_id AS id, "
+            "subsamples.name, "
+            "subsamples.public_data AS public, "
+            "subsample_type.subsample_type AS type, "
+            "users.name AS owner_name, "
+            "COUNT(chemical_analyses.chemical_analysis_id) AS chemical_analysis_count, "
+            "("
+                "SELECT "
+                    "COUNT(*) "
+                "FROM "
+                    "images "
+                "WHERE "
+                    "images.subsample_id = subsamples.subsample_id"
+            ") AS image_count "
+        "FROM (( "
+            "subsamples "
+            "LEFT OUTER JOIN users "
+            "ON subsamples.user_id = users.user_id ) "
+            "LEFT OUTER JOIN subsample_type "
+            "ON subsamples.subsample_type_id = subsample_type.subsample_type_id ) "
+            "LEFT OUTER JOIN chemical_analyses "
+            "ON subsamples.subsample_id = chemical_analyses.subsample_id "
+        "WHERE "
+            + condition + " "
+        "GROUP BY "
+            "subsamples.subsample_id, "
+            "subsamples.name, "
+            "subsamples.public_data, "
+            "subsample_type.subsample_type, "
+            "users.name"
+    )
+
 
 # http://127.0.0.1:8000/api/subsample/1216/
 class SubsampleObject(_DbObject):
@@ -16,39 +79,8 @@ class SubsampleObject(_DbObject):
         
 class _SubsampleGetQuery(_DbGetQuery):
     def __init__(self):
-        self.oneQuery = (
-                "SELECT "
-                    "subsamples.subsample_id AS id, "
-                    "subsamples.name, "
-                    "subsamples.public_data AS public, "
-                    "subsample_type.subsample_type AS type, "
-                    "users.name AS owner_name, "
-                    "COUNT(chemical_analyses.chemical_analysis_id) AS chemical_analysis_count, "
-                    "("
-                        "SELECT "
-                            "COUNT(*) "
-                        "FROM "
-                            "images "
-                        "WHERE "
-                            "images.subsample_id = subsamples.subsample_id"
-                    ") AS image_count "
-                "FROM (( "
-                    "subsamples "
-                    "LEFT OUTER JOIN users "
-                    "ON subsamples.user_id = users.user_id ) "
-                    "LEFT OUTER JOIN subsample_type "
-                    "ON subsamples.subsample_type_id = subsample_type.subsample_type_id ) "
-                    "LEFT OUTER JOIN chemical_analyses "
-                    "ON subsamples.subsample_id = chemical_analyses.subsample_id "
-                "WHERE "
-                    "subsamples.subsample_id = %(subsample_id)s "
-                "GROUP BY "
-                    "subsamples.subsample_id, "
-                    "subsamples.name, "
-                    "subsamples.public_data, "
-                    "subsample_type.subsample_type, "
-                    "users.name"
-            )
+        self.oneQuery = _subsampleQuery(
+            "subsamples.subsample_id = %(subsample_id)s")
 
         
 # This is displayed on the side of the subsamples page view
@@ -105,37 +137,5 @@ class SubsampleTableObject(_DbObject):
 class _SubsampleTableGetQuery(_DbGetQuery):
     def __init__(self):
         self.manyQueries = {
-            "*": (
-                "SELECT "
-                    "subsamples.subsample_id AS id, "
-                    "subsamples.name, "
-                    "subsamples.public_data AS public, "
-                    "subsample_type.subsample_type AS type, "
-                    "users.name AS owner_name, "
-                    "COUNT(chemical_analyses.chemical_analysis_id) AS chemical_analysis_count, "
-                    "("
-                        "SELECT "
-                            "COUNT(*) "
-                        "FROM "
-                            "images "
-                        "WHERE "
-                            "images.subsample_id = subsamples.subsample_id"
-                    ") AS image_count "
-                "FROM (( "
-                    "subsamples "
-                    "LEFT OUTER JOIN users "
-                    "ON subsamples.user_id = users.user_id ) "
-                    "LEFT OUTER JOIN subsample_type "
-                    "ON subsamples.subsample_type_id = subsample_type.subsample_type_id ) "
-                    "LEFT OUTER JOIN chemical_analyses "
-                    "ON subsamples.subsample_id = chemical_analyses.subsample_id "
-                "WHERE "
-                    "subsamples.sample_id = %(sample_id)s "
-                "GROUP BY "
-                    "subsamples.subsample_id, "
-                    "subsamples.name, "
-                    "subsamples.public_data, "
-                    "subsample_type.subsample_type, "
-                    "users.name"
-                )
+            "*": _subsampleQuery("subsamples.sample_id = %(sample_id)s")
             }
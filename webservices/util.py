@@ -1,5 +1,21 @@
 import json
 import datetime
+import hashlib
+import re
+from django.db import connection as con
+
+# %(name)s placeholders of a query
+PARAMETER = re.compile(r"%\((\w+)\)s")
+
+# whether database/MetPetDB_Counts.sql has been run, looked up once per
+# process
+counted = None
+# whether database/MetPetDB_Sample_Results.sql has been run, looked up
+# once per process
+materialized = None
+# whether database/MetPetDB_Page_Versions.sql has been run, looked up
+# once per process
+page_versioned = None
 
 class CustomJSONEncoder(json.JSONEncoder):
     """ http://stackoverflow.com/questions/455580/ """
@@ -36,3 +52,89 @@ def dictfetchone(cursor):
     	return dict(zip([col[0] for col in desc], row)) # unicode() ?
 
     return {"error": "DNE"}
+
+
+def has_counts():
+    """ Whether samples and subsamples carry the counters kept by the
+        triggers of database/MetPetDB_Counts.sql.
+
+    """
+    global counted
+    if counted is None:
+        cursor = con.cursor()
+        columns = con.introspection.get_table_description(cursor, 'subsamples')
+        counted = 'image_count' in [column[0] for column in columns]
+    return counted
+
+
+def has_materialized_results():
+    """ Whether the full_sample_results_mat table of
+        database/MetPetDB_Sample_Results.sql exists.
+
+    """
+    global materialized
+    if materialized is None:
+        materialized = \
+            'full_sample_results_mat' in con.introspection.table_names()
+    return materialized
+
+
+def has_page_versions():
+    """ Whether samples, subsamples and chemical_analyses carry the
+        page_version column of database/MetPetDB_Page_Versions.sql.
+
+    """
+    global page_versioned
+    if page_versioned is None:
+        cursor = con.cursor()
+        columns = con.introspection.get_table_description(cursor,
+                                                          'chemical_analyses')
+        page_versioned = 'page_version' in [column[0] for column in columns]
+    return page_versioned
+
+
+def execute_prepared(cursor, query, params):
+    """ Executes query, with %(name)s placeholders filled from the
+        dictionary params, as a prepared statement. The statement is
+        prepared, in the same round trip as its first execution, the
+        first time its text is seen on a connection; later executions
+        on that connection reuse its plan. Django opens a new connection
+        after closing one, and the statements are prepared again there.
+    """
+
+    if con.vendor != 'postgresql':
+        cursor.execute(query, params)
+        return
+
+    names = []
+    def number(match):
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return "$%d" % (names.index(match.group(1)) + 1)
+    statement = PARAMETER.sub(number, query)
+    name = "prepared_" + hashlib.md5(statement.encode('utf-8')).hexdigest()
+    execute = "EXECUTE " + name
+    if names:
+        execute += " (" + ", ".join(["%s"] * len(names)) + ")"
+    values = [params[key] for key in names]
+
+    # statement name -> whether it is prepared, for the connection the
+    # statements were prepared on; False when a first execution failed
+    # and may or may not have left it prepared
+    prepared = getattr(con, 'prepared_statements', None)
+    if prepared is None or prepared[0] is not con.connection:
+        prepared = (con.connection, {})
+        con.prepared_statements = prepared
+    statements = prepared[1]
+
+    if statements.get(name) is False:
+        cursor.execute("SELECT COUNT(*) FROM pg_prepared_statements "
+                       "WHERE name = %s", [name])
+        statements[name] = cursor.fetchone()[0] > 0
+    if statements.get(name):
+        cursor.execute(execute, values)
+        return
+    statements[name] = False
+    cursor.execute("PREPARE " + name + " AS " + statement + "; " + execute,
+                   values)
+    statements[name] = True
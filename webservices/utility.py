@@ -1,32 +1,53 @@
 from django.db import connection as con
+from webservices.util import execute_prepared
 import json
 
+#formatted oxides by species, the set of species is small and fixed
+oxideCache={}
 
-#creates JSON for facets
-def getFacetJSON(query):
+
+#creates the JSON values of a facet row: id, label and count
+def getFacetValue(row):
+        dataId=unicode(row[0])
+        dataLabel=unicode(row[1])
+        if dataLabel=='':
+                dataLabel='Missing Value'
+        dataCount=unicode(row[2])
+        jsonValues={}
+        jsonValues['id']=dataId
+        jsonValues['label']=dataLabel
+        jsonValues['count']=dataCount
+        return jsonValues
+
+#creates the list of facet values, each with its id, label and count
+def getFacetData(query, params=None):
         cursor=con.cursor()
-        print query
-        cursor.execute(query)
+        execute_prepared(cursor, query, params)
         data=cursor.fetchall()
         jsonData=[]
         for row in data:
-                dataId=unicode(row[0])
-                dataLabel=unicode(row[1])
-		if dataLabel=='':
-			dataLabel='Missing Value'
-                dataCount=unicode(row[2])
-                jsonValues={}
-                jsonValues['id']=dataId
-                jsonValues['label']=dataLabel
-                jsonValues['count']=dataCount
-                jsonData.append(jsonValues)
-        return json.dumps(jsonData)
+                jsonData.append(getFacetValue(row))
+        return jsonData
+
+#creates the lists of values of several facets from rows starting with the facet name
+def getAllFacetData(query, params=None):
+        cursor=con.cursor()
+        execute_prepared(cursor, query, params)
+        data=cursor.fetchall()
+        jsonData={}
+        for row in data:
+                jsonData.setdefault(row[0],[]).append(getFacetValue(row[1:]))
+        return jsonData
+
+#creates JSON for facets
+def getFacetJSON(query, params=None):
+        return json.dumps(getFacetData(query, params))
 
 
 #creates JSON array for all data
-def getAllJSON(query):
+def getAllJSON(query, params=None):
         cursor=con.cursor()
-        cursor.execute(query)
+        execute_prepared(cursor, query, params)
         data=cursor.fetchall()
         resultSetSize=len(data)
         jsonData=[]
@@ -56,11 +77,18 @@ def getAllJSON(query):
                
         return json.dumps(jsonData)
 
-#create HTML table output for results (This is currently a hack. Code must be cleaned to generate HTML when format=HTML)
-def getSampleResults(query):
+#fetches the rows of a query
+def getRows(query, params=None):
         cursor=con.cursor()
-        cursor.execute(query)
-        data=cursor.fetchall()
+        execute_prepared(cursor, query, params)
+        return cursor.fetchall()
+
+#create HTML table output for results (This is currently a hack. Code must be cleaned to generate HTML when format=HTML)
+def getSampleResults(query, params=None):
+        return formatSampleResults(getRows(query, params))
+
+#create HTML table output for rows of SampleQuery.get_main
+def formatSampleResults(data):
         resultSetSize=len(data)
         htmlData="<table id='gridData'><thead><tr><th>Sample Number</th><th>Subsamples</th><th>Analyses</th><th>Images</th></tr></thead><tbody>"
         i=0
@@ -72,3 +100,18 @@ def getSampleResults(query):
         return htmlData
 
 
+
+#Function to format oxides by subscripting digits
+def formatOxide(species):
+        if species in oxideCache:
+                return oxideCache[species]
+        retStr=""
+        i=0
+        while(i<len(species)):
+                if species[i].isdigit():
+                        retStr+='<sub>'+species[i]+'</sub>'
+                else:
+                        retStr+=species[i]
+                i+=1
+        oxideCache[species]=retStr
+        return retStr
@@ -1,17 +1,37 @@
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest
+try:
+	from django.http import StreamingHttpResponse
+	#the middlewares of Django >= 1.5 leave streaming responses streaming
+	BUFFERING_MIDDLEWARE = ()
+except ImportError:
+	#Django < 1.5 streams any iterator passed to HttpResponse, as long as no
+	#middleware reads response.content: that runs the whole generator first
+	StreamingHttpResponse = HttpResponse
+	BUFFERING_MIDDLEWARE = ('django.middleware.gzip.GZipMiddleware',
+		'django.middleware.http.ConditionalGetMiddleware')
 import json
 import sys
 from django.shortcuts import render
+from django.conf import settings
 from django.db import connection as con
 from webservices.SampleQuery import *
 from webservices.utility import *
 from webservices.sample import SampleObject, SampleImagesObject
 from webservices.subsample import SubsampleObject, SubsampleTableObject, SubsampleImagesTableObject
 from webservices.chemicalanalysis import ChemicalAnalysisObject, ChemicalAnalysisTableObject
+from webservices.exhibit import SamplesExport, ChemicalAnalysesExport
+from webservices.facetcache import FACETS
+from webservices.facetindex import get_facets, get_count, get_sample_ids
+from tastyapi.paginator import encode_cursor, decode_cursor
+from tastyapi.models import RockType, Mineral, Region, MetamorphicGrade, MetamorphicRegion
+from tastyapi.vocabulary import get_ids
 
 #direct stdout to stderr so that it is logged by the webserver
 sys.stdout = sys.stderr
 
+#samples listed per page of search results
+PAGE_SIZE=500
+
 
 #Main interface view
 def index(request):
@@ -104,6 +124,9 @@ def metpetdb(request):
 	metamorphic_region_id=request.GET.get('metamorphic_region_id','')
 	
 	publication_id= request.GET.get('publication_id','')
+
+	#opaque cursor from the nextCursor element of the previous page of results
+	cursor=request.GET.get('cursor','')
 	
 	if rocktype_id!='':
 		rocktype_id_list=rocktype_id.split(',')
@@ -145,291 +168,75 @@ def metpetdb(request):
 	else:
 		publication_id_list=[]
 
-	
+
+	#vocabulary names may be given in place of ids, resolved through the vocabulary cache
+	for (parameter, model, id_list) in [('rocktype', RockType, rocktype_id_list), ('mineral', Mineral, mineral_id_list), ('region', Region, region_id_list), ('metamorphic_grade', MetamorphicGrade, metamorphic_grade_id_list), ('metamorphic_region', MetamorphicRegion, metamorphic_region_id_list)]:
+		names=request.GET.get(parameter,'')
+		if names!='':
+			names=names.split(',')
+			ids=get_ids(model, names)
+			unknown=[name for name in names if name not in ids]
+			if unknown:
+				return HttpResponseBadRequest("Unknown "+parameter+": "+", ".join(unknown))
+			id_list.extend(ids[name] for name in names)
+
 	samples=SampleQuery(rock_type=rocktype_id_list,country=country_list,owner_id=owner_id_list,mineral_id=mineral_id_list,region_id=region_id_list,metamorphic_grade_id=metamorphic_grade_id_list, metamorphic_region_id=metamorphic_region_id_list, publication_id=publication_id_list)
 	#sample_test = SampleQuery(rock_type=[3,], country=[], owner_id=[139,], mineral_id=[3,], region_id=[52,], metamorphic_grade_id=[17,], metamorphic_region_id=[], publication_id=[])
-	if returntype=='rocktype_facet':
-		return HttpResponse(getFacetJSON(samples.rock_type_facet()), content_type="application/json")
-	elif returntype=='country_facet':
-		return HttpResponse(getFacetJSON(samples.country_facet()), content_type="application/json")
-	elif returntype=='mineral_facet':
-		return HttpResponse(getFacetJSON(samples.mineral_facet()), content_type="application/json")
-	elif returntype=='region_facet':
-		return HttpResponse(getFacetJSON(samples.region_facet()), content_type="application/json")
-	elif returntype=='owner_facet':
-		return HttpResponse(getFacetJSON(samples.owner_facet()), content_type="application/json")
-	elif returntype=='metamorphicgrade_facet':
-		return HttpResponse(getFacetJSON(samples.metamorphic_grade_facet()), content_type="application/json")
-	elif returntype=='metamorphicregion_facet':
-		return HttpResponse(getFacetJSON(samples.metamorphic_region_facet()), content_type="application/json")
-	elif returntype== 'publication_facet':
-		return HttpResponse(getFacetJSON(samples.publication_facet()), content_type="application/json")
+	try:
+		samples.get_where()
+	except ValueError:
+		return HttpResponseBadRequest("Ids must be integers")
+	try:
+		after=decode_cursor(cursor)
+	except ValueError:
+		return HttpResponseBadRequest("Invalid cursor")
+
+	if returntype in dict(FACETS):
+		#all facets of a selection are computed and cached together, or read from the facet index
+		return HttpResponse(json.dumps(get_facets(samples)[returntype]), content_type="application/json")
+	elif returntype=='all_facets':
+		#every facet in one payload, by the returntype of each facet
+		return HttpResponse(json.dumps(get_facets(samples)), content_type="application/json")
 	elif returntype=='map':
 		#q=test.get_main_brief()
-		return HttpResponse(getAllJSON(samples.get_main_brief()), content_type="application/json")
+		return HttpResponse(getAllJSON(*samples.get_main_brief()), content_type="application/json")
 	else:
-		cursor=con.cursor()
-        cursor.execute(samples.get_count())
-        sample_count=cursor.fetchall()
-        #this is currently a hack to pass a html element containing the sample_count
-        htmlCount="<div id='sampleCount' display:'none'>"+str(sample_count[0][0])+"</div>"
-        print htmlCount
-        if sample_count>500:
-        	return HttpResponse(getSampleResults(samples.get_main(500))+htmlCount)
-        else:
-        	return HttpResponse(getSampleResults(samples.get_main(500)))
-
-#Not sure if below is used for anything right now
-#Function to format oxides by subscripting digits
-def formatOxide(species):
-        retStr=""
-        i=0
-        while(i<len(species)):
-                if species[i].isdigit():
-                        retStr+='<sub>'+species[i]+'</sub>'
-                else:
-                        retStr+=species[i]
-                i+=1
-        return retStr
-
-
+		sample_count=get_count(samples)
+		#this is currently a hack to pass a html element containing the sample_count, search.html reads it for every result set
+		htmlCount="<div id='sampleCount' display:'none'>"+str(sample_count)+"</div>"
+		print htmlCount
+		sample_ids=get_sample_ids(samples, PAGE_SIZE, after)
+		if sample_ids is None:
+			data=getRows(*samples.get_main(PAGE_SIZE, after))
+		else:
+			#the facet index found the samples of the page, only their rows are read
+			data=getRows(*samples.get_main(sample_ids=sample_ids))
+		#a full page may be followed by another one, starting after its last sample
+		if len(data)==PAGE_SIZE:
+			htmlCount+="<div id='nextCursor' display:'none'>"+encode_cursor(data[-1][0])+"</div>"
+		return HttpResponse(formatSampleResults(data)+htmlCount)
+
+#Whether request asks for a streamed feed and the middlewares let it through.
+#On Django < 1.5 GZipMiddleware, ConditionalGetMiddleware and the ETags of
+#CommonMiddleware (USE_ETAGS) read the whole body, so the feed is built in
+#memory then, as without stream=1.
+def streamed(request):
+	if not request.GET.get('stream',''):
+		return False
+	if not BUFFERING_MIDDLEWARE:
+		return True
+	middleware = settings.MIDDLEWARE_CLASSES
+	if settings.USE_ETAGS and 'django.middleware.common.CommonMiddleware' in middleware:
+		return False
+	return not [name for name in BUFFERING_MIDDLEWARE if name in middleware]
+
+#Exhibit feeds, pass stream=1 to send the document as it is generated
 def samples(request):
-	samples_data=[]
-	samples=Samples.objects.filter(public_data='Y')|Samples.objects.filter(user_id='139')
-	i=0
-	for sample in samples:
-		#initialize the variables
-		sample_data={}
-		sample_latlon=""
-		sample_number=""
-		sample_metamorphic_regions=[]
-        	sample_country=""
-        	sample_owner=""
-        	sample_rock_type=""
-        	sample_metamorphic_grades=[]
-		sample_minerals=[]
-		sample_regions=[]
-		sample_reference_first_authors=[]
-		sample_reference_journal_names=[]
-		sample_reference_publication_years=[]
-		sample_number_link=""
-		sample_id=""
-
-		#get sample id
-		sample_id=sample.sample_id
-		
-		#get sample metamorphic regions
-		samplemetamorphicregions=sample.samplemetamorphicregionsdup_set.all()
-		for samplemetamorphicregion in samplemetamorphicregions:
-			sample_metamorphic_regions.append(samplemetamorphicregion.metamorphic_region.name)
-		
-		#get lat lon from location
-		
-		sample_location_x=Samples.objects.raw('select sample_id,st_X(location) as geo from samples where sample_id='+str(sample.sample_id))[0].geo
-		sample_location_y=Samples.objects.raw('select sample_id,st_Y(location) as geo from samples where sample_id='+str(sample.sample_id))[0].geo
-		sample_latlon=str(sample_location_y)+","+str(sample_location_x)
-		
-		'''
-		sample_latlon=Samples.objects.raw('select sample_id,substr(ST_asText(location), 7) as geo from samples where sample_id='+str(sample.sample_id))[0].geo
-		sample_latlon=sample_latlon.rstrip(')')
-		sample_latlon=sample_latlon.replace(' ',',')		
-		'''
-		
-		#get sample number
-		sample_number=sample.number
-
-		#get sample country
-		sample_country=sample.country
-		
-		#get sample owner
-		sample_owner=sample.user.name
-
-		#get sample rock type
-		sample_rock_type=sample.rock_type.rock_type
-
-		#get sample metamorphic grades
-		samplemetamorphicgrades=sample.samplemetamorphicgradesdup_set.all()
-		for samplemetamorphicgrade in samplemetamorphicgrades:
-			sample_metamorphic_grades.append(samplemetamorphicgrade.metamorphic_grade.name)
-		
-		#get sample minerals
-		sampleminerals=sample.samplemineralsdup_set.all()
-		for samplemineral in sampleminerals:
-			sample_minerals.append(samplemineral.mineral.name)
-
-		#get sample regions
-		sampleregions=sample.sampleregionsdup_set.all()
-		for sampleregion in sampleregions:
-			sample_regions.append(sampleregion.region.name)
-
-		#get sample references
-		samplereferences=sample.samplereferencedup_set.all()
-		for samplereference in samplereferences:
-			referencenumber=samplereference.reference.name
-			georeferences=Georeference.objects.filter(reference_number=str(referencenumber))
-			for georeference in georeferences:
-				sample_reference_first_authors.append(georeference.first_author)
-				sample_reference_journal_names.append(georeference.journal_name_2)
-				sample_reference_publication_years.append(georeference.publication_year)
-	
-		#url to metpetdb
-                sample_link='http://metpetdb.rpi.edu/metpetweb/#sample/'+str(sample_id)
-		
-		sample_data["sample_id"]=sample_id
-		sample_data["label"]=sample_number
-		sample_data['sample_link']=sample_link
-		sample_data["sample_metamorphic_regions"]=sample_metamorphic_regions
-		sample_data["sample_country"]=sample_country
-		sample_data["sample_owner"]=sample_owner
-		sample_data["sample_rock_type"]=sample_rock_type
-		sample_data["sample_metamorphic_grades"]=sample_metamorphic_grades
-		sample_data["sample_minerals"]=sample_minerals
-		sample_data["sample_regions"]=sample_regions
-		sample_data["sample_reference_first_authors"]=sample_reference_first_authors
-		sample_data["sample_reference_journal_names"]=sample_reference_journal_names
-		sample_data['sample_reference_publication_years']=sample_reference_publication_years
-		sample_data["sample_latlon"]=sample_latlon
-		samples_data.append(sample_data)
-		
-	return HttpResponse("{\"items\":"+json.dumps(samples_data)+"}")
+	if streamed(request):
+		return StreamingHttpResponse(SamplesExport().stream())
+	return HttpResponse(SamplesExport().json())
 
 def chemical_analyses(request):
-	from django.db import connection
-	chemical_analyses_data=[]
-	#chemical_analyses=ChemicalAnalyses.objects.filter(public_data='Y')|ChemicalAnalyses.objects.filter(user_id='139')
-	
-	chemical_analyses=ChemicalAnalyses.objects.raw("select * from chemical_analyses where (public_data='Y' or user_id='139') and (large_rock='Y' or mineral_id is not null)");
-
-	id=0
-	i=0
-	for chemical_analysis in chemical_analyses:
-		chemical_analysis_data={}
-		chemical_analysis_id=""
-		chemical_analysis_large_rock=""
-		chemical_analysis_count=""
-		chemical_analysis_mineral_name=""
-		chemical_analysis_owner=""
-		chemical_analysis_rock_type=""
-		chemical_analysis_metamorphic_grade=[]
-		chemical_analysis_metamorphic_regions=[]
-		chemical_analysis_method=""
-		chemical_analysis_first_authors=[]
-		chemical_analysis_publication_journal_names=[]
-		chemical_analysis_publication_years=[]
-		chemical_analysis_total_weight=""
-		chemical_analysis_elements=[]
-		chemical_analysis_oxides=[]
-		chemical_analysis_latlon=""
-		chemical_analysis_sample_number=""
-		chemical_analysis_sample_id=""
-		sample_minerals=[]
-
-		#get chemical analysis id
-		chemical_analysis_id=chemical_analysis.chemical_analysis_id
-
-		#get chemical analysis sample id
-                chemical_analysis_sample_id=chemical_analysis.subsample.sample.sample_id
-
-		#get chemical analyses count
-	        cursor=con.cursor()
-        	cursor.execute('select count(chemical_analysis_id) from chemical_analyses where subsample_id='+str(chemical_analysis_sample_id))
-        	row=cursor.fetchone()
-		chemical_analysis_count=row[0]
-		
-		#get lat lon from location
-                sample_location_x=Samples.objects.raw('select sample_id,st_X(location) as geo from samples where sample_id='+str(chemical_analysis_sample_id))[0].geo
-                sample_location_y=Samples.objects.raw('select sample_id,st_Y(location) as geo from samples where sample_id='+str(chemical_analysis_sample_id))[0].geo
-                chemical_analysis_latlon=str(sample_location_y)+","+str(sample_location_x)
-
-		#get chemical analysis large rock
-		chemical_analysis_large_rock=chemical_analysis.large_rock
-		
-		#get chemical analysis mineral name
-		if chemical_analysis_large_rock=='Y' and chemical_analysis.mineral==None:
-			chemical_analysis_mineral_name='Bulk Rock'
-		elif chemical_analysis_large_rock=='N' and chemical_analysis.mineral!=None:
-			chemical_analysis_mineral_name=chemical_analysis.mineral.name
-		elif chemical_analysis_large_rock=='N' and chemical_analysis.mineral==None:
-			chemical_analysis_mineral_name=None
-
-		#get chemical analysis method
-		chemical_analysis_method=chemical_analysis.analysis_method
-
-		#get chemical analysis owner
-		chemical_analysis_owner=chemical_analysis.user.name
-
-		#get chemical analysis total weight
-		chemical_analysis_total_weight=chemical_analysis.total
-
-		#get chemical analysis oxides
-		chemicalanalysisoxides=chemical_analysis.chemicalanalysisoxidesdup_set.all()
-		for chemicalanalysisoxide in chemicalanalysisoxides:
-			chemical_analysis_oxides.append(formatOxide(str(chemicalanalysisoxide.oxide.species)))
-		
-		#get chemical analysis elements
-		chemicalanalysiselements=chemical_analysis.chemicalanalysiselementsdup_set.all()
-		for chemicalanalysiselement in chemicalanalysiselements:
-			chemical_analysis_elements.append(chemicalanalysiselement.element.name)
-
-		#get chemical analysis rock type
-		chemical_analysis_rock_type=chemical_analysis.subsample.sample.rock_type.rock_type
-		
-		#get chemical analysis metamorphic grade
-		samplemetamorphicgrades=chemical_analysis.subsample.sample.samplemetamorphicgradesdup_set.all()
-		for samplemetamorphicgrade in samplemetamorphicgrades:
-			chemical_analysis_metamorphic_grade.append(samplemetamorphicgrade.metamorphic_grade.name)
-		#get chemical analysis metamorphic regions
-                samplemetamorphicregions=chemical_analysis.subsample.sample.samplemetamorphicregionsdup_set.all()
-                for samplemetamorphicregion in samplemetamorphicregions:
-                        chemical_analysis_metamorphic_regions.append(samplemetamorphicregion.metamorphic_region.name)
-			
-		#get chemical analysis references
-		chemicalreferences=chemical_analysis.subsample.sample.samplereferencedup_set.all()
-		for chemicalreference in chemicalreferences:
-			referencenumber=chemicalreference.reference.name
-			georeferences=Georeference.objects.filter(reference_number=str(referencenumber))
-			for georeference in georeferences:
-				chemical_analysis_first_authors.append(georeference.first_author)
-				chemical_analysis_publication_journal_names.append(georeference.journal_name_2)
-				chemical_analysis_publication_years.append(georeference.publication_year)
-		
-		#get chemical analysis sample number
-		chemical_analysis_sample_number=chemical_analysis.subsample.sample.number
-
-		#get sample minerals
-		sampleminerals=SampleMineralsDup.objects.raw('select * from sample_minerals_dup where sample_id='+str(chemical_analysis_sample_id))
-		for samplemineral in sampleminerals:
-                        sample_minerals.append(samplemineral.mineral.name)
-
-
-		#url to metpetdb
-		chemical_analysis_link="http://metpetdb.rpi.edu/metpetweb/#sample/"+str(chemical_analysis_sample_id)
-
-		chemical_analysis_data['chemical_analysis_id']=chemical_analysis_id
-		chemical_analysis_data['sample_id']=chemical_analysis_sample_id
-		chemical_analysis_data['label']=chemical_analysis_sample_number
-		chemical_analysis_data['chemical_analysis_link']=chemical_analysis_link
-		chemical_analysis_data['chemical_analysis_count']=chemical_analysis_count
-		chemical_analysis_data['chemical_analysis_latlon']=chemical_analysis_latlon
-		chemical_analysis_data['chemical_analysis_large_rock']=chemical_analysis_large_rock
-		chemical_analysis_data['chemical_analysis_mineral_name']=chemical_analysis_mineral_name
-		chemical_analysis_data['chemical_analysis_method']=chemical_analysis_method
-		chemical_analysis_data['chemical_analysis_owner']=chemical_analysis_owner
-		chemical_analysis_data['chemical_analysis_total_weight']=chemical_analysis_total_weight
-		chemical_analysis_data['chemical_analysis_oxides']=chemical_analysis_oxides
-		chemical_analysis_data['chemical_analysis_elements']=chemical_analysis_elements
-		chemical_analysis_data['chemical_analysis_rock_type']=chemical_analysis_rock_type
-		chemical_analysis_data['chemical_analysis_metamorphic_grade']=chemical_analysis_metamorphic_grade
-		chemical_analysis_data['chemical_analysis_metamorphic_regions']=chemical_analysis_metamorphic_regions
-		chemical_analysis_data['chemical_analysis_first_authors']=chemical_analysis_first_authors
-		chemical_analysis_data['chemical_analysis_publication_journal_names']=chemical_analysis_publication_journal_names
-		chemical_analysis_data['chemical_analysis_publication_years']=chemical_analysis_publication_years
-		chemical_analysis_data['chemical_analysis_sample_minerals']=sample_minerals
-		chemical_analyses_data.append(chemical_analysis_data)
-
-	return HttpResponse("{\"items\":"+json.dumps(chemical_analyses_data)+"}")
-
-
-
-	
-			
+	if streamed(request):
+		return StreamingHttpResponse(ChemicalAnalysesExport().stream())
+	return HttpResponse(ChemicalAnalysesExport().json())